@@ -0,0 +1,52 @@
+"""
+Async request path (EDUSHARE_DB_ASYNC=1).
+
+Handlers decorated with @db_endpoint are written once, against a plain
+Session. In async mode the decorator turns them into coroutines: the
+request gets an AsyncSession, and the handler body runs through
+AsyncSession.run_sync, i.e. in a greenlet on the event loop whose database
+calls await the async driver. No threadpool slot is held while the database
+works. Only handlers without blocking file I/O are decorated; uploads keep
+running in the threadpool in both modes.
+"""
+import inspect
+
+from fastapi import Depends
+from fastapi.params import Depends as DependsParam
+
+from .db import get_async_db, get_async_read_db, get_db, get_read_db
+from .shares import share_context, share_context_async
+from . import settings
+
+# sync dependency -> its async-mode replacement
+ASYNC_DEPENDENCIES = {
+    get_db: get_async_db,
+    get_read_db: get_async_read_db,
+    share_context: share_context_async,
+}
+
+
+def db_endpoint(handler):
+    """Serve `handler` as a coroutine on the async engine when async mode is on."""
+    if not settings.DB_ASYNC:
+        return handler
+
+    sig = inspect.signature(handler)
+    params = []
+    for p in sig.parameters.values():
+        dep = p.default
+        if isinstance(dep, DependsParam) and dep.dependency in ASYNC_DEPENDENCIES:
+            p = p.replace(default=Depends(ASYNC_DEPENDENCIES[dep.dependency]))
+        params.append(p)
+
+    async def endpoint(**kwargs):
+        adb = kwargs.pop("db")
+        return await adb.run_sync(lambda db: handler(db=db, **kwargs))
+
+    # not functools.wraps: a __wrapped__ pointing at the sync handler would
+    # make FastAPI treat the endpoint as sync
+    endpoint.__name__ = handler.__name__
+    endpoint.__qualname__ = handler.__qualname__
+    endpoint.__doc__ = handler.__doc__
+    endpoint.__signature__ = sig.replace(parameters=params)
+    return endpoint
@@ -0,0 +1,165 @@
+import zipfile
+from dataclasses import dataclass
+from datetime import datetime
+
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+
+from .models import Item
+from .permissions import get_effective_roles, ROLE_ORDER
+from .storage import StorageBackend, READ_SIZE
+from .tree import in_subtree, subtree_filter
+
+# Formats that are already compressed: deflating them again costs CPU for
+# nothing, so by default they go into the archive as-is (ZIP_STORED).
+COMPRESSED_PREFIXES = ("image/", "video/", "audio/")
+COMPRESSED_TYPES = {
+    "application/pdf",
+    "application/zip",
+    "application/gzip",
+    "application/x-gzip",
+    "application/x-7z-compressed",
+    "application/x-rar-compressed",
+    "application/vnd.rar",
+    "application/x-bzip2",
+    "application/x-xz",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "application/vnd.openxmlformats-officedocument.presentationml.presentation",
+}
+ZIP64_LIMIT = (1 << 31) - 1
+
+
+@dataclass
+class ArchiveEntry:
+    arcname: str
+    is_dir: bool
+    storage_path: str | None = None
+    size: int = 0
+    mime_type: str | None = None
+    modified_at: datetime | None = None
+
+
+def is_precompressed(mime_type: str | None) -> bool:
+    mime = (mime_type or "").lower()
+    return mime in COMPRESSED_TYPES or mime.startswith(COMPRESSED_PREFIXES)
+
+
+def safe_name(name: str) -> str:
+    name = name.replace("/", "_").replace("\\", "_").strip()
+    return name if name not in ("", ".", "..") else "_"
+
+
+def collect_entries(db: Session, user_id: int | None, roots: list[Item]) -> list[ArchiveEntry]:
+    """
+    Everything under `roots` (each root becomes a top-level entry), loaded with
+    one query. With a user_id, items that user can't view are left out
+    together with whatever is below them; share links pass None.
+    """
+    # a selected item inside another selected folder is already covered by it
+    roots = [r for r in roots if not any(o.id != r.id and in_subtree(r.path, o.path) for o in roots)]
+
+    rows = (
+        db.query(Item)
+        .filter(or_(*[subtree_filter(r.path) for r in roots]))
+        .order_by(Item.path)  # a parent's path is a prefix of its children's, so parents come first
+        .all()
+    )
+    if user_id is not None:
+        roles = get_effective_roles(db, user_id, rows)
+        rows = [it for it in rows if ROLE_ORDER[roles[it.id]] >= ROLE_ORDER["viewer"]]
+
+    root_ids = {r.id for r in roots}
+    dir_names: dict[int, str] = {}
+    taken: set[str] = set()
+    entries = []
+    for it in rows:
+        if it.id in root_ids:
+            prefix = ""
+        elif it.parent_id in dir_names:
+            prefix = dir_names[it.parent_id] + "/"
+        else:
+            continue  # its folder was filtered out
+
+        base = safe_name(it.name)
+        arcname = prefix + base
+        n = 1
+        while arcname.lower() in taken:
+            stem, dot, ext = base.rpartition(".") if it.type == "file" and "." in base else (base, "", "")
+            arcname = f"{prefix}{stem} ({n}){dot}{ext}"
+            n += 1
+        taken.add(arcname.lower())
+
+        if it.type == "folder":
+            dir_names[it.id] = arcname
+            entries.append(ArchiveEntry(arcname=arcname, is_dir=True, modified_at=it.modified_at))
+        elif it.storage_path:
+            entries.append(
+                ArchiveEntry(
+                    arcname=arcname,
+                    is_dir=False,
+                    storage_path=it.storage_path,
+                    size=it.size_bytes or 0,
+                    mime_type=it.mime_type,
+                    modified_at=it.modified_at,
+                )
+            )
+    return entries
+
+
+class _Sink:
+    """Write-only, unseekable target for ZipFile: the generator drains it."""
+
+    def __init__(self):
+        self.buf = bytearray()
+
+    def write(self, data) -> int:
+        self.buf += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        out = bytes(self.buf)
+        self.buf.clear()
+        return out
+
+
+def zip_info(entry: ArchiveEntry, compress_type: int) -> zipfile.ZipInfo:
+    ts = entry.modified_at or datetime.utcnow()
+    if ts.year < 1980:
+        ts = datetime(1980, 1, 1)
+    info = zipfile.ZipInfo(entry.arcname + ("/" if entry.is_dir else ""), date_time=ts.timetuple()[:6])
+    info.compress_type = compress_type
+    info.file_size = entry.size
+    return info
+
+
+def iter_zip(entries: list[ArchiveEntry], storage: StorageBackend, store_compressed: bool = True):
+    """
+    Yield a ZIP archive of `entries` while it is being built. Memory stays at
+    about one read buffer: ZipFile writes to an unseekable sink, so sizes and
+    CRCs go into data descriptors after each file instead of being patched in.
+    """
+    sink = _Sink()
+    with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_DEFLATED, allowZip64=True) as zf:
+        for entry in entries:
+            if entry.is_dir:
+                zf.writestr(zip_info(entry, zipfile.ZIP_STORED), b"")
+                continue
+
+            stored = store_compressed and is_precompressed(entry.mime_type)
+            info = zip_info(entry, zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED)
+            with storage.open(entry.storage_path) as src, zf.open(info, "w", force_zip64=entry.size > ZIP64_LIMIT) as dest:
+                while True:
+                    chunk = src.read(READ_SIZE)
+                    if not chunk:
+                        break
+                    dest.write(chunk)
+                    if sink.buf:
+                        yield sink.drain()
+            if sink.buf:
+                yield sink.drain()
+    if sink.buf:
+        yield sink.drain()
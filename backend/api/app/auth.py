@@ -1,6 +1,15 @@
 from fastapi import Header, HTTPException
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
 
-def get_current_user_stub(x_user: str | None = Header(default=None)):
+from .cache import TTLCache
+from .models import User
+from . import settings
+
+# (provider, provider_user_id) -> User column values, filled by main.upsert_user
+identity_cache = TTLCache(settings.IDENTITY_CACHE_SIZE, settings.IDENTITY_CACHE_TTL)
+
+async def get_current_user_stub(x_user: str | None = Header(default=None)):
     """
     Local dev only:
     Send header: X-User: alice   (or bob)
@@ -8,3 +17,39 @@ def get_current_user_stub(x_user: str | None = Header(default=None)):
     if not x_user:
         raise HTTPException(status_code=401, detail="Missing X-User header (local dev auth)")
     return {"provider": "local", "provider_user_id": x_user, "display_name": x_user, "email": None}
+
+
+# ----------------- CACHE INVALIDATION -----------------
+# Same scheme as permissions.py: queued on the session, applied after commit.
+
+def _queue_user_change(mapper, connection, target: User):
+    db = object_session(target)
+    if db is None:
+        return
+    queued = db.info.setdefault("identity_invalidations", [])
+    queued.append((target.provider, target.provider_user_id))
+    # a renamed identity leaves its old key behind
+    state = inspect(target)
+    old_provider = state.attrs.provider.history.deleted or [target.provider]
+    old_user_id = state.attrs.provider_user_id.history.deleted or [target.provider_user_id]
+    if (old_provider[0], old_user_id[0]) != queued[-1]:
+        queued.append((old_provider[0], old_user_id[0]))
+
+
+for _evt in ("after_update", "after_delete"):
+    event.listen(User, _evt, _queue_user_change)
+
+
+def apply_identity_invalidations(queued: list[tuple]):
+    for key in queued:
+        identity_cache.pop(key)
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_invalidations(db: Session):
+    apply_identity_invalidations(db.info.pop("identity_invalidations", []))
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_invalidations(db: Session):
+    db.info.pop("identity_invalidations", None)
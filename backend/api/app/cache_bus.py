@@ -0,0 +1,151 @@
+"""
+Cross-process cache invalidation, through the database.
+
+permissions.py, shares.py and auth.py queue their invalidations on the
+session and apply them to this process's caches after commit. With several
+worker processes (gunicorn.conf.py) the others have to hear about them too,
+so the same queued entries are also written to `cache_invalidations`, in the
+committing transaction, and every process polls that table for rows written
+by someone else. Entries therefore outlive a change by at most
+CACHE_BUS_POLL_SECONDS in the other workers, and nothing but the database
+file is shared. The poll also wakes this process's change streams when
+another process added changes.
+
+Rows are read in id order. SQLite hands ids out under its single write
+lock, so they also commit in that order; a server database with concurrent
+writers could commit a lower id late, which the TTLs still bound.
+
+A process that could not poll for longer than the retention period may have
+missed rows: it clears its caches instead.
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+
+from .auth import apply_identity_invalidations, identity_cache
+from .changes import current_cursor, notifier
+from .db import ReadSessionLocal
+from .models import CacheInvalidation
+from .permissions import apply_permission_invalidations, permission_cache
+from .shares import apply_share_invalidations, share_cache
+from . import settings
+
+log = logging.getLogger("edushare.cache_bus")
+
+# identifies this process's rows, so it doesn't re-apply its own
+ORIGIN = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+# session info key -> (fn(entries) applying them to this process's cache, that cache)
+TOPICS = {
+    "permission_invalidations": (apply_permission_invalidations, permission_cache),
+    "identity_invalidations": (apply_identity_invalidations, identity_cache),
+    "share_invalidations": (apply_share_invalidations, share_cache),
+}
+
+
+def enabled() -> bool:
+    return settings.CACHE_BUS_POLL_SECONDS > 0
+
+
+@event.listens_for(Session, "before_commit")
+def _publish(db: Session):
+    if not enabled():
+        return
+    db.flush()  # mapper events queue their invalidations during the flush
+    for key in TOPICS:
+        queued = db.info.get(key)
+        if queued:
+            db.add(CacheInvalidation(origin=ORIGIN, topic=key, payload=json.dumps(queued)))
+
+
+def trim_invalidations(db: Session) -> int:
+    cutoff = datetime.utcnow() - timedelta(seconds=settings.CACHE_BUS_RETENTION_SECONDS)
+    removed = db.query(CacheInvalidation).filter(CacheInvalidation.created_at < cutoff).delete(synchronize_session=False)
+    db.commit()
+    return removed
+
+
+class CacheBusListener:
+    def __init__(self):
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_id = None
+        self.last_change = None
+        self.last_poll = None
+        self.counters = {"polls": 0, "applied": 0, "resets": 0}
+
+    def poll(self, db: Session):
+        now = time.monotonic()
+        if self.last_poll is not None and now - self.last_poll > settings.CACHE_BUS_RETENTION_SECONDS:
+            # rows may have been trimmed before we saw them
+            for _, cache in TOPICS.values():
+                cache.clear()
+            self.counters["resets"] += 1
+        self.last_poll = now
+        self.counters["polls"] += 1
+
+        if self.last_id is None:
+            self.last_id = db.query(func.max(CacheInvalidation.id)).scalar() or 0
+        rows = (
+            db.query(CacheInvalidation)
+            .filter(CacheInvalidation.id > self.last_id)
+            .order_by(CacheInvalidation.id)
+            .all()
+        )
+        for row in rows:
+            self.last_id = row.id
+            if row.origin == ORIGIN or row.topic not in TOPICS:
+                continue
+            TOPICS[row.topic][0]([tuple(entry) for entry in json.loads(row.payload)])
+            self.counters["applied"] += 1
+
+        head = current_cursor(db)
+        if self.last_change is not None and head > self.last_change:
+            notifier.notify()
+        self.last_change = head
+        db.rollback()  # end the read transaction so the next poll sees new commits
+
+    def stats(self) -> dict:
+        return {
+            "origin": ORIGIN,
+            "poll_seconds": settings.CACHE_BUS_POLL_SECONDS,
+            "running": self._thread is not None,
+            "last_id": self.last_id,
+            **self.counters,
+        }
+
+    def _loop(self):
+        db = ReadSessionLocal()
+        try:
+            while not self._stop.is_set():
+                try:
+                    self.poll(db)
+                except Exception:
+                    log.exception("cache bus poll failed")
+                    db.rollback()
+                self._stop.wait(settings.CACHE_BUS_POLL_SECONDS)
+        finally:
+            db.close()
+
+    def start(self):
+        if self._thread is not None or not enabled():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="edushare-cache-bus", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+
+
+listener = CacheBusListener()
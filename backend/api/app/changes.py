@@ -0,0 +1,240 @@
+"""
+Change feed.
+
+Every mutating handler appends a Change row in the same transaction as the
+change itself. Clients keep the id of the last change they saw as a cursor
+and ask /changes?since=<cursor> for what happened after it, or keep
+/changes/stream open to have changes pushed as server-sent events.
+
+Rows are filtered by the same visibility rules as everything else, on the
+item's path after the change and, for moves, before it: a client sees an
+item arrive in and leave its part of the tree. The log is compacted and
+trimmed by a scheduled job (compact_changes).
+
+Cursors assume ids commit in id order. SQLite hands them out under its
+single write lock, so they do; this feed is SQLite-only in that respect. A
+server database with concurrent writers could commit a lower id after a
+client has read past it, and that client would never see the change.
+"""
+import asyncio
+import json
+import threading
+from datetime import datetime, timedelta
+
+from fastapi import HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from sqlalchemy import and_, event, exists, func, or_
+from sqlalchemy.orm import Session, aliased
+
+from .models import Change, ChangeLogState, Item, User
+from .permissions import visible_filter
+from .tree import subtree_filter
+from . import settings
+
+
+def record_change(
+    db: Session,
+    kind: str,
+    item: Item,
+    actor: User | None = None,
+    old_path: str | None = None,
+    old_parent_id: int | None = None,
+    audience_user_id: int | None = None,
+):
+    """Log a change to `item` (its path must be final); committed with the caller."""
+    db.add(
+        Change(
+            kind=kind,
+            item_id=item.id,
+            parent_id=item.parent_id,
+            old_parent_id=old_parent_id,
+            path=item.path,
+            old_path=old_path,
+            owner_user_id=item.owner_user_id,
+            actor_user_id=actor.id if actor is not None else None,
+            audience_user_id=audience_user_id,
+        )
+    )
+    db.info["changes_written"] = True
+
+
+# ----------------- READING -----------------
+def user_scope(user_id: int):
+    """Changes `user_id` may see: the item was visible to them before or after it."""
+    return or_(
+        and_(
+            Change.audience_user_id == None,
+            or_(
+                visible_filter(user_id, Change.path, Change.owner_user_id),
+                and_(Change.old_path != None, visible_filter(user_id, Change.old_path, Change.owner_user_id)),
+            ),
+        ),
+        Change.audience_user_id == user_id,
+    )
+
+
+def subtree_scope(root_path: str):
+    """Changes inside a shared subtree."""
+    return and_(
+        Change.audience_user_id == None,
+        or_(subtree_filter(root_path, Change.path), subtree_filter(root_path, Change.old_path)),
+    )
+
+
+def current_cursor(db: Session) -> int:
+    return db.query(func.max(Change.id)).scalar() or 0
+
+
+def trimmed_through(db: Session) -> int:
+    return db.query(ChangeLogState.trimmed_through).scalar() or 0
+
+
+def changes_since(db: Session, since: int, scope, limit: int) -> tuple[list[Change], int, bool]:
+    """
+    Up to `limit` visible changes after `since`: (rows, next cursor, more).
+    The cursor also moves past changes the caller can't see, so they are
+    not scanned again.
+    """
+    head = current_cursor(db)
+    # only rows trimmed for age lose anything; superseded ones leave a later row
+    if since < trimmed_through(db):
+        raise HTTPException(410, "Cursor is older than the change log; reload and start a new cursor")
+
+    rows = (
+        db.query(Change)
+        .filter(Change.id > since, Change.id <= head, scope)
+        .order_by(Change.id)
+        .limit(limit + 1)
+        .all()
+    )
+    more = len(rows) > limit
+    rows = rows[:limit]
+    return rows, (rows[-1].id if more else max(head, since)), more
+
+
+# ----------------- COMPACTION -----------------
+def compact_changes(db: Session) -> int:
+    """
+    Drop create/update rows that a later row for the same item, at the same
+    path, makes redundant (clients upsert the item's current state anyway),
+    then everything past the retention period, recording the highest id
+    that went (cursors behind it get a 410). The newest row always stays,
+    so cursors keep counting up. Returns the number of rows removed.
+    """
+    head = current_cursor(db)
+    later = aliased(Change)
+    superseded = exists().where(
+        later.item_id == Change.item_id,
+        later.id > Change.id,
+        or_(later.path == Change.path, later.old_path == Change.path),
+    )
+    removed = (
+        db.query(Change)
+        .filter(Change.kind.in_(("create", "update")), Change.id < head, superseded)
+        .delete(synchronize_session=False)
+    )
+
+    cutoff = datetime.utcnow() - timedelta(days=settings.CHANGES_RETENTION_DAYS)
+    expired = db.query(Change).filter(Change.created_at < cutoff, Change.id < head)
+    last_expired = expired.with_entities(func.max(Change.id)).scalar()
+    if last_expired is not None:
+        removed += expired.delete(synchronize_session=False)
+        state = db.query(ChangeLogState).first()
+        if state is None:
+            state = ChangeLogState(trimmed_through=0)
+            db.add(state)
+        state.trimmed_through = max(state.trimmed_through or 0, last_expired)
+    db.commit()
+    return removed
+
+
+# ----------------- PUSH -----------------
+class ChangeNotifier:
+    """Wakes this process's open change streams when a change commits."""
+
+    def __init__(self):
+        self._waiters = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self):
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._lock:
+            self._waiters.add(waiter)
+        return waiter
+
+    def unsubscribe(self, waiter):
+        with self._lock:
+            self._waiters.discard(waiter)
+
+    def notify(self):
+        with self._lock:
+            waiters = list(self._waiters)
+        for loop, ev in waiters:
+            try:
+                loop.call_soon_threadsafe(ev.set)
+            except RuntimeError:
+                pass  # loop already closed
+
+
+notifier = ChangeNotifier()
+
+
+@event.listens_for(Session, "after_commit")
+def _notify_streams(db: Session):
+    if db.info.pop("changes_written", False):
+        notifier.notify()
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_changes(db: Session):
+    db.info.pop("changes_written", None)
+
+
+def sse(event_name: str, data: dict, event_id: int | None = None) -> str:
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{head}event: {event_name}\ndata: {json.dumps(jsonable_encoder(data))}\n\n"
+
+
+def change_stream(request: Request, since: int | None, fetch) -> StreamingResponse:
+    """
+    Server-sent events for the changes `fetch(cursor)` returns (a /changes
+    page, run in the threadpool). Resumes from Last-Event-ID on reconnect.
+    Any HTTP error (revoked link, expired cursor) is sent as an "error"
+    event and ends the stream.
+    """
+    last_id = request.headers.get("last-event-id")
+    if last_id and last_id.isdigit():
+        since = int(last_id)
+
+    async def events():
+        waiter = notifier.subscribe()
+        try:
+            cursor = since
+            while True:
+                waiter[1].clear()  # commits from here on wake the next wait
+                try:
+                    page = await run_in_threadpool(fetch, cursor)
+                except HTTPException as e:
+                    yield sse("error", {"status": e.status_code, "detail": e.detail})
+                    return
+                if cursor is None:
+                    yield sse("ready", {"cursor": page["cursor"]}, page["cursor"])
+                for change in page["changes"]:
+                    yield sse("change", change, change["id"])
+                cursor = page["cursor"]
+                if page["has_more"]:
+                    continue
+                try:
+                    await asyncio.wait_for(waiter[1].wait(), settings.CHANGES_STREAM_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+        finally:
+            notifier.unsubscribe(waiter)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"cache-control": "no-cache", "x-accel-buffering": "no"},
+    )
@@ -0,0 +1,167 @@
+"""
+Subtree copies.
+
+A copy is written one tree level at a time with executemany INSERTs: each
+row's parent is remapped to the id its parent's copy just got, and the
+level's paths are filled in by one more executemany. Nothing is loaded as
+ORM objects except the copy's root.
+
+File copies point at the same blobs as their originals. Blobs are content
+addressed and only reclaimed once no item references them, so a copy costs
+no storage I/O and no disk, and an upload to either side just writes a new
+blob (copy-on-write).
+
+The copy belongs to whoever made it; grants and share links stay with the
+original. Small subtrees are copied inside the request, in one transaction.
+Larger ones are copied by a "copy_subtree" job (jobs.py), which commits a
+batch at a time so it can report progress.
+"""
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import bindparam, insert, select, update
+from sqlalchemy.orm import Session
+
+from .changes import record_change
+from .models import Item, ItemPermission, ShareLink, User
+from .tree import assign_path, child_path, RollupDelta, subtree_filter, subtree_weight
+from . import settings
+
+COPIED_COLUMNS = ("name", "type", "storage_path", "content_hash", "mime_type", "size_bytes")
+
+
+def needs_job(source: Item) -> bool:
+    return (source.descendant_count or 0) + 1 > settings.COPY_SYNC_MAX_ITEMS
+
+
+class SubtreeCopy:
+    """
+    Copies `source` (and everything below it) into `dest` (None = top level).
+    start() creates the copy's root; copy_batch() then copies the ids from
+    batches() in order, so a parent's copy always exists before its
+    children's. Rollups go into the RollupDelta the caller passes and applies.
+    """
+
+    def __init__(self, db: Session, source: Item, dest: Item | None, user: User, name: str | None = None):
+        self.db = db
+        self.source = source
+        self.dest = dest
+        self.user = user
+        self.name = name or source.name
+        self.now = datetime.utcnow()
+        self.root: Item | None = None
+        # source id -> (copy id, copy path) for every item copied so far
+        self.copied: dict[int, tuple[int, str]] = {}
+
+        depth = source.path.count("/")
+        self.levels = defaultdict(list)
+        if source.type == "folder":
+            rows = db.query(Item.id, Item.path).filter(subtree_filter(source.path), Item.id != source.id)
+            for item_id, path in rows:
+                self.levels[path.count("/") - depth].append(item_id)
+        self.total = 1 + sum(len(ids) for ids in self.levels.values())
+
+    def start(self, rollup: RollupDelta) -> Item:
+        src = self.source
+        self.root = Item(
+            parent_id=self.dest.id if self.dest is not None else None,
+            name=self.name,
+            type=src.type,
+            owner_user_id=self.user.id,
+            storage_path=src.storage_path,
+            content_hash=src.content_hash,
+            mime_type=src.mime_type,
+            size_bytes=src.size_bytes if src.type == "file" else 0,
+            created_at=self.now,
+            modified_at=self.now,
+            modified_by_user_id=self.user.id,
+        )
+        self.db.add(self.root)
+        assign_path(self.db, self.root, self.dest)
+        self.copied[src.id] = (self.root.id, self.root.path)
+        rollup.add(self.root.path, subtree_weight(self.root))
+        record_change(self.db, "create", self.root, self.user)
+        return self.root
+
+    def batches(self):
+        for depth in sorted(self.levels):
+            ids = self.levels[depth]
+            for i in range(0, len(ids), settings.COPY_BATCH_SIZE):
+                yield ids[i:i + settings.COPY_BATCH_SIZE]
+
+    def copy_batch(self, ids: list[int], rollup: RollupDelta) -> int:
+        """Copy the items `ids` (one level); returns how many were copied."""
+        t = Item.__table__
+        sources = self.db.execute(
+            select(t.c.id, t.c.parent_id, *(t.c[c] for c in COPIED_COLUMNS)).where(t.c.id.in_(ids))
+        ).all()
+        rows = []
+        for src in sources:
+            parent = self.copied.get(src.parent_id)
+            if parent is None:
+                continue  # moved out of the subtree (or its parent vanished) since the copy started
+            row = {c: getattr(src, c) for c in COPIED_COLUMNS}
+            if src.type == "folder":
+                row["size_bytes"] = 0  # folder rollups arrive with their contents
+            row.update(
+                parent_id=parent[0],
+                owner_user_id=self.user.id,
+                created_at=self.now,
+                modified_at=self.now,
+                modified_by_user_id=self.user.id,
+                # stands in for the path until the id is known; tells the returned ids apart
+                path=f"copy:{src.id}",
+            )
+            rows.append(row)
+        if not rows:
+            return 0
+
+        returned = self.db.execute(insert(t).returning(t.c.id, t.c.path), rows).all()
+        by_source = {src.id: src for src in sources}
+        paths = []
+        for copy_id, temp_path in returned:
+            src = by_source[int(temp_path[len("copy:"):])]
+            path = child_path(self.copied[src.parent_id][1], copy_id)
+            self.copied[src.id] = (copy_id, path)
+            paths.append({"b_id": copy_id, "b_path": path})
+            rollup.add(path, (src.size_bytes or 0, 1, 1) if src.type == "file" else (0, 0, 1))
+
+        self.db.execute(update(t).where(t.c.id == bindparam("b_id")).values(path=bindparam("b_path")), paths)
+        return len(paths)
+
+
+def copy_subtree(
+    db: Session, source: Item, dest: Item | None, user: User, name: str | None = None, rollup: RollupDelta | None = None
+) -> Item:
+    """Copy a whole subtree in the caller's transaction; returns the copy's root."""
+    delta = rollup if rollup is not None else RollupDelta()
+    copy = SubtreeCopy(db, source, dest, user, name)
+    copy.start(delta)
+    for ids in copy.batches():
+        copy.copy_batch(ids, delta)
+    if rollup is None:
+        delta.apply(db)
+    return copy.root
+
+
+def discard_copy(db: Session, copy_id: int, user: User) -> list[str]:
+    """
+    Remove a partial copy left by an interrupted copy job. Returns the blobs
+    it referenced, for the caller to hand to reclaim_storage.
+    """
+    root = db.get(Item, copy_id)
+    if root is None:
+        return []
+    rows = subtree_filter(root.path)
+    rollup = RollupDelta()
+    rollup.add(root.path, subtree_weight(root), -1)
+    rollup.apply(db)
+    record_change(db, "delete", root, user)
+    storage_paths = [
+        p for (p,) in db.query(Item.storage_path).filter(rows, Item.storage_path != None).distinct()
+    ]
+    subtree_ids = db.query(Item.id).filter(rows).scalar_subquery()
+    db.query(ItemPermission).filter(ItemPermission.item_id.in_(subtree_ids)).delete(synchronize_session=False)
+    db.query(ShareLink).filter(ShareLink.item_id.in_(subtree_ids)).delete(synchronize_session=False)
+    db.query(Item).filter(rows).delete(synchronize_session=False)
+    return storage_paths
@@ -1,21 +1,202 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ColumnElement
+from sqlalchemy.sql.visitors import InternalTraversal
+from sqlalchemy.util.concurrency import await_only, in_greenlet
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool, StaticPool
+
+from . import settings
+
+# Two engines on the same database: writes go through `engine`, GET endpoints
+# through `read_engine` (get_read_db). On SQLite the file runs in WAL mode, so
+# readers work off a snapshot and never wait for a writer.
+
+
+def _sqlite_pragmas(read_only: bool):
+    def on_connect(dbapi_conn, _record):
+        cur = dbapi_conn.cursor()
+        if not read_only:
+            cur.execute(f"PRAGMA journal_mode={settings.SQLITE_JOURNAL_MODE}")  # persistent: stored in the file
+        cur.execute(f"PRAGMA synchronous={settings.SQLITE_SYNCHRONOUS}")
+        cur.execute(f"PRAGMA cache_size=-{settings.SQLITE_CACHE_SIZE_KB}")
+        cur.execute(f"PRAGMA mmap_size={settings.SQLITE_MMAP_SIZE}")
+        cur.execute(f"PRAGMA busy_timeout={settings.SQLITE_BUSY_TIMEOUT_MS}")
+        cur.execute("PRAGMA temp_store=MEMORY")
+        if read_only:
+            cur.execute("PRAGMA query_only=ON")
+        cur.close()
+    return on_connect
+
+
+def make_engine(
+    url: str, pool_size: int, max_overflow: int, read_only: bool = False, create=create_engine, poolclass=QueuePool
+):
+    parsed = make_url(url)
+    if parsed.get_backend_name() != "sqlite":
+        return create(
+            url,
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_timeout=settings.DB_POOL_TIMEOUT,
+            pool_recycle=settings.DB_POOL_RECYCLE,
+            pool_pre_ping=True,
+        )
+
+    if parsed.database in (None, "", ":memory:"):
+        # one shared connection, or every session would see its own empty database
+        eng = create(url, connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    else:
+        eng = create(
+            url,
+            connect_args={"check_same_thread": False},
+            poolclass=poolclass,
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_timeout=settings.DB_POOL_TIMEOUT,
+        )
+    event.listen(getattr(eng, "sync_engine", eng), "connect", _sqlite_pragmas(read_only))
+    return eng
+
+
+engine = make_engine(settings.DATABASE_URL, settings.DB_POOL_SIZE, settings.DB_MAX_OVERFLOW)
+
+if settings.DATABASE_READ_URL == settings.DATABASE_URL and engine.pool.__class__ is StaticPool:
+    read_engine = engine
+else:
+    read_engine = make_engine(
+        settings.DATABASE_READ_URL, settings.DB_READ_POOL_SIZE, settings.DB_READ_MAX_OVERFLOW, read_only=True
+    )
 
-DATABASE_URL = "sqlite:////home/edushare.db"  # ✅ absolute path in /home
 
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False},
-)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine, info={"read_only": True})
+
+# ----------------- ASYNC MODE -----------------
+# Same database and pragmas through an asyncio driver; only built when
+# EDUSHARE_DB_ASYNC=1, so the async drivers stay optional.
+ASYNC_DRIVERS = {"sqlite": "aiosqlite", "postgresql": "asyncpg", "mysql": "aiomysql"}
+
+
+def async_url(url: str) -> str:
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise RuntimeError(f"No async driver configured for {backend!r}")
+    return parsed.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}").render_as_string(hide_password=False)
+
+
+async_engine = async_read_engine = AsyncSessionLocal = AsyncReadSessionLocal = None
+if settings.DB_ASYNC:
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+    async_engine = make_engine(
+        async_url(settings.DATABASE_URL),
+        settings.DB_POOL_SIZE,
+        settings.DB_MAX_OVERFLOW,
+        create=create_async_engine,
+        poolclass=AsyncAdaptedQueuePool,
+    )
+    async_read_engine = make_engine(
+        async_url(settings.DATABASE_READ_URL),
+        settings.DB_READ_POOL_SIZE,
+        settings.DB_READ_MAX_OVERFLOW,
+        read_only=True,
+        create=create_async_engine,
+        poolclass=AsyncAdaptedQueuePool,
+    )
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=True)
+    AsyncReadSessionLocal = async_sessionmaker(
+        async_read_engine, autoflush=False, expire_on_commit=True, info={"read_only": True}
+    )
+
+
+def run_on_writer(fn):
+    """
+    fn(db) on a writer session of its own (fn commits), for read-pool
+    handlers that now and then have to write. Returns fn's result, which must
+    not need the session any more. Inside an async-mode handler (a greenlet
+    on the event loop, see aio.py) it runs on the async write engine: a sync
+    writer there would stall the loop while SQLite makes it wait for the
+    write lock.
+    """
+    if async_engine is not None and in_greenlet():
+        return await_only(_run_on_async_writer(fn))
+    with SessionLocal() as db:
+        return fn(db)
+
+
+async def _run_on_async_writer(fn):
+    async with AsyncSessionLocal() as adb:
+        return await adb.run_sync(fn)
+
+
+# label -> engine, for instrumentation and /health (the read engine only if it is a separate pool)
+ENGINES = {"write": engine}
+if read_engine is not engine:
+    ENGINES["read"] = read_engine
+if async_engine is not None:
+    ENGINES.update(async_write=async_engine, async_read=async_read_engine)
+
+
+def pool_stats(eng) -> dict:
+    pool = getattr(eng, "sync_engine", eng).pool
+    stats = {"pool": type(pool).__name__}
+    for name in ("size", "checkedin", "checkedout", "overflow"):
+        fn = getattr(pool, name, None)
+        if callable(fn):
+            stats[name] = fn()
+    return stats
+
 
 class Base(DeclarativeBase):
     pass
 
+
+class NoCase(ColumnElement):
+    """
+    `element` compared and sorted ignoring case: COLLATE NOCASE on SQLite.
+    Elsewhere it is left alone, the server databases' locale collations
+    already order letters case-insensitively.
+    """
+    inherit_cache = True
+    _traverse_internals = [("element", InternalTraversal.dp_clauseelement)]
+
+    def __init__(self, element):
+        self.element = element
+        self.type = element.type
+
+
+@compiles(NoCase)
+def _compile_nocase(element, compiler, **kw):
+    return compiler.process(element.element, **kw)
+
+
+@compiles(NoCase, "sqlite")
+def _compile_nocase_sqlite(element, compiler, **kw):
+    return compiler.process(element.element, **kw) + " COLLATE NOCASE"
+
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+def get_read_db():
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def get_async_read_db():
+    async with AsyncReadSessionLocal() as db:
+        yield db
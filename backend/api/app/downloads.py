@@ -0,0 +1,164 @@
+from email.utils import format_datetime, parsedate_to_datetime
+from datetime import timezone
+from urllib.parse import quote
+
+import anyio
+from fastapi import HTTPException, Request
+from starlette.responses import Response
+
+from .models import Item
+from .storage import StorageBackend, READ_SIZE
+
+
+# ----------------- VALIDATORS -----------------
+def item_etag(item: Item) -> str:
+    # content-addressed blobs give a strong validator for free; files stored
+    # before content hashing only get a weak one
+    if item.content_hash:
+        return f'"{item.content_hash}"'
+    stamp = int(item.modified_at.timestamp()) if item.modified_at else 0
+    return f'W/"{item.id}-{item.size_bytes or 0}-{stamp}"'
+
+
+def http_date(dt) -> str:
+    return format_datetime(dt.replace(tzinfo=timezone.utc, microsecond=0), usegmt=True)
+
+
+def etag_matches(header: str, etag: str, weak: bool = True) -> bool:
+    if header.strip() == "*":
+        return True
+    if weak:
+        bare = etag.removeprefix("W/")
+        return any(tag.strip().removeprefix("W/") == bare for tag in header.split(","))
+    return not etag.startswith("W/") and any(tag.strip() == etag for tag in header.split(","))
+
+
+def not_modified(request: Request, etag: str, modified_at) -> bool:
+    """RFC 9110 13.2.2: If-None-Match wins; If-Modified-Since only without it."""
+    inm = request.headers.get("if-none-match")
+    if inm is not None:
+        return etag_matches(inm, etag)
+    ims = request.headers.get("if-modified-since")
+    if ims and modified_at is not None:
+        try:
+            since = parsedate_to_datetime(ims)
+        except (TypeError, ValueError):
+            return False
+        return modified_at.replace(tzinfo=timezone.utc, microsecond=0) <= since
+    return False
+
+
+def requested_range(request: Request, size: int, etag: str, modified_at) -> tuple[int, int] | None:
+    """(start, end inclusive) for a satisfiable single-range request, else None for the full body."""
+    header = request.headers.get("range")
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None  # no range, another unit, or multipart ranges: send it all
+
+    if_range = request.headers.get("if-range")
+    if if_range is not None:
+        if if_range.startswith(('"', "W/")):
+            if not etag_matches(if_range, etag, weak=False):
+                return None
+        elif modified_at is None or if_range != http_date(modified_at):
+            return None
+
+    first, _, last = header[len("bytes="):].strip().partition("-")
+    try:
+        if first == "":
+            # suffix range: last N bytes
+            length = int(last)
+            if length <= 0:
+                raise ValueError
+            start, end = max(size - length, 0), size - 1
+        else:
+            start = int(first)
+            end = int(last) if last else size - 1
+            end = min(end, size - 1)
+    except ValueError:
+        return None
+
+    if start >= size or start > end:
+        raise HTTPException(416, "Requested range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+
+# ----------------- RESPONSE -----------------
+class BlobResponse(Response):
+    """
+    Sends [start, end] of a stored blob. Uses the ASGI zero-copy send
+    extension (kernel sendfile) when the server offers it for a local file,
+    otherwise reads in 1 MiB chunks off the event loop.
+    """
+
+    def __init__(self, storage: StorageBackend, key: str, start: int, end: int, status_code: int, headers: dict):
+        super().__init__(status_code=status_code, headers=headers)
+        self.storage = storage
+        self.key = key
+        self.start = start
+        self.count = end - start + 1
+        self.headers["content-length"] = str(self.count)
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope["method"] == "HEAD" or self.count <= 0:
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        local = self.storage.local_path(self.key)
+        if local is not None and "http.response.zerocopysend" in scope.get("extensions", {}):
+            with open(local, "rb") as fh:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": fh,
+                    "offset": self.start,
+                    "count": self.count,
+                    "more_body": False,
+                })
+            return
+
+        fh = await anyio.to_thread.run_sync(self.storage.open, self.key)
+        try:
+            await anyio.to_thread.run_sync(fh.seek, self.start)
+            remaining = self.count
+            while remaining > 0:
+                chunk = await anyio.to_thread.run_sync(fh.read, min(READ_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                await send({"type": "http.response.body", "body": b""})
+        finally:
+            await anyio.to_thread.run_sync(fh.close)
+
+
+def download_response(request: Request, item: Item, storage: StorageBackend) -> Response:
+    if item.type != "file":
+        raise HTTPException(400, "Only files can be downloaded")
+    if not item.storage_path or not storage.exists(item.storage_path):
+        raise HTTPException(404, "File content missing")
+
+    size = item.size_bytes if item.size_bytes is not None else storage.size(item.storage_path)
+    etag = item_etag(item)
+    headers = {
+        "etag": etag,
+        "accept-ranges": "bytes",
+        "cache-control": "private, no-cache",
+        "vary": "X-User",
+    }
+    if item.modified_at is not None:
+        headers["last-modified"] = http_date(item.modified_at)
+
+    if not_modified(request, etag, item.modified_at):
+        return Response(status_code=304, headers=headers)
+
+    headers["content-type"] = item.mime_type or "application/octet-stream"
+    headers["content-disposition"] = f"attachment; filename*=UTF-8''{quote(item.name)}"
+
+    rng = requested_range(request, size, etag, item.modified_at)
+    if rng is None:
+        return BlobResponse(storage, item.storage_path, 0, size - 1, 200, headers)
+
+    start, end = rng
+    headers["content-range"] = f"bytes {start}-{end}/{size}"
+    return BlobResponse(storage, item.storage_path, start, end, 206, headers)
@@ -0,0 +1,338 @@
+"""
+Durable background jobs.
+
+Jobs are rows in the `jobs` table, written in the same transaction as the
+change that needs them, so committed work is never lost. A worker thread
+inside the API process (or a separate `python -m app.jobs` process) claims
+queued rows one at a time and runs the handler registered for their kind.
+"""
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+
+from .cache_bus import trim_invalidations
+from .changes import compact_changes
+from .copying import discard_copy, SubtreeCopy
+from .db import SessionLocal
+from .models import Item, Job, UploadSession, User
+from .previews import drop_previews
+from .storage import get_staging, get_storage
+from .tree import recompute_rollups, RollupDelta
+from . import settings
+
+log = logging.getLogger("edushare.jobs")
+
+# kind -> fn(db, job, payload)
+HANDLERS = {}
+
+# blobs checked and removed per transaction by reclaim_storage
+RECLAIM_BATCH = 100
+
+# kind -> seconds between runs, for housekeeping the worker queues by itself
+SCHEDULE = {
+    "compact_changes": settings.CHANGES_COMPACT_EVERY_SECONDS,
+    "trim_invalidations": settings.CACHE_BUS_RETENTION_SECONDS,
+    "expire_uploads": settings.UPLOAD_EXPIRE_EVERY_SECONDS,
+}
+
+
+def job_handler(kind: str):
+    def register(fn):
+        HANDLERS[kind] = fn
+        return fn
+    return register
+
+
+def enqueue(db: Session, kind: str, payload: dict, owner_user_id: int | None = None, total: int | None = None) -> Job:
+    """Add a job to the caller's transaction; it becomes visible when they commit."""
+    job = Job(kind=kind, payload=json.dumps(payload), owner_user_id=owner_user_id, total=total)
+    db.add(job)
+    db.flush()
+    db.info["wake_job_worker"] = True
+    return job
+
+
+def report_progress(db: Session, job: Job, progress: int, total: int | None = None):
+    job.progress = progress
+    if total is not None:
+        job.total = total
+    job.updated_at = datetime.utcnow()
+    db.commit()
+
+
+def job_out(job: Job) -> dict:
+    return {
+        "id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "progress": job.progress,
+        "total": job.total,
+        "error": job.error,
+        "created_at": job.created_at,
+        "finished_at": job.finished_at,
+    }
+
+
+def claim_next(db: Session) -> Job | None:
+    while True:
+        job = db.query(Job).filter(Job.status == "queued").order_by(Job.id).first()
+        if job is None:
+            return None
+        # conditional UPDATE so two workers can never claim the same row
+        claimed = (
+            db.query(Job)
+            .filter(Job.id == job.id, Job.status == "queued")
+            .update(
+                {Job.status: "running", Job.attempts: Job.attempts + 1, Job.updated_at: datetime.utcnow()},
+                synchronize_session=False,
+            )
+        )
+        db.commit()
+        if claimed:
+            db.refresh(job)
+            return job
+
+
+def run_job(db: Session, job: Job):
+    job_id = job.id
+    try:
+        handler = HANDLERS.get(job.kind)
+        if handler is None:
+            raise RuntimeError(f"No handler for job kind {job.kind!r}")
+        handler(db, job, json.loads(job.payload))
+        job.status = "done"
+        job.error = None
+        job.finished_at = datetime.utcnow()
+    except Exception as e:
+        log.exception("job %s failed", job_id)
+        db.rollback()
+        job = db.get(Job, job_id)
+        job.error = repr(e)
+        if job.attempts >= settings.JOB_MAX_ATTEMPTS:
+            job.status = "failed"
+            job.finished_at = datetime.utcnow()
+        else:
+            job.status = "queued"
+    job.updated_at = datetime.utcnow()
+    db.commit()
+
+
+def requeue_stale(db: Session) -> int:
+    """Jobs left 'running' by a crashed process go back to the queue after the lease."""
+    cutoff = datetime.utcnow() - timedelta(seconds=settings.JOB_LEASE_SECONDS)
+    n = (
+        db.query(Job)
+        .filter(Job.status == "running", Job.updated_at < cutoff)
+        .update({Job.status: "queued"}, synchronize_session=False)
+    )
+    db.commit()
+    return n
+
+
+def enqueue_due(db: Session) -> int:
+    """Queue each scheduled kind whose last job was created longer ago than its interval."""
+    queued = 0
+    now = datetime.utcnow()
+    for kind, every in SCHEDULE.items():
+        last = db.query(func.max(Job.created_at)).filter(Job.kind == kind).scalar()
+        if last is None or last < now - timedelta(seconds=every):
+            enqueue(db, kind, {})
+            queued += 1
+    db.info.pop("wake_job_worker", None)  # the worker is the one asking
+    db.commit()
+    return queued
+
+
+class JobWorker:
+    def __init__(self):
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def wake(self):
+        self._wake.set()
+
+    def run_pending(self) -> int:
+        """Run queued jobs until the queue is empty. Returns how many ran."""
+        ran = 0
+        db = SessionLocal()
+        try:
+            requeue_stale(db)
+            enqueue_due(db)
+            while not self._stop.is_set():
+                job = claim_next(db)
+                if job is None:
+                    break
+                run_job(db, job)
+                ran += 1
+        finally:
+            db.close()
+        return ran
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.run_pending()
+            except Exception:
+                log.exception("job worker iteration failed")
+            self._wake.wait(settings.JOB_POLL_SECONDS)
+            self._wake.clear()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="edushare-jobs", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+
+
+worker = JobWorker()
+
+
+@event.listens_for(Session, "after_commit")
+def _wake_worker(db: Session):
+    if db.info.pop("wake_job_worker", False):
+        worker.wake()
+
+
+# ----------------- HANDLERS -----------------
+@job_handler("reclaim_storage")
+def reclaim_storage(db: Session, job: Job, payload: dict):
+    """Remove blobs of deleted items, outside the request that deleted them."""
+    storage = get_storage()
+    paths = payload.get("storage_paths", [])
+    for start in range(0, len(paths), RECLAIM_BATCH):
+        batch = paths[start:start + RECLAIM_BATCH]
+        # Write first, so the reference check below runs under the (SQLite,
+        # database-wide) write lock: an upload flushes its row before moving
+        # its blob into place (main.finish_upload), so it has either
+        # committed and is seen here, or waits for us and re-creates the blob.
+        job.updated_at = datetime.utcnow()
+        db.flush()
+        # blobs are shared by identical files: keep one while anything uses it
+        used = {p for (p,) in db.query(Item.storage_path).filter(Item.storage_path.in_(batch))}
+        for path in batch:
+            if path not in used:
+                drop_previews(db, storage, path)
+                storage.delete(path)
+        report_progress(db, job, start + len(batch), len(paths))  # commits: releases the lock
+    job.progress = len(paths)
+    job.total = len(paths)
+
+
+@job_handler("repair_rollups")
+def repair_rollups(db: Session, job: Job, payload: dict):
+    job.total = recompute_rollups(db)
+    job.progress = job.total
+
+
+def drop_partial_copy(db: Session, job: Job, user: User):
+    """Remove the copy an earlier attempt of a copy job left behind, and forget it."""
+    payload = json.loads(job.payload)
+    copy_id = payload.pop("copy_id", None)
+    if copy_id is None:
+        return
+    storage_paths = discard_copy(db, copy_id, user)
+    if storage_paths:
+        enqueue(db, "reclaim_storage", {"storage_paths": storage_paths}, owner_user_id=user.id)
+    job.payload = json.dumps(payload)
+    db.commit()
+
+
+@job_handler("copy_subtree")
+def copy_subtree_job(db: Session, job: Job, payload: dict):
+    """
+    Copy a large subtree a batch at a time. Each batch commits with its
+    rollups, so the copy fills in while it runs; a retry (or the final
+    failure) removes what an interrupted attempt left behind.
+    """
+    user = db.get(User, job.owner_user_id)
+    drop_partial_copy(db, job, user)
+    try:
+        source = db.get(Item, payload["item_id"])
+        dest = db.get(Item, payload["new_parent_id"]) if payload.get("new_parent_id") is not None else None
+        if source is None or (payload.get("new_parent_id") is not None and dest is None):
+            raise RuntimeError("The item or the destination folder no longer exists")
+
+        copy = SubtreeCopy(db, source, dest, user, payload.get("new_name"))
+        rollup = RollupDelta()
+        copy.start(rollup)
+        rollup.apply(db)
+        job.payload = json.dumps({**payload, "copy_id": copy.root.id})
+        done = 1
+        report_progress(db, job, done, copy.total)
+        for ids in copy.batches():
+            copy.copy_batch(ids, rollup)
+            rollup.apply(db)
+            done += len(ids)
+            report_progress(db, job, done)
+    except Exception:
+        if job.attempts >= settings.JOB_MAX_ATTEMPTS:
+            db.rollback()
+            drop_partial_copy(db, job, user)
+        raise
+
+
+@job_handler("expire_uploads")
+def expire_uploads(db: Session, job: Job, payload: dict):
+    """Drop chunked uploads abandoned for UPLOAD_EXPIRE_SECONDS, and their .part files."""
+    staging = get_staging()
+    before = time.time() - settings.UPLOAD_EXPIRE_SECONDS
+    expired = 0
+    # also catches the .part files of plain uploads a crashed process left behind
+    for upload_id in staging.stale(before):
+        lock = staging.lock(upload_id)
+        try:
+            if not lock.acquire(blocking=False):
+                continue  # a chunk is arriving after all
+        except FileNotFoundError:
+            continue  # committed or aborted meanwhile
+        try:
+            last_write = staging.last_write(upload_id)
+            if last_write is None or last_write >= before:
+                continue
+            db.query(UploadSession).filter(UploadSession.id == upload_id).delete(synchronize_session=False)
+            db.commit()
+            staging.discard(upload_id)
+            expired += 1
+        finally:
+            lock.release()
+    # sessions whose .part never got created (start_upload died between the two)
+    cutoff = datetime.utcnow() - timedelta(seconds=settings.UPLOAD_EXPIRE_SECONDS)
+    for sess in db.query(UploadSession).filter(UploadSession.created_at < cutoff).all():
+        if staging.last_write(sess.id) is None:
+            db.delete(sess)
+            expired += 1
+    job.progress = expired
+
+
+@job_handler("compact_changes")
+def compact_change_log(db: Session, job: Job, payload: dict):
+    job.progress = compact_changes(db)
+
+
+@job_handler("trim_invalidations")
+def trim_cache_invalidations(db: Session, job: Job, payload: dict):
+    job.progress = trim_invalidations(db)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    worker.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        worker.stop()
@@ -0,0 +1,239 @@
+"""
+Admission control: per-client rate limits and a global concurrency cap.
+
+Every request draws a token from a bucket keyed by its user (the X-User
+identity, or the client address without one) and, under /s/{token}, also
+from one keyed by the share token, so a script looping on a public link is
+held back whoever runs it. Reads, writes and heavy operations (deletes,
+archives, copies, batches) have separate budgets: a client busy reading
+still has its writes, and a few recursive deletes don't spend a read budget.
+An empty bucket is a 429 with Retry-After saying when the next token comes.
+
+Independently, at most ADMISSION_MAX_IN_FLIGHT requests are handled at once;
+beyond that a request gets a 503 with Retry-After at once, instead of
+waiting in the threadpool or on the SQLite write lock behind everybody else.
+A request gives its slot back when its response starts, so sending a body
+(downloads, archives) doesn't count. Change streams are rate limited when
+opened but don't hold a slot.
+
+State is per process: with several workers each enforces the limits on its
+own share of the traffic.
+"""
+import json
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from starlette.routing import Match
+
+from .metrics import COLLECTORS, CounterMetric, gauge_lines
+from . import settings
+
+# (method, route) -> "heavy"; other GET/HEAD are reads, the rest writes
+HEAVY_ROUTES = {
+    ("DELETE", "/items/{item_id}"),
+    ("DELETE", "/s/{token}/items/{item_id}"),
+    ("POST", "/items/{item_id}/copy"),
+    ("POST", "/s/{token}/items/{item_id}/copy"),
+    ("POST", "/items/batch"),
+    ("POST", "/s/{token}/items/batch"),
+    ("GET", "/folders/{folder_id}/archive"),
+    ("POST", "/archive"),
+    ("GET", "/s/{token}/archive"),
+    ("POST", "/s/{token}/archive"),
+}
+# never limited: monitoring must keep working when the API is overloaded
+# (nor are OPTIONS preflights, see AdmissionMiddleware)
+EXEMPT_ROUTES = {"/health", "/metrics"}
+
+admission_rejected = CounterMetric(
+    "edushare_admission_rejected_total", "Requests turned away before reaching a handler.", ("reason", "budget", "key")
+)
+
+
+def budgets() -> dict[str, tuple[float, float]]:
+    """budget -> (tokens per second, burst)"""
+    return {
+        "read": (settings.RATE_READ_PER_SECOND, settings.RATE_READ_BURST),
+        "write": (settings.RATE_WRITE_PER_SECOND, settings.RATE_WRITE_BURST),
+        "heavy": (settings.RATE_HEAVY_PER_SECOND, settings.RATE_HEAVY_BURST),
+    }
+
+
+def classify(method: str, route: str) -> str:
+    if (method, route) in HEAVY_ROUTES:
+        return "heavy"
+    return "read" if method in ("GET", "HEAD") else "write"
+
+
+class RateLimiter:
+    """Token buckets, one per (key kind, key, budget); the least recently used are dropped past `max_keys`."""
+
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self._buckets: OrderedDict = OrderedDict()  # key -> [tokens, refilled_at]
+        self._lock = threading.Lock()
+
+    def admit(self, keys: list[tuple], budget: str) -> tuple[float, tuple | None]:
+        """
+        Take one token from each key's `budget` bucket, or none if any is
+        empty. Returns (0, None), or the seconds until the emptiest refills
+        and its key.
+        """
+        rate, burst = budgets()[budget]
+        if rate <= 0:
+            return 0.0, None
+        now = time.monotonic()
+        with self._lock:
+            buckets = []
+            for key in keys:
+                bucket_key = (*key, budget)
+                bucket = self._buckets.get(bucket_key)
+                if bucket is None:
+                    bucket = self._buckets[bucket_key] = [burst, now]
+                else:
+                    bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+                    bucket[1] = now
+                    self._buckets.move_to_end(bucket_key)
+                buckets.append((key, bucket))
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+
+            short = [(key, (1 - bucket[0]) / rate) for key, bucket in buckets if bucket[0] < 1]
+            if short:
+                key, wait = max(short, key=lambda s: s[1])
+                return wait, key
+            for _, bucket in buckets:
+                bucket[0] -= 1
+        return 0.0, None
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class ConcurrencyLimiter:
+    def __init__(self):
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def enter(self) -> bool:
+        limit = settings.ADMISSION_MAX_IN_FLIGHT
+        with self._lock:
+            if limit > 0 and self.in_flight >= limit:
+                return False
+            self.in_flight += 1
+        return True
+
+    def leave(self):
+        with self._lock:
+            self.in_flight -= 1
+
+
+rate_limiter = RateLimiter(settings.RATE_LIMIT_MAX_KEYS)
+concurrency = ConcurrencyLimiter()
+
+
+def admission_metrics() -> list[str]:
+    lines = gauge_lines("edushare_admission_in_flight", "Requests holding a concurrency slot.", [({}, concurrency.in_flight)])
+    lines += gauge_lines(
+        "edushare_admission_max_in_flight", "Concurrency slots (0 = unlimited).", [({}, settings.ADMISSION_MAX_IN_FLIGHT)]
+    )
+    lines += gauge_lines("edushare_rate_limit_buckets", "Token buckets held.", [({}, len(rate_limiter))])
+    return lines
+
+
+COLLECTORS.append(admission_metrics)
+
+
+# ----------------- MIDDLEWARE -----------------
+async def reject(send, status: int, retry_after: float, detail: str):
+    body = json.dumps({"detail": detail}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class AdmissionMiddleware:
+    """
+    Pure ASGI. Registered before CORSMiddleware, so CORS wraps it and browsers
+    can read a 429/503; MetricsMiddleware wraps both, so rejections are counted.
+    Preflights (OPTIONS) pass through unlimited.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def match(self, scope) -> tuple[str, dict]:
+        """The route template the router will pick, and the scope it will add (endpoint, path_params)."""
+        for route in scope["app"].routes:
+            matched, child = route.matches(scope)
+            if matched == Match.FULL:
+                return route.path, child
+        return "unmatched", {}
+
+    def client_keys(self, scope, params: dict) -> list[tuple]:
+        user = None
+        for name, value in scope["headers"]:
+            if name == b"x-user":
+                user = value.decode("latin-1")
+                break
+        if user:
+            keys = [("user", user)]
+        else:
+            client = scope.get("client")
+            keys = [("client", client[0] if client else "unknown")]
+        if "token" in params:
+            keys.append(("share", params["token"]))
+        return keys
+
+    async def __call__(self, scope, receive, send):
+        # CORS answers preflights itself; any that get here cost nothing
+        if scope["type"] != "http" or not settings.ADMISSION_ENABLED or scope["method"] == "OPTIONS":
+            return await self.app(scope, receive, send)
+        route, child = self.match(scope)
+        if route in EXEMPT_ROUTES:
+            return await self.app(scope, receive, send)
+
+        budget = classify(scope["method"], route)
+        wait, key = rate_limiter.admit(self.client_keys(scope, child.get("path_params", {})), budget)
+        if key is not None:
+            scope.update(child)  # MetricsMiddleware labels rejections with their route too
+            admission_rejected.inc(("rate", budget, key[0]))
+            return await reject(send, 429, wait, f"Too many {budget} requests, retry later")
+
+        if route.endswith("/changes/stream"):
+            return await self.app(scope, receive, send)
+        if not concurrency.enter():
+            scope.update(child)
+            admission_rejected.inc(("overload", budget, "global"))
+            return await reject(send, 503, 1, "Server busy, retry later")
+
+        # The slot is for the handler, not the transfer: once the response
+        # starts, what is left (a download, an archive) is streamed on the
+        # event loop, and a slow client must not hold a slot for its whole
+        # transfer.
+        held = True
+
+        def leave():
+            nonlocal held
+            if held:
+                held = False
+                concurrency.leave()
+
+        async def send_and_leave(message):
+            if message["type"] == "http.response.start":
+                leave()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_and_leave)
+        finally:
+            leave()
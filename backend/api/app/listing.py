@@ -0,0 +1,104 @@
+import base64
+import hashlib
+import json
+from dataclasses import dataclass
+from datetime import datetime
+
+from fastapi import HTTPException, Query
+from sqlalchemy import literal, tuple_
+
+from .db import NoCase
+from .models import Item
+from . import settings
+
+# Keyset ("seek") pagination for folder listings.
+# Each sort key orders by a column list that ends in Item.id, so the key of
+# the last row on a page is a unique position and the next page is simply
+# "rows after that key" — one index range scan no matter how deep we page.
+SORT_COLUMNS = {
+    "name": (Item.name, Item.id),
+    "modified_at": (Item.modified_at, Item.id),
+    "size": (Item.size_bytes, Item.id),
+    "type": (Item.type, Item.name, Item.id),
+}
+# Names sort ignoring case, as people expect (and as the portal sorts what
+# it has loaded); the indexes in models.py are built the same way.
+NOCASE_COLUMNS = {"name"}
+
+
+def collated(col, expr=None):
+    """`expr` (default: `col` itself) in the collation `col` sorts by."""
+    expr = col if expr is None else expr
+    return NoCase(expr) if col.key in NOCASE_COLUMNS else expr
+
+
+@dataclass
+class ListParams:
+    sort: str
+    order: str
+    prefix: str | None
+    limit: int
+    cursor: str | None
+
+
+async def list_params(
+    sort: str = Query(default="name", pattern="^(name|modified_at|size|type)$"),
+    order: str = Query(default="asc", pattern="^(asc|desc)$"),
+    prefix: str | None = Query(default=None, max_length=255),
+    limit: int = Query(default=settings.LIST_PAGE_SIZE, ge=1, le=settings.LIST_PAGE_SIZE_MAX),
+    cursor: str | None = Query(default=None),
+) -> ListParams:
+    return ListParams(sort=sort, order=order, prefix=prefix or None, limit=limit, cursor=cursor)
+
+
+def encode_cursor(params: ListParams, item: Item) -> str:
+    values = [getattr(item, col.key) for col in SORT_COLUMNS[params.sort]]
+    values = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    raw = json.dumps([params.sort, params.order, values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(params: ListParams) -> list:
+    try:
+        raw = base64.urlsafe_b64decode(params.cursor + "=" * (-len(params.cursor) % 4))
+        sort, order, values = json.loads(raw)
+        if (sort, order) != (params.sort, params.order) or len(values) != len(SORT_COLUMNS[sort]):
+            raise ValueError("cursor belongs to a different ordering")
+        if sort == "modified_at" and values[0] is not None:
+            values[0] = datetime.fromisoformat(values[0])
+    except (ValueError, TypeError, KeyError):
+        raise HTTPException(400, "Invalid cursor")
+    return values
+
+
+def params_digest(params: ListParams) -> str:
+    """Short digest of the listing parameters, so each page and order gets its own ETag."""
+    raw = json.dumps([params.sort, params.order, params.prefix, params.limit, params.cursor], separators=(",", ":"))
+    return hashlib.sha256(raw.encode()).hexdigest()[:12]
+
+
+def escape_like(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def paginate(query, params: ListParams) -> tuple[list[Item], str | None]:
+    """Apply prefix filter, sort and cursor to an Item query. Returns (page, next_cursor)."""
+    cols = SORT_COLUMNS[params.sort]
+
+    if params.prefix:
+        query = query.filter(Item.name.like(escape_like(params.prefix) + "%", escape="\\"))
+
+    if params.cursor:
+        # the collation goes on the cursor's side: SQLite only seeks the
+        # index for a row value whose left side is the bare columns
+        after = tuple_(*cols)
+        key = tuple_(*(collated(c, literal(v, c.type)) for c, v in zip(cols, decode_cursor(params))))
+        query = query.filter(after > key if params.order == "asc" else after < key)
+
+    ordering = [collated(c).asc() if params.order == "asc" else collated(c).desc() for c in cols]
+    rows = query.order_by(*ordering).limit(params.limit + 1).all()
+
+    if len(rows) <= params.limit:
+        return rows, None
+    page = rows[:params.limit]
+    return page, encode_cursor(params, page[-1])
@@ -1,23 +1,78 @@
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Query
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 
+import hashlib
+import mimetypes
 import os
+import tempfile
 import uuid
+from urllib.parse import quote
 from datetime import datetime, timedelta
-from sqlalchemy.orm import Session
-
-from .db import get_db, Base, engine   # ✅ add Base + engine
-from .models import User, Item, ItemPermission, ShareLink
-from .schemas import ItemOut, CreateFolderIn, RenameIn, MoveIn, CreateShareLinkIn
-from .auth import get_current_user_stub
-from .permissions import get_effective_role, ROLE_ORDER
+from sqlalchemy import or_, text
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+from .db import get_db, get_read_db, engine, ENGINES, pool_stats, ReadSessionLocal, run_on_writer
+from .models import User, Item, ItemPermission, ShareLink, Job, UploadSession
+from .schemas import (
+    ArchiveIn,
+    BatchIn,
+    BatchOp,
+    CopyIn,
+    CreateFolderIn,
+    CreateShareLinkIn,
+    ItemOut,
+    MoveIn,
+    RenameIn,
+    UploadInitIn,
+)
+from .auth import get_current_user_stub, identity_cache
+from .permissions import (
+    get_effective_role,
+    get_effective_roles,
+    granted_roots,
+    IN_CHUNK,
+    invalidate_subtree_after_commit,
+    permission_cache,
+    visible_filter,
+    ROLE_ORDER,
+)
+from .aio import db_endpoint
+from .archive import collect_entries, iter_zip
+from .cache_bus import listener as cache_bus
+from .copying import copy_subtree, needs_job
+from .changes import change_stream, changes_since, current_cursor, record_change, subtree_scope, user_scope
+from .downloads import download_response, not_modified
+from .jobs import enqueue, job_out, worker
+from .limits import AdmissionMiddleware
+from .migrations import require_schema
+from .metrics import COLLECTORS, MetricsMiddleware, gauge_lines, instrument_engine, render_metrics
+from .previews import preview_response, preview_worker, queue_preview
+from .search import search_items
+from .shares import invalidate_shares_after_commit, resolve_share, share_cache, share_context, ShareContext
+from .storage import get_staging, get_storage, READ_SIZE
+from . import settings
+from .listing import ListParams, list_params, paginate, params_digest
+from .tree import (
+    apply_rollup,
+    assign_path,
+    in_subtree,
+    move_subtree,
+    rebase_paths,
+    RollupDelta,
+    subtree_filter,
+    subtree_weight,
+    touch_listing,
+)
 
 # ----------------- APP SETUP -----------------
 app = FastAPI(title="EduShare API")
 
-# ✅ Create tables automatically (fixes 500 on /me and /root in Azure)
-Base.metadata.create_all(bind=engine)
+# The schema is only changed by `python -m app.maintenance migrate` (startup.sh
+# runs it before the workers start); here it's just checked, in one query.
+require_schema(engine)
 
 # One single CORS middleware (no duplicates)
 FRONTEND_ORIGINS = [
@@ -38,14 +93,24 @@ FRONTEND_ORIGINS = [
     # "https://<your-swa-name>.azurestaticapps.net",
 ]
 
+# added first, so it runs inside CORS (the last one added is the outermost)
+# and a 429/503 still carries the CORS headers the browser needs to read it
+app.add_middleware(AdmissionMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=FRONTEND_ORIGINS,
     allow_credentials=False,  # keep False unless you switch to cookie auth
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "Content-Range", "Content-Disposition", "Retry-After"],
 )
 
+# outermost, so CORS preflights and error responses are timed too
+app.add_middleware(MetricsMiddleware)
+for _label, _eng in ENGINES.items():
+    instrument_engine(_eng, _label)
+
 
 # NOTE:
 # We are intentionally NOT doing:
@@ -60,8 +125,14 @@ app.add_middleware(
 
 
 # ----------------- HELPERS -----------------
-def upsert_user(db: Session, identity: dict) -> User:
-    u = (
+USER_COLUMNS = ("id", "provider", "provider_user_id", "display_name", "email")
+
+# subtrees OR-ed into one statement (SQLite limits expression depth to 1000)
+SUBTREE_CHUNK = 100
+
+
+def find_user(db: Session, identity: dict) -> User | None:
+    return (
         db.query(User)
         .filter(
             User.provider == identity["provider"],
@@ -69,36 +140,83 @@ def upsert_user(db: Session, identity: dict) -> User:
         )
         .first()
     )
-    if not u:
-        u = User(
-            provider=identity["provider"],
-            provider_user_id=identity["provider_user_id"],
-            display_name=identity.get("display_name"),
-            email=identity.get("email"),
-        )
-        db.add(u)
+
+
+def create_user(db: Session, identity: dict) -> User:
+    u = User(
+        provider=identity["provider"],
+        provider_user_id=identity["provider_user_id"],
+        display_name=identity.get("display_name"),
+        email=identity.get("email"),
+    )
+    db.add(u)
+    try:
         db.commit()
-        db.refresh(u)
+    except IntegrityError:
+        # a concurrent first login inserted the same identity
+        db.rollback()
+        return find_user(db, identity)
+    db.refresh(u)
     return u
 
 
+def attach_user(db: Session, columns: dict) -> User:
+    """Rebuild a User row from its column values and attach it without a SELECT."""
+    u = User(**columns)
+    make_transient_to_detached(u)
+    return db.merge(u, load=False)
+
+
+def upsert_user(db: Session, identity: dict) -> User:
+    key = (identity["provider"], identity["provider_user_id"])
+    cached = identity_cache.get(key)
+    if cached is not None:
+        return attach_user(db, cached)
+
+    u = find_user(db, identity)
+    if not u:
+        if db.info.get("read_only"):
+            # GET endpoints run on the read-only pool: a first login borrows a writer
+            columns = run_on_writer(lambda wdb: {col: getattr(create_user(wdb, identity), col) for col in USER_COLUMNS})
+            identity_cache.set(key, columns)
+            return attach_user(db, columns)
+        u = create_user(db, identity)
+
+    identity_cache.set(key, {col: getattr(u, col) for col in USER_COLUMNS})
+    return u
+
+
+def items_to_out(db: Session, items: list[Item]) -> list[ItemOut]:
+    """Serialize many items; all "modified by" names come from one users query."""
+    user_ids = {it.modified_by_user_id for it in items if getattr(it, "modified_by_user_id", None)}
+    names = {}
+    if user_ids:
+        rows = (
+            db.query(User.id, User.display_name, User.provider_user_id)
+            .filter(User.id.in_(user_ids))
+            .all()
+        )
+        names = {uid: display_name or provider_user_id for uid, display_name, provider_user_id in rows}
+
+    return [
+        ItemOut(
+            id=item.id,
+            type=item.type,
+            name=item.name,
+            parent_id=item.parent_id,
+            mime_type=item.mime_type,
+            size_bytes=item.size_bytes or 0,
+            file_count=item.file_count or 0,
+            descendant_count=item.descendant_count or 0,
+            modified_at=getattr(item, "modified_at", None),
+            modified_by=names.get(getattr(item, "modified_by_user_id", None)),
+        )
+        for item in items
+    ]
+
+
 def item_to_out(db: Session, item: Item) -> ItemOut:
-    modified_by_name = None
-    if getattr(item, "modified_by_user_id", None):
-        u = db.query(User).filter(User.id == item.modified_by_user_id).first()
-        if u:
-            modified_by_name = u.display_name or u.provider_user_id
-
-    return ItemOut(
-        id=item.id,
-        type=item.type,
-        name=item.name,
-        parent_id=item.parent_id,
-        mime_type=item.mime_type,
-        size_bytes=item.size_bytes or 0,
-        modified_at=getattr(item, "modified_at", None),
-        modified_by=modified_by_name,
-    )
+    return items_to_out(db, [item])[0]
 
 
 def touch_modified(item: Item, user: User):
@@ -109,56 +227,132 @@ def touch_modified(item: Item, user: User):
         item.modified_by_user_id = user.id
 
 
-def get_valid_share_link(db: Session, token: str) -> ShareLink:
-    link = db.query(ShareLink).filter(ShareLink.token == token).first()
-    if link is None:
-        raise HTTPException(status_code=404, detail="Share link not found")
-    if link.expires_at and link.expires_at < datetime.utcnow():
-        raise HTTPException(status_code=410, detail="Share link expired")
-    return link
-
-
-def is_descendant(db: Session, child_id: int, root_id: int) -> bool:
-    """True if child_id is root_id OR inside root_id (walk parent chain)."""
-    cur = db.query(Item).filter(Item.id == child_id).first()
-    while cur:
-        if cur.id == root_id:
-            return True
-        if cur.parent_id is None:
-            return False
-        cur = db.query(Item).filter(Item.id == cur.parent_id).first()
-    return False
-
-
-def share_root_item(db: Session, token: str) -> Item:
-    link = get_valid_share_link(db, token)
-    root = db.query(Item).filter(Item.id == link.item_id).first()
-    if not root:
-        raise HTTPException(404, "Item missing")
-    return root
+_background_lock = None
 
 
-def require_share_role(db: Session, token: str, needed: str) -> ShareLink:
-    link = get_valid_share_link(db, token)
-    if ROLE_ORDER[link.role] < ROLE_ORDER[needed]:
-        raise HTTPException(403, f"Share link does not allow {needed}")
-    return link
+def claim_background_work() -> bool:
+    """
+    With several worker processes only one should run the job and preview
+    workers: whoever holds an exclusive lock on BACKGROUND_LOCK_FILE. The OS
+    releases it when that process dies, and its replacement takes it over.
+    """
+    global _background_lock
+    try:
+        import fcntl
+    except ImportError:
+        return True  # no flock (Windows): single process only
+    path = settings.BACKGROUND_LOCK_FILE or os.path.join(
+        tempfile.gettempdir(), f"edushare-{hashlib.sha1(settings.DATABASE_URL.encode()).hexdigest()[:12]}.lock"
+    )
+    fh = open(path, "a")
+    try:
+        fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        fh.close()
+        return False
+    _background_lock = fh
+    return True
+
+
+@app.on_event("startup")
+def start_job_worker():
+    cache_bus.start()
+    if not (settings.JOB_WORKER_ENABLED or settings.PREVIEW_WORKERS > 0) or not claim_background_work():
+        return
+    if settings.JOB_WORKER_ENABLED:
+        worker.start()
+    if settings.PREVIEW_WORKERS > 0:
+        preview_worker.start()
+
+
+@app.on_event("shutdown")
+def stop_job_worker():
+    worker.stop()
+    preview_worker.stop()
+    cache_bus.stop()
 
 
 # ----------------- BASICS -----------------
+CACHES = {"permissions": permission_cache, "identities": identity_cache, "shares": share_cache}
+
+
 @app.get("/health")
-def health():
-    return {"ok": True}
+def health(response: Response):
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+        db_ok = True
+    except SQLAlchemyError:
+        db_ok = False
+        response.status_code = 503
+    return {
+        "ok": db_ok,
+        "db": {"reachable": db_ok, **{label: pool_stats(eng) for label, eng in ENGINES.items()}},
+        "caches": {name: cache.stats() for name, cache in CACHES.items()},
+        "previews": preview_worker.stats(),
+        "process": {"pid": os.getpid(), "background_work": _background_lock is not None},
+        "cache_bus": cache_bus.stats(),
+    }
+
+
+def runtime_metrics() -> list[str]:
+    pools = {label: pool_stats(eng) for label, eng in ENGINES.items()}
+    caches = {name: cache.stats() for name, cache in CACHES.items()}
+    previews = preview_worker.stats()
+    lines = gauge_lines(
+        "edushare_db_pool_connections",
+        "Pooled connections by state.",
+        [
+            ({"engine": label, "state": state}, stats[key])
+            for label, stats in pools.items()
+            for state, key in (("checked_out", "checkedout"), ("checked_in", "checkedin"), ("overflow", "overflow"))
+            if key in stats
+        ],
+    )
+    lines += gauge_lines(
+        "edushare_db_pool_size", "Configured pool size.",
+        [({"engine": label}, stats["size"]) for label, stats in pools.items() if "size" in stats],
+    )
+    lines += gauge_lines("edushare_cache_entries", "Entries held.", [({"cache": n}, c["size"]) for n, c in caches.items()])
+    for key in ("hits", "misses", "evictions"):
+        lines += gauge_lines(
+            f"edushare_cache_{key}_total", f"Cache {key}.", [({"cache": n}, c[key]) for n, c in caches.items()], "counter"
+        )
+    lines += gauge_lines("edushare_preview_queue_depth", "Previews waiting to render.", [({}, previews["queued"])])
+    lines += gauge_lines("edushare_preview_in_flight", "Previews rendering now.", [({}, previews["in_flight"])])
+    lines += gauge_lines(
+        "edushare_previews_total", "Preview renders by outcome.",
+        [({"outcome": key}, previews[key]) for key in ("rendered", "failed", "retried", "shed")], "counter",
+    )
+    bus = cache_bus.stats()
+    lines += gauge_lines("edushare_cache_bus_polls_total", "Polls of the cache invalidation table.", [({}, bus["polls"])], "counter")
+    lines += gauge_lines(
+        "edushare_cache_bus_applied_total", "Invalidations applied from other processes.", [({}, bus["applied"])], "counter"
+    )
+    lines += gauge_lines(
+        "edushare_cache_bus_resets_total", "Caches cleared after falling behind the bus.", [({}, bus["resets"])], "counter"
+    )
+    return lines
+
+
+COLLECTORS.append(runtime_metrics)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 
 @app.get("/me")
-def me(db: Session = Depends(get_db), identity: dict = Depends(get_current_user_stub)):
+@db_endpoint
+def me(db: Session = Depends(get_read_db), identity: dict = Depends(get_current_user_stub)):
     u = upsert_user(db, identity)
     return {"id": u.id, "display_name": u.display_name}
 
 
 # ----------------- NORMAL (LOGGED-IN) API -----------------
 @app.post("/folders", response_model=ItemOut)
+@db_endpoint
 def create_folder(
     body: CreateFolderIn,
     db: Session = Depends(get_db),
@@ -166,6 +360,7 @@ def create_folder(
 ):
     user = upsert_user(db, identity)
 
+    parent = None
     if body.parent_id is not None:
         parent = db.query(Item).filter(Item.id == body.parent_id, Item.type == "folder").first()
         if not parent:
@@ -188,22 +383,80 @@ def create_folder(
         modified_by_user_id=user.id,
     )
     db.add(folder)
+    assign_path(db, folder, parent)
+    apply_rollup(db, folder.path, subtree_weight(folder))
+    record_change(db, "create", folder, user)
     db.commit()
     db.refresh(folder)
     return item_to_out(db, folder)
 
 
+def listing_etag(request: Request, response: Response, tag: str, params: ListParams) -> Response | None:
+    """
+    Listings are validated by a version counter that every change to the
+    listed children bumps (tree.RollupDelta), plus a digest of the sort,
+    filter and page asked for. Returns a 304 to send instead of the listing
+    when the client's copy is current.
+    """
+    etag = f'W/"{tag}-{params_digest(params)}"'
+    headers = {"etag": etag, "cache-control": "private, no-cache", "vary": "X-User"}
+    if not_modified(request, etag, None):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+
+def page_out(db: Session, response: Response, query, params: ListParams) -> list[ItemOut]:
+    """One page of a listing; the cursor for the next page goes in X-Next-Cursor."""
+    items, next_cursor = paginate(query, params)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return items_to_out(db, items)
+
+
 @app.get("/root", response_model=list[ItemOut])
-def list_root(db: Session = Depends(get_db), identity: dict = Depends(get_current_user_stub)):
+@db_endpoint
+def list_root(
+    request: Request,
+    response: Response,
+    params: ListParams = Depends(list_params),
+    db: Session = Depends(get_read_db),
+    identity: dict = Depends(get_current_user_stub),
+):
     user = upsert_user(db, identity)
-    items = db.query(Item).filter(Item.parent_id == None, Item.owner_user_id == user.id).all()
-    return [item_to_out(db, it) for it in items]
+
+    version = db.query(User.root_version).filter(User.id == user.id).scalar()
+    cached = listing_etag(request, response, f"root-{user.id}-{version}", params)
+    if cached:
+        return cached
+
+    query = db.query(Item).filter(Item.parent_id == None, Item.owner_user_id == user.id)
+    return page_out(db, response, query, params)
+
+
+@app.get("/shared-with-me", response_model=list[ItemOut])
+@db_endpoint
+def list_shared_with_me(
+    response: Response,
+    params: ListParams = Depends(list_params),
+    db: Session = Depends(get_read_db),
+    identity: dict = Depends(get_current_user_stub),
+):
+    """The topmost items other users have granted this user access to."""
+    user = upsert_user(db, identity)
+
+    query = db.query(Item).filter(Item.id.in_(granted_roots(user.id)), Item.owner_user_id != user.id)
+    return page_out(db, response, query, params)
 
 
 @app.get("/folders/{folder_id}/children", response_model=list[ItemOut])
+@db_endpoint
 def list_children(
     folder_id: int,
-    db: Session = Depends(get_db),
+    request: Request,
+    response: Response,
+    params: ListParams = Depends(list_params),
+    db: Session = Depends(get_read_db),
     identity: dict = Depends(get_current_user_stub),
 ):
     user = upsert_user(db, identity)
@@ -216,37 +469,408 @@ def list_children(
     if ROLE_ORDER[role] < ROLE_ORDER["viewer"]:
         raise HTTPException(403, "No permission to view this folder")
 
-    items = db.query(Item).filter(Item.parent_id == folder_id).all()
-    return [item_to_out(db, it) for it in items]
+    cached = listing_etag(request, response, f"folder-{folder.id}-{folder.children_version}", params)
+    if cached:
+        return cached
+
+    query = db.query(Item).filter(Item.parent_id == folder_id)
+    return page_out(db, response, query, params)
+
+
+@app.get("/search", response_model=list[ItemOut])
+@db_endpoint
+def search(
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(default=settings.SEARCH_PAGE_SIZE, ge=1, le=settings.SEARCH_PAGE_SIZE_MAX),
+    cursor: int = Query(default=0, ge=0),
+    db: Session = Depends(get_read_db),
+    identity: dict = Depends(get_current_user_stub),
+):
+    """Ranked name/type search over everything the caller can view."""
+    user = upsert_user(db, identity)
+    items, next_cursor = search_items(db, q, visible_filter(user.id), limit, cursor)
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = str(next_cursor)
+    return items_to_out(db, items)
+
+
+# ----------------- UPLOADS -----------------
+# Files are staged on disk while they arrive and stored content-addressed on
+# commit (storage.py). Plain multipart /upload does all of that in one request;
+# /uploads is the resumable protocol: init -> PUT chunks at ?offset= -> commit.
+
+def upload_folder(db: Session, user: User, folder_id: int) -> Item:
+    folder = db.query(Item).filter(Item.id == folder_id, Item.type == "folder").first()
+    if not folder:
+        raise HTTPException(404, "Folder not found")
+
+    role = get_effective_role(db, user.id, folder)
+    if ROLE_ORDER[role] < ROLE_ORDER["editor"]:
+        raise HTTPException(403, "No permission to upload here")
+    return folder
+
+
+def share_upload_folder(db: Session, share: ShareContext, folder_id: int) -> Item:
+    share.require("editor").require_folder()
+
+    folder = db.query(Item).filter(Item.id == folder_id, Item.type == "folder").first()
+    if not folder:
+        raise HTTPException(404, "Folder not found")
+    if not share.contains(folder):
+        raise HTTPException(403, "Folder is outside shared subtree")
+    return folder
+
+
+def finish_upload(db: Session, user: User, folder: Item, upload_id: str, name: str, mime_type: str | None) -> Item:
+    """Move a fully staged upload into blob storage and create its Item (caller commits)."""
+    staging = get_staging()
+    size = staging.size(upload_id)
+    digest = staging.digest(upload_id)
+
+    now = datetime.utcnow()
+    item = Item(
+        parent_id=folder.id,
+        name=name,
+        type="file",
+        owner_user_id=user.id,
+        content_hash=digest,
+        mime_type=mime_type or mimetypes.guess_type(name)[0] or "application/octet-stream",
+        size_bytes=size,
+        created_at=now,
+        modified_at=now,
+        modified_by_user_id=user.id,
+    )
+    db.add(item)
+    assign_path(db, item, folder)
+    # Only now that the row is flushed (holding the write lock until our
+    # commit) may the blob appear: a reclaim job for an identical deleted
+    # file then either finished before us, or sees our row (jobs.reclaim_storage).
+    item.storage_path = get_storage().put(digest, staging.path(upload_id))
+    staging.discard(upload_id)
+    apply_rollup(db, item.path, subtree_weight(item))
+    record_change(db, "create", item, user)
+    queue_preview(db, item)
+    return item
+
+
+def store_multipart(db: Session, user: User, folder: Item, file: UploadFile) -> ItemOut:
+    upload_id = uuid.uuid4().hex
+    staging = get_staging()
+    try:
+        if staging.write_stream(upload_id, file.file) > settings.UPLOAD_MAX_SIZE:
+            raise HTTPException(413, f"Files are limited to {settings.UPLOAD_MAX_SIZE} bytes")
+        item = finish_upload(db, user, folder, upload_id, file.filename or "upload", file.content_type)
+        db.commit()
+    finally:
+        staging.discard(upload_id)
+    db.refresh(item)
+    return item_to_out(db, item)
+
+
+def upload_status(sess: UploadSession) -> dict:
+    return {
+        "upload_id": sess.id,
+        "offset": get_staging().size(sess.id),
+        "size": sess.expected_size,
+        "chunk_size": settings.UPLOAD_CHUNK_SIZE,
+    }
 
 
-@app.post("/upload")
+def start_upload(db: Session, user: User, folder: Item, body: UploadInitIn, token: str | None) -> dict:
+    if body.size is not None and body.size > settings.UPLOAD_MAX_SIZE:
+        raise HTTPException(413, f"Files are limited to {settings.UPLOAD_MAX_SIZE} bytes")
+    sess = UploadSession(
+        id=uuid.uuid4().hex,
+        user_id=user.id,
+        folder_id=folder.id,
+        share_token=token,
+        name=body.name,
+        mime_type=body.mime_type,
+        expected_size=body.size,
+    )
+    db.add(sess)
+    db.commit()
+    get_staging().writer(sess.id, 0).close()  # empty .part, so 0-byte files commit too
+    return upload_status(sess)
+
+
+def lock_upload(upload_id: str, busy: str):
+    """
+    The staged upload's lock, held by whoever writes to it, in any worker.
+    409 while someone else holds it; 404 once the upload was committed or discarded.
+    """
+    lock = get_staging().lock(upload_id)
+    try:
+        locked = lock.acquire(blocking=False)
+    except FileNotFoundError:
+        raise HTTPException(404, "Upload not found")
+    if not locked:
+        raise HTTPException(409, busy)
+    return lock
+
+
+def get_upload_session(db: Session, user: User, upload_id: str, share: ShareContext | None) -> UploadSession:
+    sess = db.query(UploadSession).filter(UploadSession.id == upload_id).first()
+    token = share.token if share is not None else None
+    if not sess or sess.user_id != user.id or sess.share_token != token:
+        raise HTTPException(404, "Upload not found")
+    if share is not None:
+        share.require("editor")
+    return sess
+
+
+async def receive_chunk(
+    request: Request, db: Session, identity: dict, upload_id: str, offset: int, share: ShareContext | None
+) -> dict:
+    """Stream the request body into the staged file at `offset`, hashing as it goes."""
+    def check():
+        user = upsert_user(db, identity)
+        get_upload_session(db, user, upload_id, share)
+    await run_in_threadpool(check)
+
+    staging = get_staging()
+    lock = lock_upload(upload_id, "Another chunk for this upload is still being written")
+    try:
+        staged = staging.size(upload_id)
+        if offset > staged:
+            raise HTTPException(409, f"Upload is at offset {staged}")
+
+        writer = await run_in_threadpool(staging.writer, upload_id, offset)
+        received = 0
+        buf = bytearray()
+        try:
+            async for piece in request.stream():
+                received += len(piece)
+                if received > settings.UPLOAD_MAX_CHUNK_SIZE:
+                    raise HTTPException(413, f"Chunks are limited to {settings.UPLOAD_MAX_CHUNK_SIZE} bytes")
+                if offset + received > settings.UPLOAD_MAX_SIZE:
+                    raise HTTPException(413, f"Files are limited to {settings.UPLOAD_MAX_SIZE} bytes")
+                buf += piece
+                if len(buf) >= READ_SIZE:
+                    await run_in_threadpool(writer.write, bytes(buf))
+                    buf.clear()
+            if buf:
+                await run_in_threadpool(writer.write, bytes(buf))
+        except BaseException:
+            writer.abort()
+            raise
+        new_offset = writer.close()
+    finally:
+        lock.release()
+
+    return {"upload_id": upload_id, "offset": new_offset}
+
+
+def commit_upload(db: Session, user: User, sess: UploadSession, folder: Item) -> ItemOut:
+    staging = get_staging()
+    lock = lock_upload(sess.id, "A chunk for this upload is still being written")
+    try:
+        staged = staging.size(sess.id)
+        if sess.expected_size is not None and staged != sess.expected_size:
+            raise HTTPException(409, f"Upload incomplete: {staged} of {sess.expected_size} bytes")
+
+        item = finish_upload(db, user, folder, sess.id, sess.name, sess.mime_type)
+        db.delete(sess)
+        db.commit()
+    finally:
+        lock.release()
+    db.refresh(item)
+    return item_to_out(db, item)
+
+
+@app.post("/upload", response_model=ItemOut)
 def upload_file(
     folder_id: int,
     file: UploadFile = File(...),
     db: Session = Depends(get_db),
     identity: dict = Depends(get_current_user_stub),
 ):
-    raise HTTPException(
-        status_code=501,
-        detail="Upload not enabled yet (Blob Storage migration step)."
-    )
+    user = upsert_user(db, identity)
+    folder = upload_folder(db, user, folder_id)
+    return store_multipart(db, user, folder, file)
+
+
+@app.post("/uploads")
+def init_upload(
+    body: UploadInitIn,
+    db: Session = Depends(get_db),
+    identity: dict = Depends(get_current_user_stub),
+):
+    user = upsert_user(db, identity)
+    folder = upload_folder(db, user, body.folder_id)
+    return start_upload(db, user, folder, body, None)
+
+
+@app.get("/uploads/{upload_id}")
+@db_endpoint
+def upload_progress(
+    upload_id: str,
+    db: Session = Depends(get_read_db),
+    identity: dict = Depends(get_current_user_stub),
+):
+    user = upsert_user(db, identity)
+    return upload_status(get_upload_session(db, user, upload_id, None))
+
+
+@app.put("/uploads/{upload_id}")
+async def put_upload_chunk(
+    upload_id: str,
+    request: Request,
+    offset: int = Query(..., ge=0),
+    db: Session = Depends(get_db),
+    identity: dict = Depends(get_current_user_stub),
+):
+    return await receive_chunk(request, db, identity, upload_id, offset, None)
+
+
+@app.post("/uploads/{upload_id}/commit", response_model=ItemOut)
+def finish_chunked_upload(
+    upload_id: str,
+    db: Session = Depends(get_db),
+    identity: dict = Depends(get_current_user_stub),
+):
+    user = upsert_user(db, identity)
+    sess = get_upload_session(db, user, upload_id, None)
+    folder = upload_folder(db, user, sess.folder_id)
+    return commit_upload(db, user, sess, folder)
 
 
-@app.get("/download/{file_id}")
+@app.delete("/uploads/{upload_id}")
+def abort_upload(
+    upload_id: str,
+    db: Session = Depends(get_db),
+    identity: dict = Depends(get_current_user_stub),
+):
+    user = upsert_user(db, identity)
+    sess = get_upload_session(db, user, upload_id, None)
+    db.delete(sess)
+    db.commit()
+    get_staging().discard(upload_id)
+    return {"ok": True}
+
+
+@app.api_route("/download/{file_id}", methods=["GET", "HEAD"])
+@db_endpoint
 def download_file(
     file_id: int,
-    db: Session = Depends(get_db),
+    request: Request,
+    db: Session = Depends(get_read_db),
     identity: dict = Depends(get_current_user_stub),
 ):
-    raise HTTPException(
-        status_code=501,
-        detail="Download not enabled yet (Blob Storage migration step)."
+    user = upsert_user(db, identity)
+
+    item = db.query(Item).filter(Item.id == file_id).first()
+    if not item:
+        raise HTTPException(404, "File not found")
+
+    role = get_effective_role(db, user.id, item)
+    if ROLE_ORDER[role] < ROLE_ORDER["viewer"]:
+        raise HTTPException(403, "No permission to download this file")
+
+    return download_response(request, item, get_storage())
+
+
+def viewable_file(db: Session, user: User, item_id: int) -> Item:
+    item = db.query(Item).filter(Item.id == item_id).first()
+    if not item:
+        raise HTTPException(404, "File not found")
+    role = get_effective_role(db, user.id, item)
+    if ROLE_ORDER[role] < ROLE_ORDER["viewer"]:
+        raise HTTPException(403, "No permission to view this file")
+    return item
+
+
+@app.api_route("/items/{item_id}/thumbnail", methods=["GET", "HEAD"])
+@db_endpoint
+def item_thumbnail(
+    item_id: int,
+    request: Request,
+    db: Session = Depends(get_read_db),
+    identity: dict = Depends(get_current_user_stub),
+):
+    user = upsert_user(db, identity)
+    return preview_response(db, request, viewable_file(db, user, item_id), "thumbnail")
+
+
+@app.api_route("/items/{item_id}/snippet", methods=["GET", "HEAD"])
+@db_endpoint
+def item_snippet(
+    item_id: int,
+    request: Request,
+    db: Session = Depends(get_read_db),
+    identity: dict = Depends(get_current_user_stub),
+):
+    user = upsert_user(db, identity)
+    return preview_response(db, request, viewable_file(db, user, item_id), "snippet")
+
+
+
+# ----------------- ZIP ARCHIVES -----------------
+def zip_response(db: Session, user_id: int | None, roots: list[Item], name: str, store_compressed: bool) -> StreamingResponse:
+    # everything the generator needs is loaded here: the DB session is closed
+    # before the body is streamed
+    entries = collect_entries(db, user_id, roots)
+    return StreamingResponse(
+        iter_zip(entries, get_storage(), store_compressed),
+        media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename*=UTF-8''{quote(name)}.zip"},
     )
 
 
+def load_selection(db: Session, item_ids: list[int]) -> list[Item]:
+    if not item_ids:
+        raise HTTPException(400, "Select at least one item")
+    if len(item_ids) > settings.ARCHIVE_MAX_SELECTION:
+        raise HTTPException(400, f"At most {settings.ARCHIVE_MAX_SELECTION} items per archive")
+    items = db.query(Item).filter(Item.id.in_(set(item_ids))).all()
+    if len(items) != len(set(item_ids)):
+        raise HTTPException(404, "Item not found")
+    return items
+
+
+@app.get("/folders/{folder_id}/archive")
+@db_endpoint
+def archive_folder(
+    folder_id: int,
+    store_compressed: bool = Query(default=True),
+    db: Session = Depends(get_read_db),
+    identity: dict = Depends(get_current_user_stub),
+):
+    user = upsert_user(db, identity)
+
+    folder = db.query(Item).filter(Item.id == folder_id, Item.type == "folder").first()
+    if not folder:
+        raise HTTPException(404, "Folder not found")
+
+    role = get_effective_role(db, user.id, folder)
+    if ROLE_ORDER[role] < ROLE_ORDER["viewer"]:
+        raise HTTPException(403, "No permission to view this folder")
+
+    return zip_response(db, user.id, [folder], folder.name, store_compressed)
+
+
+@app.post("/archive")
+@db_endpoint
+def archive_selection(
+    body: ArchiveIn,
+    store_compressed: bool = Query(default=True),
+    db: Session = Depends(get_db),
+    identity: dict = Depends(get_current_user_stub),
+):
+    user = upsert_user(db, identity)
+
+    items = load_selection(db, body.item_ids)
+    roles = get_effective_roles(db, user.id, items)
+    if any(ROLE_ORDER[roles[it.id]] < ROLE_ORDER["viewer"] for it in items):
+        raise HTTPException(403, "No permission to view all selected items")
+
+    name = items[0].name if len(items) == 1 else "edushare"
+    return zip_response(db, user.id, items, name, store_compressed)
+
 
 @app.post("/items/{item_id}/rename")
+@db_endpoint
 def rename_item(
     item_id: int,
     body: RenameIn,
@@ -265,11 +889,14 @@ def rename_item(
 
     item.name = body.new_name
     touch_modified(item, user)
+    touch_listing(db, item.path)
+    record_change(db, "update", item, user)
     db.commit()
     return {"ok": True}
 
 
 @app.post("/items/{item_id}/move")
+@db_endpoint
 def move_item(
     item_id: int,
     body: MoveIn,
@@ -282,45 +909,88 @@ def move_item(
     if not item:
         raise HTTPException(404, "Item not found")
 
-    role_item = get_effective_role(db, user.id, item)
-    if ROLE_ORDER[role_item] < ROLE_ORDER["editor"]:
+    dest = None
+    if body.new_parent_id is not None:
+        dest = db.query(Item).filter(Item.id == body.new_parent_id, Item.type == "folder").first()
+
+    roles = get_effective_roles(db, user.id, [item] + ([dest] if dest else []))
+    if ROLE_ORDER[roles[item.id]] < ROLE_ORDER["editor"]:
         raise HTTPException(403, "No permission to move this item")
 
     if body.new_parent_id is not None:
-        dest = db.query(Item).filter(Item.id == body.new_parent_id, Item.type == "folder").first()
         if not dest:
             raise HTTPException(404, "Destination folder not found")
 
-        role_dest = get_effective_role(db, user.id, dest)
-        if ROLE_ORDER[role_dest] < ROLE_ORDER["editor"]:
+        if ROLE_ORDER[roles[dest.id]] < ROLE_ORDER["editor"]:
             raise HTTPException(403, "No permission to move into that folder")
 
-        if item.id == dest.id:
+        if in_subtree(dest.path, item.path):
             raise HTTPException(400, "Cannot move item into itself")
 
+    old_path, old_parent_id = item.path, item.parent_id
+    invalidate_subtree_after_commit(db, old_path)
+    invalidate_shares_after_commit(db, old_path)
+    rollup = RollupDelta()
+    rollup.add(old_path, subtree_weight(item), -1)
     item.parent_id = body.new_parent_id
+    move_subtree(db, item, dest)
+    rollup.add(item.path, subtree_weight(item))
+    rollup.apply(db)
     touch_modified(item, user)
+    record_change(db, "move", item, user, old_path, old_parent_id)
     db.commit()
     return {"ok": True}
 
 
-def delete_item_recursive(db: Session, item: Item):
-    children = db.query(Item).filter(Item.parent_id == item.id).all()
-    for child in children:
-        delete_item_recursive(db, child)
+def delete_subtrees(db: Session, roots: list[Item], user: User) -> Job | None:
+    """
+    Delete the given items and everything below them with a handful of
+    set-based statements (each subtree is one range on items.path). Rollups
+    are left to the caller. Stored files are not touched here: they are
+    handed to a background job, which is returned.
+    """
+    storage_paths = set()
+    for i in range(0, len(roots), SUBTREE_CHUNK):
+        chunk = roots[i:i + SUBTREE_CHUNK]
+        rows = or_(*[subtree_filter(root.path) for root in chunk])
+        # grants below are deleted too, so their holders are told directly
+        grants = (
+            db.query(ItemPermission.user_id, Item.path)
+            .join(Item, Item.id == ItemPermission.item_id)
+            .filter(rows)
+            .distinct()
+            .all()
+        )
+        for root in chunk:
+            invalidate_subtree_after_commit(db, root.path)
+            invalidate_shares_after_commit(db, root.path)
+            record_change(db, "delete", root, user)
+            for grantee in sorted({uid for uid, path in grants if in_subtree(path, root.path)}):
+                record_change(db, "delete", root, user, audience_user_id=grantee)
+
+        subtree_ids = db.query(Item.id).filter(rows).scalar_subquery()
+        storage_paths.update(
+            p for (p,) in db.query(Item.storage_path)
+            .filter(rows, Item.type == "file", Item.storage_path != None)
+            .distinct()
+        )
+
+        db.query(ItemPermission).filter(ItemPermission.item_id.in_(subtree_ids)).delete(synchronize_session=False)
+        db.query(ShareLink).filter(ShareLink.item_id.in_(subtree_ids)).delete(synchronize_session=False)
+        db.query(Item).filter(rows).delete(synchronize_session=False)
 
-    if item.type == "file" and item.storage_path:
-        try:
-            if os.path.exists(item.storage_path):
-                os.remove(item.storage_path)
-        except Exception:
-            pass
+    if not storage_paths:
+        return None
+    return enqueue(db, "reclaim_storage", {"storage_paths": sorted(storage_paths)}, owner_user_id=user.id)
 
-    db.query(ItemPermission).filter(ItemPermission.item_id == item.id).delete()
-    db.delete(item)
+
+def delete_subtree(db: Session, item: Item, user: User) -> Job | None:
+    apply_rollup(db, item.path, subtree_weight(item), -1)
+    return delete_subtrees(db, [item], user)
 
 
 @app.delete("/items/{item_id}")
+@db_endpoint
 def delete_item(
     item_id: int,
     db: Session = Depends(get_db),
@@ -336,13 +1006,269 @@ def delete_item(
     if ROLE_ORDER[role] < ROLE_ORDER["editor"]:
         raise HTTPException(403, "No permission to delete")
 
-    delete_item_recursive(db, item)
+    job = delete_subtree(db, item, user)
     db.commit()
-    return {"ok": True}
+    return {"ok": True, "job_id": job.id if job else None}
+
+
+def start_copy(db: Session, user: User, source: Item, dest: Item | None, name: str | None) -> dict:
+    """Copy `source` into `dest` now, or queue a job if the subtree is large (access already checked)."""
+    if dest is not None and in_subtree(dest.path, source.path):
+        raise HTTPException(400, "Cannot copy a folder into itself")
+
+    if needs_job(source):
+        payload = {"item_id": source.id, "new_parent_id": dest.id if dest else None, "new_name": name}
+        job = enqueue(db, "copy_subtree", payload, owner_user_id=user.id, total=(source.descendant_count or 0) + 1)
+        db.commit()
+        return {"ok": True, "item_id": None, "job_id": job.id}
+
+    copy = copy_subtree(db, source, dest, user, name)
+    db.commit()
+    return {"ok": True, "item_id": copy.id, "job_id": None}
+
+
+@app.post("/items/{item_id}/copy")
+@db_endpoint
+def copy_item(
+    item_id: int,
+    body: CopyIn,
+    db: Session = Depends(get_db),
+    identity: dict = Depends(get_current_user_stub),
+):
+    user = upsert_user(db, identity)
+
+    item = db.query(Item).filter(Item.id == item_id).first()
+    if not item:
+        raise HTTPException(404, "Item not found")
+
+    dest = None
+    if body.new_parent_id is not None:
+        dest = db.query(Item).filter(Item.id == body.new_parent_id, Item.type == "folder").first()
+
+    roles = get_effective_roles(db, user.id, [item] + ([dest] if dest else []))
+    if ROLE_ORDER[roles[item.id]] < ROLE_ORDER["viewer"]:
+        raise HTTPException(403, "No permission to copy this item")
+
+    if body.new_parent_id is not None:
+        if not dest:
+            raise HTTPException(404, "Destination folder not found")
+        if ROLE_ORDER[roles[dest.id]] < ROLE_ORDER["editor"]:
+            raise HTTPException(403, "No permission to copy into that folder")
+
+    return start_copy(db, user, item, dest, body.new_name)
+
+
+@app.get("/jobs/{job_id}")
+@db_endpoint
+def get_job(
+    job_id: int,
+    db: Session = Depends(get_read_db),
+    identity: dict = Depends(get_current_user_stub),
+):
+    user = upsert_user(db, identity)
+
+    job = db.query(Job).filter(Job.id == job_id).first()
+    if not job or job.owner_user_id != user.id:
+        raise HTTPException(404, "Job not found")
+    return job_out(job)
+
+
+# ----------------- BULK OPERATIONS -----------------
+def load_batch(db: Session, ops: list[BatchOp]) -> dict[int, Item]:
+    """Every item a batch names (targets and destinations), in one query per 500 ids."""
+    if not ops:
+        raise HTTPException(400, "No operations given")
+    if len(ops) > settings.BATCH_MAX_OPS:
+        raise HTTPException(400, f"At most {settings.BATCH_MAX_OPS} operations per batch")
+
+    ids = {op.item_id for op in ops} | {op.new_parent_id for op in ops if op.op in ("move", "copy") and op.new_parent_id}
+    ids = sorted(ids)
+    items = {}
+    for i in range(0, len(ids), IN_CHUNK):
+        for it in db.query(Item).filter(Item.id.in_(ids[i:i + IN_CHUNK])):
+            items[it.id] = it
+    return items
+
+
+def run_batch(db: Session, user: User, ops: list[BatchOp], items: dict[int, Item], check) -> dict:
+    """
+    Apply `ops` in order, in one transaction. check(op, item, dest) returns
+    (status, detail) for an op the caller doesn't allow. Refused ops are
+    reported and skipped; everything else commits together, with one rollup
+    update and one storage-reclaim job for the whole batch. Copies too large
+    to make inline are queued as jobs of their own.
+    """
+    rollup = RollupDelta()
+    deleted: list[Item] = []
+    results = []
+
+    def gone(it: Item | None) -> bool:
+        return it is None or any(in_subtree(it.path, d.path) for d in deleted)
+
+    for op in ops:
+        item = items.get(op.item_id)
+        moves = op.op in ("move", "copy")
+        dest = items.get(op.new_parent_id) if moves and op.new_parent_id is not None else None
+
+        if gone(item):
+            error = (404, "Item not found")
+        elif moves and op.new_parent_id is not None and (gone(dest) or dest.type != "folder"):
+            error = (404, "Destination folder not found")
+        else:
+            error = check(op, item, dest)
+        if error is None:
+            if moves and dest is not None and in_subtree(dest.path, item.path):
+                error = (400, f"Cannot {op.op} item into itself")
+            elif op.op == "rename" and not op.new_name:
+                error = (400, "new_name is required")
+        if error is not None:
+            results.append({"item_id": op.item_id, "op": op.op, "ok": False, "status": error[0], "detail": error[1]})
+            continue
+
+        result = {"item_id": op.item_id, "op": op.op, "ok": True}
+
+        if op.op == "rename":
+            item.name = op.new_name
+            rollup.touch(item.path)
+            record_change(db, "update", item, user)
+        elif op.op == "move":
+            old_path, old_parent_id = item.path, item.parent_id
+            invalidate_subtree_after_commit(db, old_path)
+            invalidate_shares_after_commit(db, old_path)
+            rollup.add(old_path, rollup.weight(item), -1)
+            if item.type == "folder":
+                db.flush()  # the subtree UPDATE must see earlier ops
+            item.parent_id = op.new_parent_id
+            move_subtree(db, item, dest)
+            if item.type == "folder":
+                rebase_paths(items.values(), old_path, item.path)
+            rollup.add(item.path, rollup.weight(item))
+            record_change(db, "move", item, user, old_path, old_parent_id)
+        elif op.op == "copy":
+            db.flush()  # the copy reads the subtree as earlier ops left it
+            if needs_job(item):
+                payload = {"item_id": item.id, "new_parent_id": op.new_parent_id, "new_name": op.new_name}
+                total = (item.descendant_count or 0) + 1
+                result["job_id"] = enqueue(db, "copy_subtree", payload, owner_user_id=user.id, total=total).id
+            else:
+                result["copy_id"] = copy_subtree(db, item, dest, user, op.new_name, rollup).id
+        else:
+            rollup.add(item.path, rollup.weight(item), -1)
+            deleted.append(item)
+
+        if op.op in ("move", "rename"):
+            touch_modified(item, user)
+        results.append(result)
+
+    db.flush()
+    rollup.apply(db)  # before the deletes: root versions are found through the deleted rows' owners
+    job = delete_subtrees(db, deleted, user) if deleted else None
+    db.commit()
+    return {"results": results, "job_id": job.id if job else None}
+
+
+@app.post("/items/batch")
+@db_endpoint
+def batch_items(
+    body: BatchIn,
+    db: Session = Depends(get_db),
+    identity: dict = Depends(get_current_user_stub),
+):
+    user = upsert_user(db, identity)
+
+    items = load_batch(db, body.ops)
+    roles = get_effective_roles(db, user.id, list(items.values()))
+
+    def check(op: BatchOp, item: Item, dest: Item | None):
+        if ROLE_ORDER[roles[item.id]] < ROLE_ORDER["viewer" if op.op == "copy" else "editor"]:
+            return 403, f"No permission to {op.op} this item"
+        if dest is not None and ROLE_ORDER[roles[dest.id]] < ROLE_ORDER["editor"]:
+            return 403, f"No permission to {op.op} into that folder"
+        return None
+
+    return run_batch(db, user, body.ops, items, check)
+
+
+# ----------------- CHANGE FEED -----------------
+def changes_page(db: Session, since: int | None, limit: int, scope, visible) -> dict:
+    """
+    A /changes response. Each change carries the item's current state if the
+    caller can still see it; "item": null means it is gone from their view.
+    Without `since` there are no changes, only the cursor to start from.
+    """
+    if since is None:
+        return {"changes": [], "cursor": current_cursor(db), "has_more": False}
+
+    rows, cursor, more = changes_since(db, since, scope, limit)
+    ids = sorted({c.item_id for c in rows if c.kind != "delete"})
+    items = []
+    for i in range(0, len(ids), IN_CHUNK):
+        items += db.query(Item).filter(Item.id.in_(ids[i:i + IN_CHUNK])).all()
+    items = visible(items)
+    outs = {out.id: out for out in items_to_out(db, items)}
+
+    return {
+        "changes": [
+            {
+                "id": c.id,
+                "kind": c.kind,
+                "item_id": c.item_id,
+                "parent_id": c.parent_id,
+                "old_parent_id": c.old_parent_id,
+                "at": c.created_at,
+                "item": outs.get(c.item_id) if c.kind != "delete" else None,
+            }
+            for c in rows
+        ],
+        "cursor": cursor,
+        "has_more": more,
+    }
+
+
+def user_changes(db: Session, user: User, since: int | None, limit: int) -> dict:
+    def visible(items):
+        roles = get_effective_roles(db, user.id, items)
+        return [it for it in items if ROLE_ORDER[roles[it.id]] >= ROLE_ORDER["viewer"]]
+
+    return changes_page(db, since, limit, user_scope(user.id), visible)
+
+
+def share_changes(db: Session, share: ShareContext, since: int | None, limit: int) -> dict:
+    share.require("viewer")
+    def visible(items):
+        return [it for it in items if share.contains(it)]
+
+    return changes_page(db, since, limit, subtree_scope(share.root_path), visible)
+
+
+@app.get("/changes")
+@db_endpoint
+def list_changes(
+    since: int | None = Query(default=None, ge=0),
+    limit: int = Query(default=settings.CHANGES_PAGE_SIZE, ge=1, le=settings.CHANGES_PAGE_SIZE_MAX),
+    db: Session = Depends(get_read_db),
+    identity: dict = Depends(get_current_user_stub),
+):
+    user = upsert_user(db, identity)
+    return user_changes(db, user, since, limit)
+
+
+@app.get("/changes/stream")
+def stream_changes(
+    request: Request,
+    since: int | None = Query(default=None, ge=0),
+    identity: dict = Depends(get_current_user_stub),
+):
+    def fetch(cursor):
+        with ReadSessionLocal() as db:
+            return user_changes(db, upsert_user(db, identity), cursor, settings.CHANGES_PAGE_SIZE)
+
+    return change_stream(request, since, fetch)
 
 
 # ----------------- SHARE LINK CREATION -----------------
 @app.post("/share-links/{item_id}")
+@db_endpoint
 def create_share_link(
     item_id: int,
     body: CreateShareLinkIn,
@@ -374,141 +1300,440 @@ def create_share_link(
     return {"token": link.token, "role": link.role, "expires_at": link.expires_at}
 
 
+@app.delete("/share-links/{token}")
+@db_endpoint
+def revoke_share_link(
+    token: str,
+    db: Session = Depends(get_db),
+    identity: dict = Depends(get_current_user_stub),
+):
+    user = upsert_user(db, identity)
+
+    link = db.query(ShareLink).filter(ShareLink.token == token).first()
+    if not link:
+        raise HTTPException(404, "Share link not found")
+
+    item = db.query(Item).filter(Item.id == link.item_id).first()
+    if not item or item.owner_user_id != user.id:
+        raise HTTPException(403, "Only owner can revoke share links")
+
+    db.delete(link)
+    db.commit()
+    return {"ok": True}
+
+
 # ----------------- SHARE LINK ACCESS (LOGIN REQUIRED) -----------------
+# The token is resolved once per request by the share_context dependency
+# (cached across requests, see shares.py); handlers only query what they list.
+
 @app.get("/s/{token}/meta")
+@db_endpoint
 def share_meta(
-    token: str,
-    db: Session = Depends(get_db),
+    share: ShareContext = Depends(share_context),
+    db: Session = Depends(get_read_db),
     identity: dict = Depends(get_current_user_stub),
 ):
     # Login required, but the token defines access.
     upsert_user(db, identity)
 
-    link = get_valid_share_link(db, token)
-    root = db.query(Item).filter(Item.id == link.item_id).first()
+    root = db.query(Item).filter(Item.id == share.root_id).first()
     if not root:
         raise HTTPException(404, "Item missing")
 
     return {
-        "token": link.token,
-        "role": link.role,
+        "token": share.token,
+        "role": share.role,
         "root": item_to_out(db, root),
     }
 
 
 @app.get("/s/{token}/children", response_model=list[ItemOut])
+@db_endpoint
 def share_children(
-    token: str,
+    request: Request,
+    response: Response,
     folder_id: int | None = Query(default=None),
-    db: Session = Depends(get_db),
+    params: ListParams = Depends(list_params),
+    share: ShareContext = Depends(share_context),
+    db: Session = Depends(get_read_db),
     identity: dict = Depends(get_current_user_stub),
 ):
     # Login required
     upsert_user(db, identity)
 
-    link = require_share_role(db, token, "viewer")
-    root = share_root_item(db, token)
-
-    if root.type != "folder":
-        raise HTTPException(400, "Link is not for a folder")
+    share.require("viewer").require_folder()
 
     # If no folder_id provided, list root's children
-    target_folder_id = folder_id or root.id
+    if folder_id is not None and folder_id != share.root_id:
+        folder = db.query(Item.id, Item.path, Item.children_version).filter(
+            Item.id == folder_id, Item.type == "folder"
+        ).first()
+        if not folder:
+            raise HTTPException(404, "Folder not found")
+        # Must stay inside shared subtree
+        if not share.contains(folder):
+            raise HTTPException(403, "Folder is outside shared subtree")
+        version = folder.children_version
+    else:
+        folder_id = share.root_id
+        version = db.query(Item.children_version).filter(Item.id == folder_id).scalar()
+
+    cached = listing_etag(request, response, f"folder-{folder_id}-{version}", params)
+    if cached:
+        return cached
+
+    query = db.query(Item).filter(Item.parent_id == folder_id)
+    return page_out(db, response, query, params)
+
+
+@app.get("/s/{token}/search", response_model=list[ItemOut])
+@db_endpoint
+def share_search(
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(default=settings.SEARCH_PAGE_SIZE, ge=1, le=settings.SEARCH_PAGE_SIZE_MAX),
+    cursor: int = Query(default=0, ge=0),
+    share: ShareContext = Depends(share_context),
+    db: Session = Depends(get_read_db),
+    identity: dict = Depends(get_current_user_stub),
+):
+    # Login required
+    upsert_user(db, identity)
 
-    # Must stay inside shared subtree
-    if not is_descendant(db, target_folder_id, root.id):
-        raise HTTPException(403, "Folder is outside shared subtree")
+    share.require("viewer")
+
+    items, next_cursor = search_items(db, q, subtree_filter(share.root_path), limit, cursor)
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = str(next_cursor)
+    return items_to_out(db, items)
+
+
+@app.api_route("/s/{token}/download/{file_id}", methods=["GET", "HEAD"])
+@db_endpoint
+def share_download_file(
+    file_id: int,
+    request: Request,
+    share: ShareContext = Depends(share_context),
+    db: Session = Depends(get_read_db),
+    identity: dict = Depends(get_current_user_stub),
+):
+    # Login required
+    upsert_user(db, identity)
+
+    share.require("viewer")
+
+    item = db.query(Item).filter(Item.id == file_id).first()
+    if not item:
+        raise HTTPException(404, "File not found")
+
+    if not share.contains(item):
+        if share.is_folder:
+            raise HTTPException(403, "File is outside shared subtree")
+        raise HTTPException(403, "This link does not allow downloading that file")
+
+    return download_response(request, item, get_storage())
+
+
+def shared_file(db: Session, share: ShareContext, item_id: int) -> Item:
+    share.require("viewer")
+    item = db.query(Item).filter(Item.id == item_id).first()
+    if not item:
+        raise HTTPException(404, "File not found")
+    if not share.contains(item):
+        raise HTTPException(403, "File is outside shared subtree" if share.is_folder else "Not the shared file")
+    return item
+
+
+@app.api_route("/s/{token}/items/{item_id}/thumbnail", methods=["GET", "HEAD"])
+@db_endpoint
+def share_item_thumbnail(
+    item_id: int,
+    request: Request,
+    share: ShareContext = Depends(share_context),
+    db: Session = Depends(get_read_db),
+    identity: dict = Depends(get_current_user_stub),
+):
+    # Login required
+    upsert_user(db, identity)
+    return preview_response(db, request, shared_file(db, share, item_id), "thumbnail")
+
+
+@app.api_route("/s/{token}/items/{item_id}/snippet", methods=["GET", "HEAD"])
+@db_endpoint
+def share_item_snippet(
+    item_id: int,
+    request: Request,
+    share: ShareContext = Depends(share_context),
+    db: Session = Depends(get_read_db),
+    identity: dict = Depends(get_current_user_stub),
+):
+    # Login required
+    upsert_user(db, identity)
+    return preview_response(db, request, shared_file(db, share, item_id), "snippet")
+
+
+@app.get("/s/{token}/archive")
+@db_endpoint
+def share_archive_folder(
+    folder_id: int | None = Query(default=None),
+    store_compressed: bool = Query(default=True),
+    share: ShareContext = Depends(share_context),
+    db: Session = Depends(get_read_db),
+    identity: dict = Depends(get_current_user_stub),
+):
+    # Login required
+    upsert_user(db, identity)
+
+    share.require("viewer").require_folder()
 
-    folder = db.query(Item).filter(Item.id == target_folder_id, Item.type == "folder").first()
+    folder = db.query(Item).filter(Item.id == (folder_id or share.root_id), Item.type == "folder").first()
     if not folder:
         raise HTTPException(404, "Folder not found")
+    if not share.contains(folder):
+        raise HTTPException(403, "Folder is outside shared subtree")
 
-    kids = db.query(Item).filter(Item.parent_id == folder.id).all()
-    return [item_to_out(db, it) for it in kids]
+    return zip_response(db, None, [folder], folder.name, store_compressed)
 
 
-@app.get("/s/{token}/download/{file_id}")
-def share_download_file(
-    token: str,
-    file_id: int,
+@app.post("/s/{token}/archive")
+@db_endpoint
+def share_archive_selection(
+    body: ArchiveIn,
+    store_compressed: bool = Query(default=True),
+    share: ShareContext = Depends(share_context),
     db: Session = Depends(get_db),
     identity: dict = Depends(get_current_user_stub),
 ):
-    raise HTTPException(
-        status_code=501,
-        detail="Share download not enabled yet (Blob Storage migration step)."
-    )
+    # Login required
+    upsert_user(db, identity)
+
+    share.require("viewer")
+
+    items = load_selection(db, body.item_ids)
+    if any(not share.contains(it) for it in items):
+        raise HTTPException(403, "Item is outside shared subtree")
+
+    if len(items) == 1:
+        name = items[0].name
+    else:
+        name = db.query(Item.name).filter(Item.id == share.root_id).scalar() or "download"
+    return zip_response(db, None, items, name, store_compressed)
+
+
+@app.get("/s/{token}/changes")
+@db_endpoint
+def share_list_changes(
+    since: int | None = Query(default=None, ge=0),
+    limit: int = Query(default=settings.CHANGES_PAGE_SIZE, ge=1, le=settings.CHANGES_PAGE_SIZE_MAX),
+    share: ShareContext = Depends(share_context),
+    db: Session = Depends(get_read_db),
+    identity: dict = Depends(get_current_user_stub),
+):
+    # Login required
+    upsert_user(db, identity)
+    return share_changes(db, share, since, limit)
+
+
+@app.get("/s/{token}/changes/stream")
+def share_stream_changes(
+    token: str,
+    request: Request,
+    since: int | None = Query(default=None, ge=0),
+    identity: dict = Depends(get_current_user_stub),
+):
+    def fetch(cursor):
+        with ReadSessionLocal() as db:
+            # re-resolved every time, so a revoked link ends the stream
+            upsert_user(db, identity)
+            return share_changes(db, resolve_share(db, token), cursor, settings.CHANGES_PAGE_SIZE)
+
+    return change_stream(request, since, fetch)
 
 
 # ----------------- SHARE LINK EDITOR ACTIONS -----------------
 @app.post("/s/{token}/items/{item_id}/rename")
+@db_endpoint
 def share_rename_item(
-    token: str,
     item_id: int,
     body: RenameIn,
+    share: ShareContext = Depends(share_context),
     db: Session = Depends(get_db),
     identity: dict = Depends(get_current_user_stub),
 ):
     user = upsert_user(db, identity)
-    require_share_role(db, token, "editor")
+    share.require("editor")
 
-    root = share_root_item(db, token)
     item = db.query(Item).filter(Item.id == item_id).first()
     if not item:
         raise HTTPException(404, "Item not found")
 
-    if root.type == "folder":
-        if not is_descendant(db, item.id, root.id):
+    if not share.contains(item):
+        if share.is_folder:
             raise HTTPException(403, "Item is outside shared subtree")
-    else:
-        if item.id != root.id:
-            raise HTTPException(403, "This link does not allow editing that item")
+        raise HTTPException(403, "This link does not allow editing that item")
 
     item.name = body.new_name
     touch_modified(item, user)
+    touch_listing(db, item.path)
+    record_change(db, "update", item, user)
     db.commit()
     return {"ok": True}
 
 
 @app.delete("/s/{token}/items/{item_id}")
+@db_endpoint
 def share_delete_item(
-    token: str,
     item_id: int,
+    share: ShareContext = Depends(share_context),
     db: Session = Depends(get_db),
     identity: dict = Depends(get_current_user_stub),
 ):
     user = upsert_user(db, identity)
-    require_share_role(db, token, "editor")
+    share.require("editor")
 
-    root = share_root_item(db, token)
     item = db.query(Item).filter(Item.id == item_id).first()
     if not item:
         raise HTTPException(404, "Item not found")
 
     # Do not allow deleting the root itself via share link (safety)
-    if item.id == root.id:
+    if item.id == share.root_id:
         raise HTTPException(403, "Cannot delete the root shared item")
 
-    if root.type == "folder":
-        if not is_descendant(db, item.id, root.id):
-            raise HTTPException(403, "Item is outside shared subtree")
-    else:
+    if not share.is_folder:
         raise HTTPException(403, "This link does not allow deleting items")
+    if not share.contains(item):
+        raise HTTPException(403, "Item is outside shared subtree")
 
-    delete_item_recursive(db, item)
+    job = delete_subtree(db, item, user)
     db.commit()
-    return {"ok": True}
+    return {"ok": True, "job_id": job.id if job else None}
 
 
-@app.post("/s/{token}/upload")
+@app.post("/s/{token}/items/{item_id}/copy")
+@db_endpoint
+def share_copy_item(
+    item_id: int,
+    body: CopyIn,
+    share: ShareContext = Depends(share_context),
+    db: Session = Depends(get_db),
+    identity: dict = Depends(get_current_user_stub),
+):
+    user = upsert_user(db, identity)
+    share.require("editor")
+    share.require_folder()
+
+    item = db.query(Item).filter(Item.id == item_id).first()
+    if not item:
+        raise HTTPException(404, "Item not found")
+    if not share.contains(item):
+        raise HTTPException(403, "Item is outside shared subtree")
+
+    dest = None
+    if body.new_parent_id is not None:
+        dest = db.query(Item).filter(Item.id == body.new_parent_id, Item.type == "folder").first()
+    if dest is None or not share.contains(dest):
+        raise HTTPException(403, "Destination is outside shared subtree")
+
+    return start_copy(db, user, item, dest, body.new_name)
+
+
+@app.post("/s/{token}/items/batch")
+@db_endpoint
+def share_batch_items(
+    body: BatchIn,
+    share: ShareContext = Depends(share_context),
+    db: Session = Depends(get_db),
+    identity: dict = Depends(get_current_user_stub),
+):
+    user = upsert_user(db, identity)
+    share.require("editor")
+
+    items = load_batch(db, body.ops)
+
+    def check(op: BatchOp, item: Item, dest: Item | None):
+        if not share.contains(item):
+            return 403, "Item is outside shared subtree"
+        if op.op in ("move", "delete") and item.id == share.root_id:
+            return 403, f"Cannot {op.op} the root shared item"
+        if op.op in ("move", "copy") and (dest is None or not share.contains(dest)):
+            return 403, "Destination is outside shared subtree"
+        return None
+
+    return run_batch(db, user, body.ops, items, check)
+
+
+@app.post("/s/{token}/upload", response_model=ItemOut)
 def share_upload_file(
-    token: str,
     folder_id: int,
     file: UploadFile = File(...),
+    share: ShareContext = Depends(share_context),
     db: Session = Depends(get_db),
     identity: dict = Depends(get_current_user_stub),
 ):
-    raise HTTPException(
-        status_code=501,
-        detail="Share upload not enabled yet (Blob Storage migration step)."
-    )
+    user = upsert_user(db, identity)
+    folder = share_upload_folder(db, share, folder_id)
+    return store_multipart(db, user, folder, file)
+
+
+@app.post("/s/{token}/uploads")
+def share_init_upload(
+    body: UploadInitIn,
+    share: ShareContext = Depends(share_context),
+    db: Session = Depends(get_db),
+    identity: dict = Depends(get_current_user_stub),
+):
+    user = upsert_user(db, identity)
+    folder = share_upload_folder(db, share, body.folder_id)
+    return start_upload(db, user, folder, body, share.token)
+
+
+@app.get("/s/{token}/uploads/{upload_id}")
+@db_endpoint
+def share_upload_progress(
+    upload_id: str,
+    share: ShareContext = Depends(share_context),
+    db: Session = Depends(get_read_db),
+    identity: dict = Depends(get_current_user_stub),
+):
+    user = upsert_user(db, identity)
+    return upload_status(get_upload_session(db, user, upload_id, share))
+
+
+@app.put("/s/{token}/uploads/{upload_id}")
+async def share_put_upload_chunk(
+    upload_id: str,
+    request: Request,
+    offset: int = Query(..., ge=0),
+    share: ShareContext = Depends(share_context),
+    db: Session = Depends(get_db),
+    identity: dict = Depends(get_current_user_stub),
+):
+    return await receive_chunk(request, db, identity, upload_id, offset, share)
+
+
+@app.post("/s/{token}/uploads/{upload_id}/commit", response_model=ItemOut)
+def share_finish_chunked_upload(
+    upload_id: str,
+    share: ShareContext = Depends(share_context),
+    db: Session = Depends(get_db),
+    identity: dict = Depends(get_current_user_stub),
+):
+    user = upsert_user(db, identity)
+    sess = get_upload_session(db, user, upload_id, share)
+    folder = share_upload_folder(db, share, sess.folder_id)
+    return commit_upload(db, user, sess, folder)
+
+
+@app.delete("/s/{token}/uploads/{upload_id}")
+def share_abort_upload(
+    upload_id: str,
+    share: ShareContext = Depends(share_context),
+    db: Session = Depends(get_db),
+    identity: dict = Depends(get_current_user_stub),
+):
+    user = upsert_user(db, identity)
+    sess = get_upload_session(db, user, upload_id, share)
+    db.delete(sess)
+    db.commit()
+    get_staging().discard(upload_id)
+    return {"ok": True}
@@ -0,0 +1,64 @@
+"""
+Schema upkeep.
+
+    python -m app.maintenance migrate         # apply pending schema migrations (migrations.py)
+    python -m app.maintenance version         # show the database's schema version
+    python -m app.maintenance backfill-paths  # recompute every Item.path from parent_id
+    python -m app.maintenance repair-rollups  # recompute folder size/file/descendant totals
+
+The app never changes the schema itself: it only checks the version when
+it starts, so run `migrate` after every deploy (startup.sh does).
+`upgrade` is the old name of `migrate`.
+"""
+import sys
+
+from .db import SessionLocal, engine
+from . import models  # noqa: F401  (registers tables on Base.metadata)
+from .migrations import current_version, latest_version, migrate, MIGRATIONS
+from .tree import backfill_paths, recompute_rollups
+
+
+def upgrade():
+    migrate(engine)
+
+
+def show_version():
+    version = current_version(engine)
+    print(f"database schema version {version}, code {latest_version()}")
+    for v in sorted(MIGRATIONS):
+        if v > version:
+            print(f"  pending: {v} {MIGRATIONS[v][0]}")
+
+
+def repair_rollups():
+    db = SessionLocal()
+    try:
+        n = recompute_rollups(db)
+    finally:
+        db.close()
+    print(f"folder rollups recomputed for {n} folders")
+
+
+def rebuild_paths():
+    db = SessionLocal()
+    try:
+        missing = backfill_paths(db, rebuild=True)
+    finally:
+        db.close()
+    print(f"item paths rebuilt ({missing} items without a reachable parent)")
+
+
+COMMANDS = {
+    "migrate": upgrade,
+    "upgrade": upgrade,
+    "version": show_version,
+    "backfill-paths": rebuild_paths,
+    "repair-rollups": repair_rollups,
+}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2 or sys.argv[1] not in COMMANDS:
+        print(f"usage: python -m app.maintenance [{'|'.join(COMMANDS)}]")
+        sys.exit(2)
+    COMMANDS[sys.argv[1]]()
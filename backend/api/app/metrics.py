@@ -0,0 +1,242 @@
+"""
+Request and query instrumentation, exposed on /metrics (Prometheus text format).
+
+MetricsMiddleware times every request and labels it with its route template
+("/folders/{folder_id}/children"), not the raw path, so series stay bounded.
+Statement hooks on every engine count and time SQL both globally and for the
+request that issued them (a context variable, which follows the request into
+the threadpool and into AsyncSession.run_sync), so an N+1 pattern shows up
+as a route whose statements-per-request histogram sits in the high buckets.
+Requests slower than SLOW_REQUEST_SECONDS are logged with their queries.
+
+Numbers are per process: with several workers, scrape each (or sum them).
+"""
+import bisect
+import contextvars
+import logging
+import threading
+import time
+
+from sqlalchemy import event
+
+from . import settings
+
+log = logging.getLogger("edushare.slow")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SQL_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+
+
+# ----------------- METRIC TYPES -----------------
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = labels
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class CounterMetric(Metric):
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, help_text, labels)
+        self._values = {}
+
+    def inc(self, labels: tuple = (), amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return self.header() + [f"{self.name}{_labels(self.label_names, k)} {v}" for k, v in values]
+
+
+class GaugeMetric(CounterMetric):
+    kind = "gauge"
+
+    def dec(self, labels: tuple = (), amount: float = 1):
+        self.inc(labels, -amount)
+
+
+class HistogramMetric(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [count per bucket (+Inf last), sum]
+
+    def observe(self, labels: tuple, value: float):
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][slot] += 1
+            series[1] += value
+
+    def render(self) -> list[str]:
+        with self._lock:
+            snapshot = sorted((k, list(v[0]), v[1]) for k, v in self._series.items())
+        lines = self.header()
+        for labels, counts, total in snapshot:
+            running = 0
+            for bound, n in zip(self.buckets + ("+Inf",), counts):
+                running += n
+                le = 'le="+Inf"' if bound == "+Inf" else f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, labels, le)} {running}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {round(total, 6)}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {running}")
+        return lines
+
+
+REGISTRY: list[Metric] = []
+# fn() -> list of exposition lines, called on every scrape (pool and cache stats)
+COLLECTORS = []
+
+http_requests = CounterMetric("edushare_http_requests_total", "Finished HTTP requests.", ("method", "route", "status"))
+http_duration = HistogramMetric(
+    "edushare_http_request_duration_seconds", "Time from request to the end of the response body.", ("method", "route")
+)
+http_in_flight = GaugeMetric("edushare_http_requests_in_flight", "Requests being served right now.")
+request_statements = HistogramMetric(
+    "edushare_http_request_sql_statements", "SQL statements issued per request.", ("method", "route"), STATEMENT_BUCKETS
+)
+request_sql_seconds = HistogramMetric(
+    "edushare_http_request_sql_seconds", "Time spent in SQL per request.", ("method", "route")
+)
+sql_statements = CounterMetric("edushare_sql_statements_total", "SQL statements executed.", ("engine",))
+sql_duration = HistogramMetric("edushare_sql_duration_seconds", "SQL statement execution time.", ("engine",), SQL_BUCKETS)
+
+
+def gauge_lines(name: str, help_text: str, samples: list[tuple[dict, float]], kind: str = "gauge") -> list[str]:
+    """Exposition lines for values read at scrape time."""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        lines.append(f"{name}{_labels(tuple(labels), tuple(labels.values()))} {value}")
+    return lines
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines += metric.render()
+    for collect in COLLECTORS:
+        lines += collect()
+    return "\n".join(lines) + "\n"
+
+
+# ----------------- PER-REQUEST SQL -----------------
+class RequestStats:
+    __slots__ = ("statements", "sql_seconds", "queries")
+
+    def __init__(self):
+        self.statements = 0
+        self.sql_seconds = 0.0
+        self.queries = []  # (seconds, statement), the first SLOW_REQUEST_MAX_QUERIES only
+
+
+current_request: contextvars.ContextVar[RequestStats | None] = contextvars.ContextVar("edushare_request", default=None)
+
+
+def instrument_engine(eng, label: str):
+    """Count and time every statement `eng` runs (async engines: their sync core)."""
+    target = getattr(eng, "sync_engine", eng)
+
+    @event.listens_for(target, "before_cursor_execute")
+    def _start(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(target, "after_cursor_execute")
+    def _finish(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        sql_statements.inc((label,))
+        sql_duration.observe((label,), elapsed)
+        stats = current_request.get()
+        if stats is not None:
+            stats.statements += 1
+            stats.sql_seconds += elapsed
+            if len(stats.queries) < settings.SLOW_REQUEST_MAX_QUERIES:
+                stats.queries.append((elapsed, " ".join(statement.split())[:500]))
+
+    @event.listens_for(target, "handle_error")
+    def _failed(ctx):
+        started = ctx.connection.info.get("query_started") if ctx.connection is not None else None
+        if started:
+            started.pop()
+
+
+# ----------------- MIDDLEWARE -----------------
+class MetricsMiddleware:
+    """Pure ASGI (streamed bodies are timed to their last chunk)."""
+
+    def __init__(self, app):
+        self.app = app
+        self._routes = None
+
+    def route_of(self, scope) -> str:
+        if self._routes is None:
+            self._routes = {r.endpoint: r.path for r in scope["app"].routes if hasattr(r, "endpoint")}
+        return self._routes.get(scope.get("endpoint"), "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = RequestStats()
+        token = current_request.set(stats)
+        status = 500
+        started = time.perf_counter()
+        http_in_flight.inc()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            current_request.reset(token)
+            http_in_flight.dec()
+            method, route = scope["method"], self.route_of(scope)
+            http_requests.inc((method, route, str(status)))
+            http_duration.observe((method, route), elapsed)
+            request_statements.observe((method, route), stats.statements)
+            request_sql_seconds.observe((method, route), stats.sql_seconds)
+            if elapsed >= settings.SLOW_REQUEST_SECONDS:
+                log_slow_request(scope, route, status, elapsed, stats)
+
+
+def log_slow_request(scope, route: str, status: int, elapsed: float, stats: RequestStats):
+    queries = "\n".join(f"  {seconds * 1000:8.2f} ms  {sql}" for seconds, sql in stats.queries)
+    more = stats.statements - len(stats.queries)
+    if more > 0:
+        queries += f"\n  ... and {more} more"
+    log.warning(
+        "slow request %s %s (%s) -> %s in %.0f ms, %d statements, %.0f ms SQL\n%s",
+        scope["method"], scope["path"], route, status, elapsed * 1000,
+        stats.statements, stats.sql_seconds * 1000, queries,
+    )
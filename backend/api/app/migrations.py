@@ -0,0 +1,298 @@
+"""
+Versioned schema migrations.
+
+Migrations run in version order, each once per database, and only from
+
+    python -m app.maintenance migrate
+
+(startup.sh runs it before the workers start). Importing the app just reads
+the schema version, one query, and refuses to serve a database that is
+behind the code; a database ahead of it (a rolled-back deploy) is served
+with a warning, as migrations only ever add.
+
+Every migration must be idempotent: on a new database migration 1 creates
+the tables as models.py has them now, so later migrations find their
+columns and indexes already there. Versions 1-8 bring any database from
+before versioning up to date, the way `maintenance upgrade` used to.
+
+Indexes on existing tables go through create_index(): one index per
+transaction, so writers wait for one build at a time rather than the whole
+run, and CONCURRENTLY on PostgreSQL, which doesn't block writers at all.
+SQLite has no online build: writers queue on the lock for as long as one
+index takes (readers carry on under WAL), so the command prints each
+build's time, and big ones belong in a quiet period.
+"""
+import logging
+import re
+import time
+from datetime import datetime
+
+from sqlalchemy import and_, exists, func, inspect, or_, select, text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy.schema import CreateIndex
+
+from .db import Base
+from .models import Change, ChangeLogState, Item, ItemPermission, Job, SchemaVersion, UploadSession, User
+from .search import create_search_index, rebuild_search_index
+from .tree import backfill_paths, recompute_rollups
+
+log = logging.getLogger("edushare.migrations")
+
+# version -> (name, fn(bind) -> list of what it did)
+MIGRATIONS = {}
+
+
+def migration(version: int, name: str):
+    def register(fn):
+        MIGRATIONS[version] = (name, fn)
+        return fn
+    return register
+
+
+def latest_version() -> int:
+    return max(MIGRATIONS)
+
+
+# ----------------- HELPERS -----------------
+def add_missing_columns(bind) -> list[str]:
+    added = []
+    insp = inspect(bind)
+    for table in Base.metadata.sorted_tables:
+        if not insp.has_table(table.name):
+            continue
+        existing = {c["name"] for c in insp.get_columns(table.name)}
+        for col in table.columns:
+            if col.name in existing:
+                continue
+            ddl = f"ALTER TABLE {table.name} ADD COLUMN {col.name} {col.type.compile(dialect=bind.dialect)}"
+            if col.server_default is not None:
+                ddl += f" DEFAULT {col.server_default.arg}"
+            with bind.begin() as conn:
+                conn.execute(text(ddl))
+            added.append(f"{table.name}.{col.name}")
+    return added
+
+
+def create_index(bind, index) -> bool:
+    """Create `index` (a models.py Index) unless it exists; see the module docstring. True if it was built."""
+    if index.name in {ix["name"] for ix in inspect(bind).get_indexes(index.table.name)}:
+        return False
+    ddl = str(CreateIndex(index, if_not_exists=True).compile(dialect=bind.dialect))
+    if bind.dialect.name == "postgresql":
+        ddl = re.sub(r"^CREATE (UNIQUE )?INDEX", r"CREATE \1INDEX CONCURRENTLY", ddl)
+        with bind.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text(ddl))
+    else:
+        with bind.begin() as conn:
+            conn.execute(text(ddl))
+    return True
+
+
+def create_missing_indexes(bind) -> list[str]:
+    created = []
+    for table in Base.metadata.sorted_tables:
+        for index in sorted(table.indexes, key=lambda ix: ix.name):
+            started = time.perf_counter()
+            if create_index(bind, index):
+                created.append(f"index {index.name} ({(time.perf_counter() - started) * 1000:.0f} ms)")
+    return created
+
+
+# every column holding a users.id
+USER_REFERENCES = (
+    Item.owner_user_id,
+    Item.modified_by_user_id,
+    ItemPermission.user_id,
+    UploadSession.user_id,
+    Job.owner_user_id,
+    Change.owner_user_id,
+    Change.actor_user_id,
+    Change.audience_user_id,
+)
+
+
+def merge_duplicate_users(bind) -> list[str]:
+    """
+    Fold users sharing a (provider, provider_user_id), left by concurrent
+    first logins before the unique index, into the oldest of them: their
+    items, grants, uploads, jobs and changes move to it, then they go.
+    """
+    done = []
+    with Session(bind) as db:
+        dupes = (
+            db.query(User.provider, User.provider_user_id, func.min(User.id))
+            .group_by(User.provider, User.provider_user_id)
+            .having(func.count() > 1)
+            .all()
+        )
+        for provider, provider_user_id, keep in dupes:
+            others = [
+                uid for (uid,) in db.query(User.id).filter(
+                    User.provider == provider, User.provider_user_id == provider_user_id, User.id != keep
+                )
+            ]
+            for col in USER_REFERENCES:
+                db.query(col.class_).filter(col.in_(others)).update({col: keep}, synchronize_session=False)
+            db.query(User).filter(User.id.in_(others)).delete(synchronize_session=False)
+            db.query(User).filter(User.id == keep).update(
+                {User.root_version: User.root_version + 1}, synchronize_session=False
+            )
+            done.append(f"users {', '.join(map(str, others))} merged into {keep} ({provider} {provider_user_id})")
+        if dupes:
+            # two grants on one item for the survivor now: keep the stronger
+            other = aliased(ItemPermission)
+            stronger = exists().where(
+                other.item_id == ItemPermission.item_id,
+                other.user_id == ItemPermission.user_id,
+                or_(
+                    and_(other.role == "editor", ItemPermission.role == "viewer"),
+                    and_(other.role == ItemPermission.role, other.id < ItemPermission.id),
+                ),
+            )
+            keeps = [keep for _, _, keep in dupes]
+            db.query(ItemPermission).filter(ItemPermission.user_id.in_(keeps), stronger).delete(
+                synchronize_session=False
+            )
+        db.commit()
+    return done
+
+
+# ----------------- MIGRATIONS -----------------
+@migration(1, "create missing tables")
+def create_tables(bind) -> list[str]:
+    existing = set(inspect(bind).get_table_names())
+    Base.metadata.create_all(bind=bind)
+    return [f"table {t.name}" for t in Base.metadata.sorted_tables if t.name not in existing]
+
+
+@migration(2, "add missing columns")
+def add_columns(bind) -> list[str]:
+    # new rollup columns start at 0; migration 6 fills them once paths exist
+    return [f"column {name}" for name in add_missing_columns(bind)]
+
+
+@migration(3, "fill item paths")
+def fill_paths(bind) -> list[str]:
+    with Session(bind) as db:
+        missing = backfill_paths(db)
+    return [f"{missing} items without a reachable parent"] if missing else []
+
+
+@migration(4, "search index")
+def search_index(bind) -> list[str]:
+    with bind.begin() as conn:
+        if create_search_index(conn):
+            rebuild_search_index(conn)
+            return ["created and filled items_fts"]
+    return []
+
+
+@migration(5, "add missing indexes")
+def add_indexes(bind) -> list[str]:
+    # ux_users_provider_identity can't be built over duplicate users
+    return merge_duplicate_users(bind) + create_missing_indexes(bind)
+
+
+@migration(6, "fill empty folder rollups")
+def fill_rollups(bind) -> list[str]:
+    # Rollup columns added by migration 2 are 0 everywhere, and
+    # recompute_rollups() needs the paths from migration 3: a folder with
+    # children but no descendants counted means they were never filled.
+    # (Also repairs databases whose migration 2 recomputed before paths existed.)
+    child = aliased(Item)
+    with Session(bind) as db:
+        empty = db.query(
+            exists().where(
+                Item.type == "folder",
+                Item.descendant_count == 0,
+                exists().where(child.parent_id == Item.id),
+            )
+        ).scalar()
+        if not empty:
+            return []
+        return [f"rollups recomputed for {recompute_rollups(db)} folders"]
+
+
+@migration(7, "case-insensitive name indexes")
+def nocase_indexes(bind) -> list[str]:
+    # Listings sort names COLLATE NOCASE now; indexes built on the plain
+    # names can't serve that order, so those are built again.
+    if bind.dialect.name != "sqlite":
+        return []
+    rebuilt = []
+    for index in sorted(Item.__table__.indexes, key=lambda ix: ix.name):
+        if "NOCASE" not in str(CreateIndex(index).compile(dialect=bind.dialect)):
+            continue
+        with bind.connect() as conn:
+            sql = conn.execute(
+                text("SELECT sql FROM sqlite_master WHERE type = 'index' AND name = :name"), {"name": index.name}
+            ).scalar()
+        if sql is not None and "NOCASE" in sql.upper():
+            continue
+        started = time.perf_counter()
+        with bind.begin() as conn:  # one transaction: listings never run without it
+            conn.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+            conn.execute(CreateIndex(index))
+        rebuilt.append(f"index {index.name} ({(time.perf_counter() - started) * 1000:.0f} ms)")
+    return rebuilt
+
+
+@migration(8, "change log watermark")
+def change_log_watermark(bind) -> list[str]:
+    ChangeLogState.__table__.create(bind, checkfirst=True)
+    with Session(bind) as db:
+        if db.query(ChangeLogState).first() is not None:
+            return []
+        # what compaction removed so far is unknown: assume everything below
+        # the oldest row, which is what the 410 check used to assume
+        oldest = db.query(func.min(Change.id)).scalar()
+        db.add(ChangeLogState(trimmed_through=oldest - 1 if oldest else 0))
+        db.commit()
+        return [f"change log trimmed through {oldest - 1}"] if oldest and oldest > 1 else []
+
+
+# ----------------- RUNNING -----------------
+def current_version(bind) -> int:
+    """The database's schema version; 0 if it has never been migrated."""
+    try:
+        with bind.connect() as conn:
+            return conn.execute(select(func.max(SchemaVersion.version))).scalar() or 0
+    except SQLAlchemyError:
+        return 0  # no schema_versions table yet
+
+
+def migrate(bind, report=print) -> int:
+    """Apply every migration the database doesn't have yet, in order. Returns how many ran."""
+    SchemaVersion.__table__.create(bind, checkfirst=True)
+    version = current_version(bind)
+    pending = sorted(v for v in MIGRATIONS if v > version)
+    for v in pending:
+        name, fn = MIGRATIONS[v]
+        started = time.perf_counter()
+        done = fn(bind)
+        elapsed = time.perf_counter() - started
+        with bind.begin() as conn:
+            conn.execute(SchemaVersion.__table__.insert().values(version=v, name=name, applied_at=datetime.utcnow()))
+        report(f"{v:>3} {name} ({elapsed:.2f} s)")
+        for line in done:
+            report(f"      {line}")
+    if not pending:
+        report(f"schema is up to date (version {version})")
+    return len(pending)
+
+
+class SchemaOutOfDate(RuntimeError):
+    pass
+
+
+def require_schema(bind):
+    """The app's startup check: one query."""
+    version, latest = current_version(bind), latest_version()
+    if version < latest:
+        raise SchemaOutOfDate(
+            f"database schema is at version {version}, this code needs {latest}: "
+            "run `python -m app.maintenance migrate`"
+        )
+    if version > latest:
+        log.warning("database schema is at version %d, newer than this code (%d)", version, latest)
@@ -1,18 +1,33 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Index, column
 from sqlalchemy.orm import relationship
 from datetime import datetime
-from .db import Base
+from .db import Base, NoCase
 
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (
+        # one row per login identity, even if two first requests race
+        Index("ux_users_provider_identity", "provider", "provider_user_id", unique=True),
+    )
     id = Column(Integer, primary_key=True)
     provider = Column(String, nullable=False)
     provider_user_id = Column(String, nullable=False, index=True)
     display_name = Column(String, nullable=True)
     email = Column(String, nullable=True)
+    # bumped whenever the user's top-level listing changes (ETag of /root)
+    root_version = Column(Integer, nullable=False, default=0, server_default="0")
 
 class Item(Base):
     __tablename__ = "items"
+    __table_args__ = (
+        # keyset-paginated listings (listing.py): one index per sort order,
+        # names in the listings' case-insensitive order
+        Index("ix_items_parent_name", "parent_id", NoCase(column("name", String))),
+        Index("ix_items_parent_modified", "parent_id", "modified_at"),
+        Index("ix_items_parent_size", "parent_id", "size_bytes"),
+        Index("ix_items_parent_type_name", "parent_id", "type", NoCase(column("name", String))),
+        Index("ix_items_owner_parent", "owner_user_id", "parent_id"),
+    )
     id = Column(Integer, primary_key=True)
     parent_id = Column(Integer, ForeignKey("items.id"), nullable=True)
     name = Column(String, nullable=False)
@@ -23,14 +38,29 @@ class Item(Base):
     modified_at = Column(DateTime, default=datetime.utcnow)
     modified_by_user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
 
-    storage_path = Column(String, nullable=True)
+    storage_path = Column(String, nullable=True, index=True)  # storage backend key
+    content_hash = Column(String, nullable=True)  # sha256 hex of the file content
     mime_type = Column(String, nullable=True)
-    size_bytes = Column(Integer, nullable=True)
+    size_bytes = Column(Integer, nullable=True)  # folders: total bytes of all files below
+
+    # folder rollups, maintained as deltas along the ancestor chain (tree.py)
+    file_count = Column(Integer, nullable=False, default=0, server_default="0")
+    descendant_count = Column(Integer, nullable=False, default=0, server_default="0")
+    # bumped whenever this folder's listing changes (ETag of /folders/{id}/children)
+    children_version = Column(Integer, nullable=False, default=0, server_default="0")
+
+    # materialized path "/<top id>/.../<own id>/" (see tree.py)
+    path = Column(String, nullable=True, index=True)
 
     parent = relationship("Item", remote_side=[id])
 
 class ItemPermission(Base):
     __tablename__ = "item_permissions"
+    __table_args__ = (
+        # a user's grants (role checks, /shared-with-me) and an item's grantees
+        Index("ix_item_permissions_user_item", "user_id", "item_id"),
+        Index("ix_item_permissions_item_user", "item_id", "user_id"),
+    )
     id = Column(Integer, primary_key=True)
     item_id = Column(Integer, ForeignKey("items.id"), nullable=False)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -44,3 +74,114 @@ class ShareLink(Base):
     role = Column(String, nullable=False)  # "viewer" or "editor"
     expires_at = Column(DateTime, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
+
+class UploadSession(Base):
+    """A chunked upload in progress; the bytes are staged on disk (storage.py)."""
+    __tablename__ = "upload_sessions"
+    id = Column(String, primary_key=True)  # random hex, used in URLs
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    folder_id = Column(Integer, ForeignKey("items.id"), nullable=False)
+    share_token = Column(String, nullable=True)  # set when started through a share link
+    name = Column(String, nullable=False)
+    mime_type = Column(String, nullable=True)
+    expected_size = Column(Integer, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class Job(Base):
+    """Durable background work (see jobs.py). payload/result are JSON text."""
+    __tablename__ = "jobs"
+    __table_args__ = (
+        Index("ix_jobs_status_id", "status", "id"),
+    )
+    id = Column(Integer, primary_key=True)
+    kind = Column(String, nullable=False)
+    status = Column(String, nullable=False, default="queued")  # queued/running/done/failed
+    payload = Column(Text, nullable=False, default="{}")
+    owner_user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+
+    progress = Column(Integer, nullable=False, default=0)
+    total = Column(Integer, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    error = Column(Text, nullable=True)
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+class Change(Base):
+    """
+    Append-only change log behind /changes (see changes.py). One row per
+    changed item; a moved or deleted folder is one row for the whole subtree.
+    """
+    __tablename__ = "changes"
+    __table_args__ = (
+        Index("ix_changes_item_id", "item_id", "id"),
+        Index("ix_changes_created_at", "created_at"),
+        # ids are the clients' cursors: never hand one out twice
+        {"sqlite_autoincrement": True},
+    )
+    id = Column(Integer, primary_key=True)
+    kind = Column(String, nullable=False)  # create/update/move/delete
+    item_id = Column(Integer, nullable=False)
+    parent_id = Column(Integer, nullable=True)
+    old_parent_id = Column(Integer, nullable=True)  # moves only
+    path = Column(String, nullable=False)  # item path after the change (deletes: before)
+    old_path = Column(String, nullable=True)  # moves only
+    owner_user_id = Column(Integer, nullable=False)
+    actor_user_id = Column(Integer, nullable=True)
+    # set on extra copies of a delete for users whose grants were deleted with the
+    # subtree (they can no longer see it through them); such a row is theirs only
+    audience_user_id = Column(Integer, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class ChangeLogState(Base):
+    """A single row: how far compact_changes has trimmed the change log."""
+    __tablename__ = "change_log_state"
+    id = Column(Integer, primary_key=True)
+    # highest Change.id dropped for age; a cursor behind it may have missed changes
+    trimmed_through = Column(Integer, nullable=False, default=0)
+
+class Preview(Base):
+    """
+    Thumbnail and text snippet of one blob (see previews.py). Keyed by content
+    hash, so identical files share their previews; doubles as the render queue.
+    """
+    __tablename__ = "previews"
+    __table_args__ = (
+        Index("ix_previews_status_created", "status", "created_at"),
+    )
+    content_hash = Column(String, primary_key=True)
+    source_key = Column(String, nullable=False, index=True)  # blob the previews are made from
+    mime_type = Column(String, nullable=True)
+    status = Column(String, nullable=False, default="queued")  # queued/running/ready/none/failed
+    thumbnail_key = Column(String, nullable=True)
+    thumbnail_type = Column(String, nullable=True)
+    snippet_key = Column(String, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class CacheInvalidation(Base):
+    """
+    Cache entries other worker processes must drop (see cache_bus.py). Rows
+    are only kept for CACHE_BUS_RETENTION_SECONDS.
+    """
+    __tablename__ = "cache_invalidations"
+    __table_args__ = (
+        Index("ix_cache_invalidations_created_at", "created_at"),
+        # the pollers' cursor: never hand an id out twice
+        {"sqlite_autoincrement": True},
+    )
+    id = Column(Integer, primary_key=True)
+    origin = Column(String, nullable=False)  # the process that committed it
+    topic = Column(String, nullable=False)  # which cache (session info key)
+    payload = Column(Text, nullable=False)  # JSON list of queued entries
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class SchemaVersion(Base):
+    """Migrations applied to this database (see migrations.py)."""
+    __tablename__ = "schema_versions"
+    version = Column(Integer, primary_key=True, autoincrement=False)
+    name = Column(String, nullable=False)
+    applied_at = Column(DateTime, default=datetime.utcnow)
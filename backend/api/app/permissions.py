@@ -1,27 +1,153 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import and_, cast, event, exists, func, literal, or_, select, String
+from sqlalchemy.orm import Session, aliased, object_session
 from .models import Item, ItemPermission
+from .tree import ancestor_ids
+from .cache import TTLCache
+from . import settings
 
 ROLE_ORDER = {"none": 0, "viewer": 1, "editor": 2, "owner": 3}
 
+# (user_id, item_id) -> (role, item path the role was computed for)
+permission_cache = TTLCache(settings.PERMISSION_CACHE_SIZE, settings.PERMISSION_CACHE_TTL)
+
+# SQLite's default host-parameter limit is 999
+IN_CHUNK = 500
+
+
 def max_role(a: str, b: str) -> str:
     return a if ROLE_ORDER[a] >= ROLE_ORDER[b] else b
 
+
 def get_effective_role(db: Session, user_id: int, item: Item) -> str:
-    if item.owner_user_id == user_id:
-        return "owner"
-
-    role = "none"
-    cur = item
-    while cur is not None:
-        perm = (
-            db.query(ItemPermission)
-            .filter(ItemPermission.item_id == cur.id, ItemPermission.user_id == user_id)
-            .first()
+    return get_effective_roles(db, user_id, [item])[item.id]
+
+
+def get_effective_roles(db: Session, user_id: int, items: list[Item]) -> dict[int, str]:
+    """
+    Roles of one user on many items: {item_id: role}.
+    Grants on an item or any of its ancestors count. Everything not owned
+    and not cached is resolved with one ItemPermission query per 500 ancestors.
+    """
+    roles: dict[int, str] = {}
+    pending: list[Item] = []
+    for item in items:
+        if item.owner_user_id == user_id:
+            roles[item.id] = "owner"
+            continue
+        cached = permission_cache.get((user_id, item.id))
+        # a different path means the item moved since we cached it
+        if cached is not None and cached[1] == item.path:
+            roles[item.id] = cached[0]
+        else:
+            pending.append(item)
+
+    if not pending:
+        return roles
+
+    chains = {item.id: ancestor_ids(item.path) for item in pending}
+    needed = sorted({aid for chain in chains.values() for aid in chain})
+    granted: dict[int, str] = {}
+    for i in range(0, len(needed), IN_CHUNK):
+        rows = (
+            db.query(ItemPermission.item_id, ItemPermission.role)
+            .filter(
+                ItemPermission.user_id == user_id,
+                ItemPermission.item_id.in_(needed[i:i + IN_CHUNK]),
+            )
+            .all()
         )
-        if perm:
-            role = max_role(role, perm.role)
-        if cur.parent_id is None:
-            break
-        cur = db.query(Item).filter(Item.id == cur.parent_id).first()
+        for item_id, perm_role in rows:
+            granted[item_id] = max_role(granted.get(item_id, "none"), perm_role)
+
+    for item in pending:
+        role = "none"
+        for aid in chains[item.id]:
+            if aid in granted:
+                role = max_role(role, granted[aid])
+        roles[item.id] = role
+        permission_cache.set((user_id, item.id), (role, item.path))
+
+    return roles
+
+
+def visible_filter(user_id: int, path_col=Item.path, owner_col=Item.owner_user_id):
+    """
+    SQL predicate for "user_id can at least view this row", for filtering
+    whole result sets at once. Same rules as get_effective_role: the user
+    owns the row, or holds a grant on the row or one of its ancestors.
+    """
+    granted_above = exists().where(
+        ItemPermission.user_id == user_id,
+        func.instr(path_col, literal("/") + cast(ItemPermission.item_id, String) + "/") > 0,
+    )
+    return or_(owner_col == user_id, granted_above)
+
+
+def granted_roots(user_id: int):
+    """
+    Subquery of the items granted to `user_id` that have no granted ancestor:
+    the tops of everything shared with them. Walks each grant's parent chain
+    (one index seek per level on the (user_id, item_id) index), so the cost
+    grows with grants x depth rather than grants x grants.
+    """
+    parent = aliased(Item)
+    chain = (
+        select(ItemPermission.item_id.label("item_id"), Item.parent_id.label("ancestor_id"))
+        .join(Item, Item.id == ItemPermission.item_id)
+        .where(ItemPermission.user_id == user_id)
+        .cte("grant_chain", recursive=True)
+    )
+    chain = chain.union_all(
+        select(chain.c.item_id, parent.parent_id).join(parent, parent.id == chain.c.ancestor_id)
+    )
+    above = aliased(ItemPermission)
+    nested = select(chain.c.item_id).join(
+        above, and_(above.user_id == user_id, above.item_id == chain.c.ancestor_id)
+    )
+    return select(ItemPermission.item_id).where(
+        ItemPermission.user_id == user_id, ItemPermission.item_id.not_in(nested)
+    )
+
+
+# ----------------- CACHE INVALIDATION -----------------
+# Invalidations are queued on the session and applied once the transaction
+# commits, so a rolled-back change never evicts anything and a reader can't
+# re-cache the old role between our eviction and the commit.
+
+def invalidate_subtree_after_commit(db: Session, path: str):
+    """Forget every cached role (any user) for the item at `path` and below it."""
+    db.info.setdefault("permission_invalidations", []).append(("subtree", path, None))
+
+
+def _queue_grant_change(mapper, connection, target: ItemPermission):
+    db = object_session(target)
+    if db is not None:
+        db.info.setdefault("permission_invalidations", []).append(
+            ("grant", target.item_id, target.user_id)
+        )
+
+
+for _evt in ("after_insert", "after_update", "after_delete"):
+    event.listen(ItemPermission, _evt, _queue_grant_change)
+
+
+def apply_permission_invalidations(queued: list[tuple]):
+    """Evict what `queued` invalidates (this process's commits, or another's via cache_bus)."""
+    # all subtrees in one pass over the cache, however many items a request touched
+    paths = tuple(key for kind, key, _ in queued if kind == "subtree")
+    if paths:
+        permission_cache.discard_where(lambda k, v: v[1].startswith(paths))
+    for kind, key, user_id in queued:
+        if kind == "grant":
+            marker = f"/{key}/"
+            permission_cache.discard_where(lambda k, v: k[0] == user_id and marker in v[1])
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_invalidations(db: Session):
+    apply_permission_invalidations(db.info.pop("permission_invalidations", []))
+
 
-    return role
+@event.listens_for(Session, "after_rollback")
+def _drop_invalidations(db: Session):
+    db.info.pop("permission_invalidations", None)
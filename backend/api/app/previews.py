@@ -0,0 +1,370 @@
+"""
+Thumbnail and text-snippet pipeline.
+
+An upload queues a render of its blob as a row in the `previews` table, in
+the upload's own transaction. A dispatcher thread claims queued rows and
+hands them to a process pool of PREVIEW_WORKERS processes (render.py),
+keeping at most PREVIEW_MAX_INFLIGHT renders in the pool at once so a burst
+of uploads never piles up in memory. Outputs are stored next to the blob
+under its content hash: every copy of a deduplicated file shares one set of
+previews.
+
+When more than PREVIEW_QUEUE_MAX renders are waiting, uploads stop queueing
+new ones; the thumbnail endpoint queues them later, on demand, once there
+is room again.
+"""
+import logging
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+
+from fastapi import HTTPException, Request
+from fastapi.responses import JSONResponse
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from starlette.responses import Response
+
+from .db import SessionLocal, run_on_writer
+from .downloads import BlobResponse, not_modified
+from .models import Item, Preview
+from .render import preview_kind, render
+from .storage import StorageBackend, get_storage, READ_SIZE
+from . import settings
+
+log = logging.getLogger("edushare.previews")
+
+PENDING = ("queued", "running")
+
+
+# ----------------- QUEUEING -----------------
+def queue_depth(db: Session) -> int:
+    return db.query(Preview).filter(Preview.status == "queued").count()
+
+
+def queue_preview(db: Session, item: Item) -> str:
+    """
+    Queue the previews of `item`'s blob in the caller's transaction. Returns
+    "queued", "exists" (queued or rendered before, maybe for another copy of
+    the file), "unsupported" or "busy" (queue full, try again later).
+    """
+    if item.type != "file" or not item.content_hash or not item.storage_path:
+        return "unsupported"
+    if preview_kind(item.mime_type) is None or (item.size_bytes or 0) > settings.PREVIEW_MAX_SOURCE_BYTES:
+        return "unsupported"
+    if db.get(Preview, item.content_hash) is not None:
+        return "exists"
+    if queue_depth(db) >= settings.PREVIEW_QUEUE_MAX:
+        preview_worker.counters["shed"] += 1
+        return "busy"
+
+    try:
+        with db.begin_nested():
+            db.add(Preview(content_hash=item.content_hash, source_key=item.storage_path, mime_type=item.mime_type))
+    except IntegrityError:
+        return "exists"  # a concurrent upload of the same content got there first
+    db.info["wake_preview_worker"] = True
+    return "queued"
+
+
+def queue_on_demand(item: Item) -> str:
+    """queue_preview from a read-only request, on a writer session of its own."""
+    def queue(wdb: Session) -> str:
+        outcome = queue_preview(wdb, item)
+        wdb.commit()
+        return outcome
+    return run_on_writer(queue)
+
+
+def drop_previews(db: Session, storage: StorageBackend, source_key: str):
+    """Delete the previews made from a blob that is being removed (caller commits)."""
+    for preview in db.query(Preview).filter(Preview.source_key == source_key).all():
+        for key in (preview.thumbnail_key, preview.snippet_key):
+            if key:
+                storage.delete(key)
+        db.delete(preview)
+
+
+# ----------------- SERVING -----------------
+def preview_response(db: Session, request: Request, item: Item, variant: str) -> Response:
+    """
+    The item's "thumbnail" or "snippet". 202 with Retry-After while it is
+    being rendered, 404 if the file has none. Previews of a blob never
+    change, so the content hash makes a strong validator.
+    """
+    if item.type != "file":
+        raise HTTPException(400, "Only files have previews")
+
+    preview = db.get(Preview, item.content_hash) if item.content_hash else None
+    if preview is None:
+        outcome = queue_on_demand(item)
+        if outcome == "unsupported":
+            raise HTTPException(404, "No preview for this file")
+        if outcome == "busy":
+            raise HTTPException(503, "Preview queue is full", headers={"Retry-After": "30"})
+    if preview is None or preview.status in PENDING:
+        return JSONResponse({"status": "pending"}, status_code=202, headers={"retry-after": "2"})
+
+    key = getattr(preview, f"{variant}_key")
+    if preview.status != "ready" or not key:
+        raise HTTPException(404, "No preview for this file")
+
+    etag = f'"{item.content_hash}-{variant}"'
+    headers = {"etag": etag, "cache-control": "private, max-age=3600", "vary": "X-User"}
+    if not_modified(request, etag, None):
+        return Response(status_code=304, headers=headers)
+
+    headers["content-type"] = preview.thumbnail_type if variant == "thumbnail" else "text/plain; charset=utf-8"
+    storage = get_storage()
+    return BlobResponse(storage, key, 0, storage.size(key) - 1, 200, headers)
+
+
+# ----------------- RENDERING -----------------
+def claim_batch(db: Session, limit: int) -> list[Preview]:
+    """Up to `limit` queued rows, switched to running (see jobs.claim_next)."""
+    claimed = []
+    hashes = [
+        h for (h,) in db.query(Preview.content_hash)
+        .filter(Preview.status == "queued")
+        .order_by(Preview.created_at)
+        .limit(limit)
+    ]
+    for h in hashes:
+        won = (
+            db.query(Preview)
+            .filter(Preview.content_hash == h, Preview.status == "queued")
+            .update(
+                {Preview.status: "running", Preview.attempts: Preview.attempts + 1, Preview.updated_at: datetime.utcnow()},
+                synchronize_session=False,
+            )
+        )
+        db.commit()
+        if won:
+            claimed.append(db.get(Preview, h))
+    return claimed
+
+
+def requeue_stale(db: Session) -> int:
+    """Renders left 'running' by a crashed process go back to the queue after the lease."""
+    cutoff = datetime.utcnow() - timedelta(seconds=settings.PREVIEW_LEASE_SECONDS)
+    n = (
+        db.query(Preview)
+        .filter(Preview.status == "running", Preview.updated_at < cutoff)
+        .update({Preview.status: "queued"}, synchronize_session=False)
+    )
+    db.commit()
+    return n
+
+
+class PreviewWorker:
+    """Feeds queued renders to the process pool and stores what comes back."""
+
+    def __init__(self):
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pool = None
+        self._inflight = {}  # future -> (content_hash, temp source or None, started)
+        self._last_requeue = 0.0
+        self.queue_depth = 0
+        self.render_seconds = 0.0
+        self.counters = {"rendered": 0, "failed": 0, "retried": 0, "shed": 0}
+
+    def wake(self):
+        self._wake.set()
+
+    def stats(self) -> dict:
+        rendered = self.counters["rendered"]
+        return {
+            "workers": settings.PREVIEW_WORKERS,
+            "running": self._thread is not None,
+            "queued": self.queue_depth,
+            "in_flight": len(self._inflight),
+            "max_in_flight": settings.PREVIEW_MAX_INFLIGHT,
+            **self.counters,
+            "avg_render_ms": round(self.render_seconds * 1000 / rendered, 1) if rendered else None,
+        }
+
+    # --- pool ---
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn: the API process has threads and open connections a fork would copy
+            self._pool = ProcessPoolExecutor(
+                max_workers=max(settings.PREVIEW_WORKERS, 1),
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._pool
+
+    def _reset_pool(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def _tmp_dir(self) -> str:
+        path = os.path.join(settings.STORAGE_DIR, "previews-tmp")
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    # --- dispatch ---
+    def _submit(self, db: Session, preview: Preview):
+        storage = get_storage()
+        kind = preview_kind(preview.mime_type)
+        if kind is None or not storage.exists(preview.source_key):
+            preview.status = "none"
+            preview.updated_at = datetime.utcnow()
+            db.commit()
+            return
+
+        tmp_src = None
+        src = storage.local_path(preview.source_key)
+        if src is None:
+            # the pool reads files: stage blobs of non-local backends first
+            tmp_src = os.path.join(self._tmp_dir(), uuid.uuid4().hex + ".src")
+            with storage.open(preview.source_key) as fh, open(tmp_src, "wb") as out:
+                shutil.copyfileobj(fh, out, READ_SIZE)
+            src = tmp_src
+
+        out_base = os.path.join(self._tmp_dir(), uuid.uuid4().hex)
+        future = self._get_pool().submit(
+            render, kind, src, out_base, settings.THUMBNAIL_SIZE, settings.SNIPPET_CHARS
+        )
+        self._inflight[future] = (preview.content_hash, tmp_src, time.monotonic())
+
+    def _finish(self, db: Session, future):
+        content_hash, tmp_src, started = self._inflight.pop(future)
+        if tmp_src:
+            os.remove(tmp_src)
+        error = None
+        try:
+            out = future.result()
+        except BrokenProcessPool as e:
+            # a render crashed its process; every future of the pool fails with it
+            self._reset_pool()
+            error = e
+        except Exception as e:
+            error = e
+
+        preview = db.get(Preview, content_hash)
+        storage = get_storage()
+        if error is None:
+            self.counters["rendered"] += 1
+            self.render_seconds += time.monotonic() - started
+            thumbnail, snippet = out["thumbnail"], out["snippet"]
+            if preview is None:
+                # the blob was reclaimed while rendering
+                for path in (thumbnail and thumbnail[0], snippet):
+                    if path:
+                        os.remove(path)
+                return
+            if thumbnail:
+                path, content_type = thumbnail
+                preview.thumbnail_key = storage.put_derived(content_hash, "thumb" + os.path.splitext(path)[1], path)
+                preview.thumbnail_type = content_type
+            if snippet:
+                preview.snippet_key = storage.put_derived(content_hash, "snippet.txt", snippet)
+            preview.status = "ready" if thumbnail or snippet else "none"
+            preview.error = None
+        else:
+            log.warning("preview of %s failed: %r", content_hash, error)
+            if preview is None:
+                return
+            preview.error = repr(error)
+            if preview.attempts >= settings.PREVIEW_MAX_ATTEMPTS:
+                preview.status = "failed"
+                self.counters["failed"] += 1
+            else:
+                preview.status = "queued"
+                self.counters["retried"] += 1
+        preview.updated_at = datetime.utcnow()
+        db.commit()
+
+    def step(self, db: Session, timeout: float) -> bool:
+        """Top up the pool, then wait up to `timeout` for renders to finish. False when idle."""
+        now = time.monotonic()
+        if now - self._last_requeue > settings.PREVIEW_LEASE_SECONDS / 2:
+            requeue_stale(db)
+            self._last_requeue = now
+
+        self.queue_depth = queue_depth(db)
+        free = settings.PREVIEW_MAX_INFLIGHT - len(self._inflight)
+        if free > 0 and self.queue_depth:
+            for preview in claim_batch(db, free):
+                self._submit(db, preview)
+            self.queue_depth = queue_depth(db)
+
+        if not self._inflight:
+            return False
+        done, _ = wait(list(self._inflight), timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            self._finish(db, future)
+        return True
+
+    def run_pending(self) -> None:
+        """Render everything queued, in this thread (CLI, maintenance)."""
+        db = SessionLocal()
+        try:
+            while self.step(db, settings.JOB_POLL_SECONDS) or self.queue_depth:
+                pass
+        finally:
+            db.close()
+
+    def _loop(self):
+        db = SessionLocal()
+        try:
+            while not self._stop.is_set():
+                try:
+                    busy = self.step(db, settings.JOB_POLL_SECONDS / 4)
+                except Exception:
+                    log.exception("preview worker iteration failed")
+                    db.rollback()
+                    busy = False
+                if not busy:
+                    self._wake.wait(settings.JOB_POLL_SECONDS)
+                    self._wake.clear()
+        finally:
+            db.close()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="edushare-previews", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+        self._reset_pool()
+
+
+preview_worker = PreviewWorker()
+
+
+@event.listens_for(Session, "after_commit")
+def _wake_worker(db: Session):
+    if db.info.pop("wake_preview_worker", False):
+        preview_worker.wake()
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_wake(db: Session):
+    db.info.pop("wake_preview_worker", None)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    preview_worker.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        preview_worker.stop()
@@ -0,0 +1,109 @@
+"""
+Preview rendering. Runs inside the preview process pool (previews.py).
+
+Nothing here touches the database or the app's settings, so pool processes
+start quickly. Pillow renders image thumbnails and pypdfium2 the first page
+of PDFs; without them those types simply get no thumbnail.
+
+Both are only imported by the renderers, in the pool processes: the API
+processes import this module for preview_kind() and would otherwise pay for
+loading them (about 60 ms per worker start) without ever using them.
+"""
+from importlib.util import find_spec
+
+# optional
+HAS_PILLOW = find_spec("PIL") is not None
+HAS_PDFIUM = find_spec("pypdfium2") is not None
+
+# besides text/*
+TEXT_TYPES = {
+    "application/json",
+    "application/xml",
+    "application/javascript",
+    "application/x-yaml",
+    "application/x-sh",
+}
+# formats Pillow opens that browsers may not: everything becomes JPEG/PNG anyway
+SKIP_IMAGE_TYPES = {"image/svg+xml"}
+
+
+def preview_kind(mime_type: str | None) -> str | None:
+    """Which renderer handles this type here, or None if it gets no previews."""
+    mt = (mime_type or "").split(";")[0].strip().lower()
+    if mt.startswith("image/") and mt not in SKIP_IMAGE_TYPES:
+        return "image" if HAS_PILLOW else None
+    if mt == "application/pdf":
+        return "pdf" if HAS_PDFIUM and HAS_PILLOW else None
+    if mt.startswith("text/") or mt in TEXT_TYPES:
+        return "text"
+    return None
+
+
+def save_thumbnail(im, out_base: str) -> tuple[str, str]:
+    """Write `im` as JPEG, or PNG if it has transparency; returns (path, content type)."""
+    if im.mode in ("RGBA", "LA") or (im.mode == "P" and "transparency" in im.info):
+        path = out_base + ".png"
+        im.convert("RGBA").save(path, "PNG", optimize=True)
+        return path, "image/png"
+    path = out_base + ".jpg"
+    im.convert("RGB").save(path, "JPEG", quality=80, optimize=True)
+    return path, "image/jpeg"
+
+
+def save_snippet(text: str, out_base: str, chars: int) -> str | None:
+    text = text.replace("\r\n", "\n").strip()[:chars]
+    if not text:
+        return None
+    path = out_base + ".txt"
+    with open(path, "w", encoding="utf-8") as fh:
+        fh.write(text)
+    return path
+
+
+def render_image(src: str, out_base: str, size: int) -> dict:
+    from PIL import Image, ImageOps
+
+    with Image.open(src) as im:
+        im.draft("RGB", (size, size))  # JPEG: decode at a reduced scale
+        im = ImageOps.exif_transpose(im)
+        im.thumbnail((size, size))
+        return {"thumbnail": save_thumbnail(im, out_base)}
+
+
+def render_pdf(src: str, out_base: str, size: int, chars: int) -> dict:
+    import pypdfium2 as pdfium
+
+    pdf = pdfium.PdfDocument(src)
+    try:
+        page = pdf[0]
+        width, height = page.get_size()
+        im = page.render(scale=size / max(width, height, 1)).to_pil()
+        textpage = page.get_textpage()
+        text = textpage.get_text_range(count=min(chars * 2, textpage.count_chars()))
+        textpage.close()
+        page.close()
+    finally:
+        pdf.close()
+    return {"thumbnail": save_thumbnail(im, out_base), "snippet": save_snippet(text, out_base, chars)}
+
+
+def render_text(src: str, out_base: str, chars: int) -> dict:
+    with open(src, "rb") as fh:
+        head = fh.read(chars * 4)  # enough bytes for `chars` characters of UTF-8
+    return {"snippet": save_snippet(head.decode("utf-8", errors="replace"), out_base, chars)}
+
+
+def render(kind: str, src: str, out_base: str, size: int, chars: int) -> dict:
+    """
+    Render the previews of one file into files starting with `out_base`:
+    {"thumbnail": (path, content type) | None, "snippet": path | None}.
+    """
+    if kind == "image":
+        out = render_image(src, out_base, size)
+    elif kind == "pdf":
+        out = render_pdf(src, out_base, size, chars)
+    elif kind == "text":
+        out = render_text(src, out_base, chars)
+    else:
+        raise ValueError(f"No renderer for {kind!r}")
+    return {"thumbnail": out.get("thumbnail"), "snippet": out.get("snippet")}
@@ -1,6 +1,6 @@
 from datetime import datetime
 from pydantic import BaseModel
-from typing import Optional
+from typing import Literal, Optional
 
 
 class ItemOut(BaseModel):
@@ -10,7 +10,9 @@ class ItemOut(BaseModel):
     parent_id: Optional[int] = None
 
     mime_type: Optional[str] = None
-    size_bytes: int = 0
+    size_bytes: int = 0  # folders: total of everything inside
+    file_count: int = 0  # folders only
+    descendant_count: int = 0  # folders only
 
     modified_at: Optional[datetime] = None
     modified_by: Optional[str] = None  # friendly name (we’ll fill this in main.py)
@@ -32,6 +34,33 @@ class MoveIn(BaseModel):
     new_parent_id: Optional[int] = None
 
 
+class CopyIn(BaseModel):
+    new_parent_id: Optional[int] = None  # None = top level
+    new_name: Optional[str] = None  # default: the original's name
+
+
+class BatchOp(BaseModel):
+    op: Literal["move", "delete", "rename", "copy"]
+    item_id: int
+    new_parent_id: Optional[int] = None  # move, copy (None = top level)
+    new_name: Optional[str] = None  # rename, copy
+
+
+class BatchIn(BaseModel):
+    ops: list[BatchOp]
+
+
+class UploadInitIn(BaseModel):
+    folder_id: int
+    name: str
+    size: Optional[int] = None  # total bytes, checked at commit when given
+    mime_type: Optional[str] = None
+
+
+class ArchiveIn(BaseModel):
+    item_ids: list[int]  # the portal's multi-selection
+
+
 class CreateShareLinkIn(BaseModel):
     role: str                  # "viewer" | "editor"
     expires_in_hours: Optional[int] = None
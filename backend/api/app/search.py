@@ -0,0 +1,102 @@
+import re
+
+from fastapi import HTTPException
+from sqlalchemy import column, event, table, text
+from sqlalchemy.orm import Session
+
+from .models import Item
+
+# Full-text index over Item.name / Item.mime_type.
+# items_fts is an FTS5 "external content" table: it stores only the index and
+# reads the text back from items. Triggers keep it in sync for every write,
+# including bulk UPDATE/DELETE statements that bypass the ORM. Moves don't
+# touch it at all: scoping is done against items.path at query time.
+SEARCH_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5(
+        name, mime_type,
+        content='items', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS items_fts_ai AFTER INSERT ON items BEGIN
+        INSERT INTO items_fts(rowid, name, mime_type) VALUES (new.id, new.name, new.mime_type);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS items_fts_ad AFTER DELETE ON items BEGIN
+        INSERT INTO items_fts(items_fts, rowid, name, mime_type)
+        VALUES ('delete', old.id, old.name, old.mime_type);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS items_fts_au AFTER UPDATE OF name, mime_type ON items BEGIN
+        INSERT INTO items_fts(items_fts, rowid, name, mime_type)
+        VALUES ('delete', old.id, old.name, old.mime_type);
+        INSERT INTO items_fts(rowid, name, mime_type) VALUES (new.id, new.name, new.mime_type);
+    END
+    """,
+]
+
+items_fts = table("items_fts", column("rowid"))
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def create_search_index(conn) -> bool:
+    """Create items_fts + triggers if missing. Returns True if it had to be created."""
+    if conn.dialect.name != "sqlite":
+        return False
+    exists = conn.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'items_fts'")
+    ).first()
+    for ddl in SEARCH_DDL:
+        conn.execute(text(ddl))
+    return exists is None
+
+
+def rebuild_search_index(conn):
+    conn.execute(text("INSERT INTO items_fts(items_fts) VALUES ('rebuild')"))
+
+
+@event.listens_for(Item.__table__, "after_create")
+def _create_with_items(target, conn, **kw):
+    create_search_index(conn)
+
+
+def match_expression(q: str) -> str | None:
+    """'week 3 slid' -> '"week"* "3"* "slid"*' (every word, as a prefix)."""
+    tokens = TOKEN_RE.findall(q)
+    if not tokens:
+        return None
+    return " ".join(f'"{tok}"*' for tok in tokens[:16])
+
+
+def search_items(db: Session, q: str, scope, limit: int, offset: int) -> tuple[list[Item], int | None]:
+    """
+    Ranked search restricted by `scope` (a SQL predicate on Item).
+    Returns (page, next_offset).
+    """
+    match = match_expression(q)
+    if match is None:
+        raise HTTPException(400, "Search query must contain a word")
+
+    query = db.query(Item).filter(scope)
+    if db.get_bind().dialect.name == "sqlite":
+        query = (
+            query.join(items_fts, items_fts.c.rowid == Item.id)
+            .filter(text("items_fts MATCH :match").bindparams(match=match))
+            .order_by(text("items_fts.rank"), Item.id)
+        )
+    else:
+        # no FTS5 off SQLite: every word must appear somewhere in the name
+        for tok in TOKEN_RE.findall(q)[:16]:
+            query = query.filter(Item.name.ilike(f"%{tok}%"))
+        query = query.order_by(Item.name, Item.id)
+
+    rows = query.offset(offset).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    return rows[:limit], offset + limit
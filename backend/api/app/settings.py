@@ -0,0 +1,138 @@
+import os
+
+# All knobs come from the environment so the same build runs locally and in Azure.
+
+
+def env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value not in (None, "") else default
+
+
+def env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    return float(value) if value not in (None, "") else default
+
+
+# ----------------- DATABASE -----------------
+# Any SQLAlchemy URL; only the URL changes for a server database.
+DATABASE_URL = os.getenv("EDUSHARE_DATABASE_URL", "sqlite:////home/edushare.db")
+# GET endpoints read through their own pool; point this at a replica if there is one.
+DATABASE_READ_URL = os.getenv("EDUSHARE_DATABASE_READ_URL") or DATABASE_URL
+# 1 = serve database-only endpoints as coroutines on an async engine
+# (aiosqlite / asyncpg) instead of in the threadpool; see aio.py.
+DB_ASYNC = env_int("EDUSHARE_DB_ASYNC", 0) == 1
+DB_POOL_SIZE = env_int("EDUSHARE_DB_POOL_SIZE", 5)
+DB_MAX_OVERFLOW = env_int("EDUSHARE_DB_MAX_OVERFLOW", 10)
+DB_READ_POOL_SIZE = env_int("EDUSHARE_DB_READ_POOL_SIZE", 10)
+DB_READ_MAX_OVERFLOW = env_int("EDUSHARE_DB_READ_MAX_OVERFLOW", 20)
+DB_POOL_TIMEOUT = env_float("EDUSHARE_DB_POOL_TIMEOUT", 30)
+DB_POOL_RECYCLE = env_int("EDUSHARE_DB_POOL_RECYCLE", 1800)
+# SQLite only. WAL needs shared memory between processes, which network
+# filesystems may not provide: fall back to DELETE there.
+SQLITE_JOURNAL_MODE = os.getenv("EDUSHARE_SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("EDUSHARE_SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_CACHE_SIZE_KB = env_int("EDUSHARE_SQLITE_CACHE_SIZE_KB", 64 * 1024)
+SQLITE_MMAP_SIZE = env_int("EDUSHARE_SQLITE_MMAP_SIZE", 256 * 1024 * 1024)
+SQLITE_BUSY_TIMEOUT_MS = env_int("EDUSHARE_SQLITE_BUSY_TIMEOUT_MS", 5000)
+
+# ----------------- CACHES -----------------
+PERMISSION_CACHE_SIZE = env_int("EDUSHARE_PERMISSION_CACHE_SIZE", 50_000)
+PERMISSION_CACHE_TTL = env_float("EDUSHARE_PERMISSION_CACHE_TTL", 300)
+IDENTITY_CACHE_SIZE = env_int("EDUSHARE_IDENTITY_CACHE_SIZE", 10_000)
+IDENTITY_CACHE_TTL = env_float("EDUSHARE_IDENTITY_CACHE_TTL", 600)
+SHARE_CACHE_SIZE = env_int("EDUSHARE_SHARE_CACHE_SIZE", 10_000)
+SHARE_CACHE_TTL = env_float("EDUSHARE_SHARE_CACHE_TTL", 300)
+
+# With several worker processes each has its own caches; commits are
+# announced through the cache_invalidations table, which every process polls
+# this often (so other workers drop stale entries within about this delay;
+# 0 = single process, no polling). Rows are kept for the retention period; a
+# process that fell further behind than that clears its caches.
+CACHE_BUS_POLL_SECONDS = env_float("EDUSHARE_CACHE_BUS_POLL_SECONDS", 1.0)
+CACHE_BUS_RETENTION_SECONDS = env_float("EDUSHARE_CACHE_BUS_RETENTION_SECONDS", 600)
+
+# ----------------- LISTINGS -----------------
+LIST_PAGE_SIZE = env_int("EDUSHARE_LIST_PAGE_SIZE", 200)
+LIST_PAGE_SIZE_MAX = env_int("EDUSHARE_LIST_PAGE_SIZE_MAX", 1000)
+SEARCH_PAGE_SIZE = env_int("EDUSHARE_SEARCH_PAGE_SIZE", 50)
+SEARCH_PAGE_SIZE_MAX = env_int("EDUSHARE_SEARCH_PAGE_SIZE_MAX", 200)
+
+# ----------------- FILE STORAGE -----------------
+STORAGE_BACKEND = os.getenv("EDUSHARE_STORAGE_BACKEND", "local")
+STORAGE_DIR = os.getenv("EDUSHARE_STORAGE_DIR", "/home/edushare_storage")
+UPLOAD_CHUNK_SIZE = env_int("EDUSHARE_UPLOAD_CHUNK_SIZE", 8 * 1024 * 1024)
+UPLOAD_MAX_CHUNK_SIZE = env_int("EDUSHARE_UPLOAD_MAX_CHUNK_SIZE", 64 * 1024 * 1024)
+# whole file, however it is uploaded
+UPLOAD_MAX_SIZE = env_int("EDUSHARE_UPLOAD_MAX_SIZE", 10 * 1024 * 1024 * 1024)
+# chunked uploads nobody has written to for this long are dropped with their
+# staged bytes, by a job queued this often
+UPLOAD_EXPIRE_SECONDS = env_float("EDUSHARE_UPLOAD_EXPIRE_SECONDS", 24 * 3600)
+UPLOAD_EXPIRE_EVERY_SECONDS = env_float("EDUSHARE_UPLOAD_EXPIRE_EVERY_SECONDS", 3600)
+ARCHIVE_MAX_SELECTION = env_int("EDUSHARE_ARCHIVE_MAX_SELECTION", 1000)
+
+# ----------------- PREVIEWS -----------------
+# Thumbnails / snippets are rendered in a process pool next to the API
+# (0 workers = off). Pillow renders images, pypdfium2 PDFs; both optional.
+PREVIEW_WORKERS = env_int("EDUSHARE_PREVIEW_WORKERS", 2)
+# renders handed to the pool at once; the rest wait in the previews table
+PREVIEW_MAX_INFLIGHT = env_int("EDUSHARE_PREVIEW_MAX_INFLIGHT", 4)
+# beyond this many queued renders uploads stop queueing new ones; those files
+# get queued when their thumbnail is first asked for
+PREVIEW_QUEUE_MAX = env_int("EDUSHARE_PREVIEW_QUEUE_MAX", 1000)
+PREVIEW_MAX_SOURCE_BYTES = env_int("EDUSHARE_PREVIEW_MAX_SOURCE_BYTES", 100 * 1024 * 1024)
+PREVIEW_LEASE_SECONDS = env_float("EDUSHARE_PREVIEW_LEASE_SECONDS", 300)
+PREVIEW_MAX_ATTEMPTS = env_int("EDUSHARE_PREVIEW_MAX_ATTEMPTS", 3)
+THUMBNAIL_SIZE = env_int("EDUSHARE_THUMBNAIL_SIZE", 256)
+SNIPPET_CHARS = env_int("EDUSHARE_SNIPPET_CHARS", 500)
+
+# ----------------- BULK OPERATIONS -----------------
+BATCH_MAX_OPS = env_int("EDUSHARE_BATCH_MAX_OPS", 1000)
+# copies of bigger subtrees (items, the root included) run as a background job
+COPY_SYNC_MAX_ITEMS = env_int("EDUSHARE_COPY_SYNC_MAX_ITEMS", 2000)
+# rows per INSERT batch; a copy job commits and reports progress after each
+COPY_BATCH_SIZE = env_int("EDUSHARE_COPY_BATCH_SIZE", 1000)
+
+# ----------------- BACKGROUND JOBS -----------------
+JOB_WORKER_ENABLED = env_int("EDUSHARE_JOB_WORKER", 1) == 1
+JOB_POLL_SECONDS = env_float("EDUSHARE_JOB_POLL_SECONDS", 2.0)
+JOB_LEASE_SECONDS = env_float("EDUSHARE_JOB_LEASE_SECONDS", 600)
+JOB_MAX_ATTEMPTS = env_int("EDUSHARE_JOB_MAX_ATTEMPTS", 5)
+# With several workers only the one holding this lock file runs the job and
+# preview workers (default: one per database, in the temp dir).
+BACKGROUND_LOCK_FILE = os.getenv("EDUSHARE_BACKGROUND_LOCK_FILE", "")
+
+# ----------------- CHANGE FEED -----------------
+CHANGES_PAGE_SIZE = env_int("EDUSHARE_CHANGES_PAGE_SIZE", 500)
+CHANGES_PAGE_SIZE_MAX = env_int("EDUSHARE_CHANGES_PAGE_SIZE_MAX", 2000)
+# streams are woken by commits in this process, and by the cache bus poll
+# for other processes' commits; without one they re-check this often (also
+# the heartbeat interval)
+CHANGES_STREAM_POLL_SECONDS = env_float("EDUSHARE_CHANGES_STREAM_POLL_SECONDS", 10)
+CHANGES_RETENTION_DAYS = env_float("EDUSHARE_CHANGES_RETENTION_DAYS", 30)
+CHANGES_COMPACT_EVERY_SECONDS = env_float("EDUSHARE_CHANGES_COMPACT_EVERY_SECONDS", 3600)
+
+# ----------------- SERVER -----------------
+# gunicorn.conf.py: uvicorn worker processes (WEB_CONCURRENCY if unset)
+WORKERS = env_int("EDUSHARE_WORKERS", env_int("WEB_CONCURRENCY", 1))
+
+# ----------------- ADMISSION CONTROL -----------------
+# Token buckets per user and per share token (see limits.py): a budget
+# refills at PER_SECOND tokens a second up to BURST; 0 per second = no
+# limit. A share link's buckets are spent by everyone using the link.
+ADMISSION_ENABLED = env_int("EDUSHARE_ADMISSION", 1) == 1
+RATE_READ_PER_SECOND = env_float("EDUSHARE_RATE_READ_PER_SECOND", 50)
+RATE_READ_BURST = env_float("EDUSHARE_RATE_READ_BURST", 200)
+RATE_WRITE_PER_SECOND = env_float("EDUSHARE_RATE_WRITE_PER_SECOND", 10)
+RATE_WRITE_BURST = env_float("EDUSHARE_RATE_WRITE_BURST", 100)
+# deletes, archives, copies and batches
+RATE_HEAVY_PER_SECOND = env_float("EDUSHARE_RATE_HEAVY_PER_SECOND", 1)
+RATE_HEAVY_BURST = env_float("EDUSHARE_RATE_HEAVY_BURST", 20)
+RATE_LIMIT_MAX_KEYS = env_int("EDUSHARE_RATE_LIMIT_MAX_KEYS", 100_000)
+# requests served at once per process before new ones get a 503 (0 = no cap);
+# keep it near the threadpool size (40) so the queue never builds up there
+ADMISSION_MAX_IN_FLIGHT = env_int("EDUSHARE_ADMISSION_MAX_IN_FLIGHT", 48)
+
+# ----------------- OBSERVABILITY -----------------
+# requests slower than this are logged ("edushare.slow") with their SQL
+SLOW_REQUEST_SECONDS = env_float("EDUSHARE_SLOW_REQUEST_SECONDS", 1.0)
+SLOW_REQUEST_MAX_QUERIES = env_int("EDUSHARE_SLOW_REQUEST_MAX_QUERIES", 50)
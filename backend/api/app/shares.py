@@ -0,0 +1,116 @@
+from dataclasses import dataclass
+from datetime import datetime
+
+from fastapi import Depends, HTTPException
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from .cache import TTLCache
+from .db import get_async_read_db, get_read_db
+from .models import Item, ShareLink
+from .permissions import ROLE_ORDER
+from .tree import in_subtree
+from . import settings
+
+
+@dataclass(frozen=True)
+class ShareContext:
+    """Everything a /s/{token} request needs to know about its link, resolved once."""
+
+    token: str
+    role: str
+    expires_at: datetime | None
+    root_id: int
+    root_type: str
+    root_path: str
+
+    @property
+    def is_folder(self) -> bool:
+        return self.root_type == "folder"
+
+    def require(self, needed: str) -> "ShareContext":
+        if ROLE_ORDER[self.role] < ROLE_ORDER[needed]:
+            raise HTTPException(403, f"Share link does not allow {needed}")
+        return self
+
+    def require_folder(self) -> "ShareContext":
+        if not self.is_folder:
+            raise HTTPException(400, "Link is not for a folder")
+        return self
+
+    def contains(self, item: Item) -> bool:
+        """True if `item` is the shared item or (for folder links) below it."""
+        if self.is_folder:
+            return in_subtree(item.path, self.root_path)
+        return item.id == self.root_id
+
+
+# token -> ShareContext; an entry never outlives the link's expires_at
+share_cache = TTLCache(settings.SHARE_CACHE_SIZE, settings.SHARE_CACHE_TTL)
+
+
+def resolve_share(db: Session, token: str) -> ShareContext:
+    share = share_cache.get(token)
+    if share is None:
+        row = (
+            db.query(ShareLink.role, ShareLink.expires_at, Item.id, Item.type, Item.path)
+            .join(Item, Item.id == ShareLink.item_id)
+            .filter(ShareLink.token == token)
+            .first()
+        )
+        if row is None:
+            raise HTTPException(status_code=404, detail="Share link not found")
+        share = ShareContext(token, *row)
+        ttl = settings.SHARE_CACHE_TTL
+        if share.expires_at is not None:
+            ttl = min(ttl, (share.expires_at - datetime.utcnow()).total_seconds())
+        share_cache.set(token, share, ttl)
+
+    if share.expires_at and share.expires_at < datetime.utcnow():
+        raise HTTPException(status_code=410, detail="Share link expired")
+    return share
+
+
+def share_context(token: str, db: Session = Depends(get_read_db)) -> ShareContext:
+    return resolve_share(db, token)
+
+
+async def share_context_async(token: str, db=Depends(get_async_read_db)) -> ShareContext:
+    return await db.run_sync(resolve_share, token)
+
+
+# ----------------- CACHE INVALIDATION -----------------
+# Same scheme as permissions.py: queued on the session, applied after commit.
+
+def invalidate_shares_after_commit(db: Session, path: str):
+    """Forget cached links whose root is the item at `path` or below it (moves, deletes)."""
+    db.info.setdefault("share_invalidations", []).append(("subtree", path))
+
+
+def _queue_link_change(mapper, connection, target: ShareLink):
+    db = object_session(target)
+    if db is not None:
+        db.info.setdefault("share_invalidations", []).append(("token", target.token))
+
+
+for _evt in ("after_update", "after_delete"):
+    event.listen(ShareLink, _evt, _queue_link_change)
+
+
+def apply_share_invalidations(queued: list[tuple]):
+    paths = tuple(key for kind, key in queued if kind == "subtree")
+    if paths:
+        share_cache.discard_where(lambda k, v: v.root_path.startswith(paths))
+    for kind, key in queued:
+        if kind == "token":
+            share_cache.pop(key)
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_invalidations(db: Session):
+    apply_share_invalidations(db.info.pop("share_invalidations", []))
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_invalidations(db: Session):
+    db.info.pop("share_invalidations", None)
@@ -0,0 +1,287 @@
+"""
+Blob storage for uploaded files.
+
+Uploads are staged on local disk (one growing .part file per upload, with a
+running sha256), then handed to a StorageBackend, which stores each blob
+under the hash of its content: identical files are only stored once and
+Item.storage_path holds the backend key.
+
+Backends are picked with EDUSHARE_STORAGE_BACKEND; "local" keeps blobs in
+EDUSHARE_STORAGE_DIR and needs nothing else.
+"""
+import abc
+import hashlib
+import os
+import shutil
+import threading
+
+try:
+    import fcntl
+except ImportError:  # no flock (Windows): uploads are only locked within one process
+    fcntl = None
+
+from . import settings
+
+READ_SIZE = 1024 * 1024
+
+
+class StorageBackend(abc.ABC):
+    """
+    Content-addressed blob store. Keys are opaque strings owned by the backend.
+    A backend that misses one of the abstract methods can't be instantiated.
+    """
+
+    @abc.abstractmethod
+    def put(self, digest: str, staged_path: str) -> str:
+        """Store the staged file as the blob for `digest` and return its key."""
+
+    @abc.abstractmethod
+    def put_derived(self, digest: str, suffix: str, staged_path: str) -> str:
+        """Store a file derived from blob `digest` (a thumbnail, ...) next to it."""
+
+    @abc.abstractmethod
+    def open(self, key: str):
+        """Binary file object positioned at the start of the blob."""
+
+    def local_path(self, key: str) -> str | None:
+        """Filesystem path of the blob if the backend has one (enables sendfile)."""
+        return None
+
+    @abc.abstractmethod
+    def size(self, key: str) -> int:
+        """Size of the blob in bytes."""
+
+    @abc.abstractmethod
+    def exists(self, key: str) -> bool:
+        """Whether a blob is stored under `key`."""
+
+    @abc.abstractmethod
+    def delete(self, key: str):
+        """Remove the blob; a missing one is not an error."""
+
+
+class LocalStorage(StorageBackend):
+    def __init__(self, root: str):
+        self.root = root
+
+    def key_for(self, digest: str) -> str:
+        return f"sha256/{digest[:2]}/{digest[2:4]}/{digest}"
+
+    def local_path(self, key: str) -> str:
+        # items stored before content addressing hold an absolute path
+        return key if os.path.isabs(key) else os.path.join(self.root, key)
+
+    def put(self, digest: str, staged_path: str) -> str:
+        key = self.key_for(digest)
+        dest = self.local_path(key)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        # Replace even if the blob exists: the rename is atomic. It does not
+        # protect the blob from a reclaim job by itself: callers put only after
+        # flushing the row that references it (main.finish_upload).
+        os.replace(staged_path, dest)
+        return key
+
+    def put_derived(self, digest: str, suffix: str, staged_path: str) -> str:
+        key = f"{self.key_for(digest)}.{suffix}"
+        dest = self.local_path(key)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        os.replace(staged_path, dest)
+        return key
+
+    def open(self, key: str):
+        return open(self.local_path(key), "rb")
+
+    def size(self, key: str) -> int:
+        return os.path.getsize(self.local_path(key))
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self.local_path(key))
+
+    def delete(self, key: str):
+        try:
+            os.remove(self.local_path(key))
+        except FileNotFoundError:
+            pass
+
+
+BACKENDS = {
+    "local": lambda: LocalStorage(os.path.join(settings.STORAGE_DIR, "blobs")),
+}
+
+_storage = None
+
+
+def get_storage() -> StorageBackend:
+    global _storage
+    if _storage is None:
+        if settings.STORAGE_BACKEND not in BACKENDS:
+            raise RuntimeError(f"Unknown storage backend {settings.STORAGE_BACKEND!r}")
+        _storage = BACKENDS[settings.STORAGE_BACKEND]()
+    return _storage
+
+
+# ----------------- UPLOAD STAGING -----------------
+class ChunkWriter:
+    """Appends to a staged upload while feeding the running hash."""
+
+    def __init__(self, staging: "StagingArea", upload_id: str, offset: int):
+        self.staging = staging
+        self.upload_id = upload_id
+        self.hasher = staging._hasher_at(upload_id, offset)
+        self.offset = offset
+        self.fh = open(staging.path(upload_id), "r+b" if offset else "wb")
+        self.fh.truncate(offset)
+        self.fh.seek(offset)
+
+    def write(self, data: bytes):
+        self.fh.write(data)
+        self.hasher.update(data)
+        self.offset += len(data)
+
+    def close(self) -> int:
+        self.fh.flush()
+        st = os.fstat(self.fh.fileno())
+        self.fh.close()
+        self.staging._hashes[self.upload_id] = (self.offset, st.st_mtime_ns, self.hasher)
+        return self.offset
+
+    def abort(self):
+        # bytes already on disk stay; the saved hash no longer matches, so it
+        # is recomputed from the file on the next chunk
+        self.fh.close()
+        self.staging._hashes.pop(self.upload_id, None)
+
+
+class UploadLock:
+    """
+    Exclusive hold on one staged upload while a chunk or the commit works on
+    it: an flock on its .part file, so it holds across threads and across
+    worker processes. acquire() never waits; it raises FileNotFoundError
+    once the upload has been committed or discarded.
+    """
+
+    def __init__(self, staging: "StagingArea", upload_id: str):
+        self.staging = staging
+        self.upload_id = upload_id
+        self._fd = None
+        self._thread_lock = None
+
+    def acquire(self, blocking: bool = False) -> bool:
+        fd = os.open(self.staging.path(self.upload_id), os.O_RDWR)
+        if fcntl is None:
+            os.close(fd)
+            with self.staging._locks_guard:
+                self._thread_lock = self.staging._locks.setdefault(self.upload_id, threading.Lock())
+            return self._thread_lock.acquire(blocking=blocking)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._fd = fd
+        return True
+
+    def release(self):
+        if self._thread_lock is not None:
+            self._thread_lock.release()
+        else:
+            os.close(self._fd)  # drops the flock
+
+
+class StagingArea:
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        # upload_id -> (offset, .part mtime, sha256 state up to offset). Only
+        # this process's chunks update it, so it is trusted only while the
+        # file is exactly as this process left it; otherwise (another worker
+        # wrote since, or a restart) the hash is rebuilt from the .part file.
+        self._hashes = {}
+        self._locks = {}  # without fcntl only
+        self._locks_guard = threading.Lock()
+
+    def path(self, upload_id: str) -> str:
+        return os.path.join(self.root, f"{upload_id}.part")
+
+    def lock(self, upload_id: str) -> UploadLock:
+        return UploadLock(self, upload_id)
+
+    def last_write(self, upload_id: str) -> float | None:
+        try:
+            return os.path.getmtime(self.path(upload_id))
+        except FileNotFoundError:
+            return None
+
+    def stale(self, before: float) -> list[str]:
+        """Uploads whose staged file was last written before `before` (a time.time())."""
+        stale = []
+        for entry in os.scandir(self.root):
+            if entry.name.endswith(".part"):
+                try:
+                    if entry.stat().st_mtime < before:
+                        stale.append(entry.name[:-len(".part")])
+                except FileNotFoundError:
+                    pass
+        return stale
+
+    def size(self, upload_id: str) -> int:
+        try:
+            return os.path.getsize(self.path(upload_id))
+        except FileNotFoundError:
+            return 0
+
+    def _hasher_at(self, upload_id: str, offset: int):
+        state = self._hashes.pop(upload_id, None)
+        if state is not None and state[0] == offset:
+            try:
+                st = os.stat(self.path(upload_id))
+            except FileNotFoundError:
+                st = None
+            if st is not None and st.st_size == offset and st.st_mtime_ns == state[1]:
+                return state[2]
+        hasher = hashlib.sha256()
+        if offset:
+            with open(self.path(upload_id), "rb") as fh:
+                remaining = offset
+                while remaining:
+                    data = fh.read(min(READ_SIZE, remaining))
+                    if not data:
+                        break
+                    hasher.update(data)
+                    remaining -= len(data)
+        return hasher
+
+    def writer(self, upload_id: str, offset: int) -> ChunkWriter:
+        return ChunkWriter(self, upload_id, offset)
+
+    def write_stream(self, upload_id: str, fileobj) -> int:
+        """Stage a whole file object (plain multipart uploads)."""
+        writer = self.writer(upload_id, 0)
+        try:
+            shutil.copyfileobj(fileobj, writer, READ_SIZE)
+        except BaseException:
+            writer.abort()
+            raise
+        return writer.close()
+
+    def digest(self, upload_id: str) -> str:
+        return self._hasher_at(upload_id, self.size(upload_id)).hexdigest()
+
+    def discard(self, upload_id: str):
+        self._hashes.pop(upload_id, None)
+        with self._locks_guard:
+            self._locks.pop(upload_id, None)
+        try:
+            os.remove(self.path(upload_id))
+        except FileNotFoundError:
+            pass
+
+
+_staging = None
+
+
+def get_staging() -> StagingArea:
+    global _staging
+    if _staging is None:
+        _staging = StagingArea(os.path.join(settings.STORAGE_DIR, "uploads"))
+    return _staging
@@ -0,0 +1,210 @@
+from collections import defaultdict
+
+from sqlalchemy import and_, bindparam, cast, func, literal, select, String, update
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy.orm.attributes import set_committed_value
+
+from .models import Item, User
+
+# Materialized path index:
+# every item stores "/<top id>/.../<parent id>/<own id>/" in Item.path, so the
+# ancestor chain is readable without queries and a whole subtree is one
+# indexed range scan on items.path.
+
+
+def child_path(parent_path: str | None, item_id: int) -> str:
+    return f"{parent_path or '/'}{item_id}/"
+
+
+def ancestor_ids(path: str) -> list[int]:
+    """Ids from the top-level item down to (and including) the item itself."""
+    return [int(p) for p in path.strip("/").split("/") if p]
+
+
+def in_subtree(path: str, root_path: str) -> bool:
+    """True if the item at `path` is the root OR inside it."""
+    return path.startswith(root_path)
+
+
+def subtree_filter(root_path: str, column=Item.path):
+    # Paths only contain digits and "/", and "0" sorts right after "/",
+    # so [root_path, root_path-with-last-char-bumped) is exactly the subtree.
+    return and_(column >= root_path, column < root_path[:-1] + "0")
+
+
+def assign_path(db: Session, item: Item, parent: Item | None):
+    """Give a freshly added item its path (needs the id, so flushes first)."""
+    if item.id is None:
+        db.flush()
+    item.path = child_path(parent.path if parent is not None else None, item.id)
+
+
+def move_subtree(db: Session, item: Item, new_parent: Item | None):
+    """Rewrite the path prefix of `item` and everything below it in one UPDATE."""
+    old_path = item.path
+    new_path = child_path(new_parent.path if new_parent is not None else None, item.id)
+    if old_path == new_path:
+        return
+
+    if item.type == "file":
+        # nothing below a file: a plain attribute change, batched by the flush
+        item.path = new_path
+        return
+
+    db.query(Item).filter(subtree_filter(old_path)).update(
+        {Item.path: literal(new_path) + func.substr(Item.path, len(old_path) + 1)},
+        synchronize_session=False,
+    )
+    # keep the in-session object in sync with what we just wrote
+    db.expire(item, ["path"])
+
+
+def rebase_paths(items, old_path: str, new_path: str):
+    """Mirror a subtree move on objects already loaded, without reloading them."""
+    for it in items:
+        if it.path is not None and in_subtree(it.path, old_path):
+            set_committed_value(it, "path", new_path + it.path[len(old_path):])
+
+
+# ----------------- FOLDER ROLLUPS -----------------
+# Folders carry size_bytes (total bytes below), file_count and
+# descendant_count. Every change adds a delta to each ancestor folder instead
+# of rescanning the subtree; recompute_rollups() is the bulk repair.
+#
+# A folder whose rollups change is shown differently in its parent's
+# listing, so the same update bumps the listing versions (children_version,
+# and User.root_version for top-level items) used as listing ETags.
+
+def subtree_weight(item: Item) -> tuple[int, int, int]:
+    """What `item` contributes to each ancestor: (bytes, files, descendants)."""
+    if item.type == "file":
+        return (item.size_bytes or 0, 1, 1)
+    return (item.size_bytes or 0, item.file_count or 0, (item.descendant_count or 0) + 1)
+
+
+class RollupDelta:
+    """Collects per-folder deltas so a whole request is applied with one executemany."""
+
+    def __init__(self):
+        self.deltas = defaultdict(lambda: [0, 0, 0])
+        self.top_ids = set()  # top-level items: their owner's root listing changed
+
+    def add(self, path: str, weight: tuple[int, int, int], sign: int = 1):
+        """Add (sign * weight) to every ancestor of the item at `path`."""
+        ids = ancestor_ids(path)
+        self.top_ids.add(ids[0])
+        for folder_id in ids[:-1]:
+            d = self.deltas[folder_id]
+            for i in range(3):
+                d[i] += sign * weight[i]
+
+    def touch(self, path: str):
+        """The item at `path` changed in place (renamed): only its parent's listing changes."""
+        ids = ancestor_ids(path)
+        if len(ids) == 1:
+            self.top_ids.add(ids[0])
+        else:
+            self.deltas[ids[-2]]
+
+    def weight(self, item: Item) -> tuple[int, int, int]:
+        """subtree_weight() of `item` including deltas added here but not applied yet."""
+        w = subtree_weight(item)
+        d = self.deltas.get(item.id)
+        return w if d is None else (w[0] + d[0], w[1] + d[1], w[2] + d[2])
+
+    def apply(self, db: Session):
+        rows = [
+            {"folder_id": fid, "d_bytes": b, "d_files": f, "d_desc": n}
+            for fid, (b, f, n) in self.deltas.items()
+        ]
+        if rows:
+            t = Item.__table__
+            db.execute(
+                update(t)
+                .where(t.c.id == bindparam("folder_id"))
+                .values(
+                    size_bytes=func.coalesce(t.c.size_bytes, 0) + bindparam("d_bytes"),
+                    file_count=t.c.file_count + bindparam("d_files"),
+                    descendant_count=t.c.descendant_count + bindparam("d_desc"),
+                    children_version=t.c.children_version + 1,
+                ),
+                rows,
+            )
+        if self.top_ids:
+            users = User.__table__
+            owners = select(Item.owner_user_id).where(Item.id.in_(self.top_ids))
+            db.execute(update(users).where(users.c.id.in_(owners)).values(root_version=users.c.root_version + 1))
+        self.deltas.clear()
+        self.top_ids.clear()
+
+
+def apply_rollup(db: Session, path: str, weight: tuple[int, int, int], sign: int = 1):
+    delta = RollupDelta()
+    delta.add(path, weight, sign)
+    delta.apply(db)
+
+
+def touch_listing(db: Session, path: str):
+    delta = RollupDelta()
+    delta.touch(path)
+    delta.apply(db)
+
+
+def recompute_rollups(db: Session) -> int:
+    """Recompute every folder's rollups from scratch (consistency repair)."""
+    d = aliased(Item)
+    # strictly below: same range as subtree_filter, minus the folder itself
+    upper = func.substr(Item.path, 1, func.length(Item.path) - 1, type_=String) + "0"
+    below = and_(d.path > Item.path, d.path < upper)
+    n = (
+        db.query(Item)
+        .filter(Item.type == "folder", Item.path != None)
+        .update(
+            {
+                Item.size_bytes: select(func.coalesce(func.sum(d.size_bytes), 0))
+                .where(below, d.type == "file").scalar_subquery(),
+                Item.file_count: select(func.count()).where(below, d.type == "file").scalar_subquery(),
+                Item.descendant_count: select(func.count()).where(below).scalar_subquery(),
+                Item.children_version: Item.children_version + 1,
+            },
+            synchronize_session=False,
+        )
+    )
+    db.query(User).update({User.root_version: User.root_version + 1}, synchronize_session=False)
+    db.commit()
+    return n
+
+
+def backfill_paths(db: Session, rebuild: bool = False) -> int:
+    """
+    Fill Item.path for rows that don't have one yet (or all rows if rebuild).
+    Works top-down one tree level per statement. Returns the number of rows
+    still without a path afterwards (orphans / broken parent chains).
+    """
+    if rebuild:
+        db.query(Item).update({Item.path: None}, synchronize_session=False)
+
+    db.query(Item).filter(Item.parent_id == None, Item.path == None).update(
+        {Item.path: literal("/") + cast(Item.id, String) + "/"},
+        synchronize_session=False,
+    )
+
+    parent = aliased(Item)
+    parent_path = select(parent.path).where(parent.id == Item.parent_id).scalar_subquery()
+    while True:
+        updated = (
+            db.query(Item)
+            .filter(
+                Item.path == None,
+                Item.parent_id.in_(select(parent.id).where(parent.path != None)),
+            )
+            .update(
+                {Item.path: parent_path + cast(Item.id, String) + "/"},
+                synchronize_session=False,
+            )
+        )
+        if not updated:
+            break
+
+    db.commit()
+    return db.query(Item).filter(Item.path == None).count()
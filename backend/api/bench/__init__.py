@@ -0,0 +1,22 @@
+"""
+Benchmarks for the EduShare API (run from backend/api).
+
+    python -m bench run                       # small dataset, in-process
+    python -m bench run --profile medium --concurrency 16 --duration 30
+    python -m bench compare bench-results/OLD.json bench-results/NEW.json
+
+`run` builds a synthetic dataset (bench/dataset.py) in a scratch database,
+drives every endpoint through the app in this process, then replays a
+weighted read-heavy mix from several threads, times cold starts (`import
+app.main` and the schema check) in fresh interpreters, and writes p50/p95/p99
+latency, throughput and SQL statements per request to a JSON file named
+after the profile and commit. `compare` exits non-zero on regressions, so it
+can gate a change.
+
+To measure a real server (uvicorn/gunicorn workers, network, the change
+streams), generate the data first and start the server on it:
+
+    python -m bench generate --workdir /tmp/edushare-bench
+    # start the API with the environment printed above, then
+    python -m bench run --url http://127.0.0.1:8000 --dataset /tmp/edushare-bench/dataset.json
+"""
@@ -0,0 +1,207 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from .profiles import PROFILES
+
+
+def scratch_env(workdir: str):
+    """Point the app at a scratch database and storage; must run before `app` is imported."""
+    os.makedirs(workdir, exist_ok=True)
+    os.environ["EDUSHARE_DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ.pop("EDUSHARE_DATABASE_READ_URL", None)
+    os.environ["EDUSHARE_STORAGE_DIR"] = os.path.join(workdir, "storage")
+    # background work would add statements to whatever request is being counted
+    os.environ.setdefault("EDUSHARE_JOB_WORKER", "0")
+    os.environ.setdefault("EDUSHARE_PREVIEW_WORKERS", "0")
+    os.environ.setdefault("EDUSHARE_CACHE_BUS_POLL_SECONDS", "0")
+    # the load phase is one user hammering the API: measure it, don't shed it
+    os.environ.setdefault("EDUSHARE_ADMISSION", "0")
+
+
+def create_schema():
+    from app.db import engine
+    from app.migrations import migrate
+
+    migrate(engine, report=lambda line: None)
+
+
+def make_dataset(profile: str, seed: int):
+    from app.db import SessionLocal
+    from .dataset import generate
+
+    started = time.perf_counter()
+    with SessionLocal() as db:
+        ds = generate(db, profile, seed)
+    ds.counts["generate_seconds"] = round(time.perf_counter() - started, 3)
+    return ds
+
+
+def git(*args) -> str | None:
+    try:
+        out = subprocess.run(["git", *args], capture_output=True, text=True, timeout=10)
+    except OSError:
+        return None
+    return out.stdout.strip() if out.returncode == 0 else None
+
+
+def run_meta(args, url: str | None) -> dict:
+    import fastapi
+    import sqlalchemy
+    from app import settings
+
+    return {
+        "commit": git("rev-parse", "--short", "HEAD"),
+        "dirty": bool(git("status", "--porcelain")),
+        "started_at": datetime.utcnow().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "fastapi": fastapi.__version__,
+        "sqlalchemy": sqlalchemy.__version__,
+        "target": url or "in-process",
+        "db_async": settings.DB_ASYNC,
+        "iterations": args.iterations,
+        "warmup": args.warmup,
+    }
+
+
+def cmd_generate(args):
+    scratch_env(args.workdir)
+    create_schema()
+    ds = make_dataset(args.profile, args.seed)
+    path = os.path.join(args.workdir, "dataset.json")
+    with open(path, "w") as fh:
+        json.dump(ds.to_dict(), fh, indent=2)
+    print(f"{args.profile} dataset: {ds.counts}")
+    print(f"wrote {path}; serve it with:")
+    print(f"  EDUSHARE_DATABASE_URL={os.environ['EDUSHARE_DATABASE_URL']} EDUSHARE_STORAGE_DIR={os.environ['EDUSHARE_STORAGE_DIR']}")
+
+
+def cmd_run(args):
+    if args.url:
+        import httpx
+        from .dataset import Dataset
+
+        if not args.dataset:
+            sys.exit("--url needs --dataset (from `python -m bench generate`)")
+        with open(args.dataset) as fh:
+            ds = Dataset(**json.load(fh))
+        client = httpx.Client(base_url=args.url, timeout=120)
+        counter = None
+    else:
+        scratch_env(args.workdir or tempfile.mkdtemp(prefix="edushare-bench-"))
+        create_schema()
+        from fastapi.testclient import TestClient
+        from app import db as app_db
+        from app.main import app
+        from .runner import SqlCounter
+
+        print(f"generating {args.profile} dataset in {os.path.dirname(os.environ['EDUSHARE_STORAGE_DIR'])}")
+        ds = make_dataset(args.profile, args.seed)
+        print(f"  {ds.counts}")
+        client = TestClient(app)
+        counter = SqlCounter()
+        engines = {app_db.engine, app_db.read_engine, app_db.async_engine, app_db.async_read_engine}
+        counter.attach(eng for eng in engines if eng is not None)
+
+    from .runner import run_endpoints, run_load
+    from .scenarios import Ctx, SCENARIOS
+
+    chosen, skipped = [], {}
+    for sc in SCENARIOS:
+        if args.only and not any(pattern in sc.name for pattern in args.only):
+            continue
+        if sc.stream and not args.url:
+            skipped[sc.name] = "endless response: needs --url"
+        elif sc.in_process and args.url:
+            skipped[sc.name] = "resets the app's caches: in-process only"
+        else:
+            chosen.append(sc)
+
+    with client:
+        ctx = Ctx(client, ds)
+        result = {"meta": run_meta(args, args.url), "dataset": ds.to_dict()}
+        print(f"endpoints ({args.iterations} runs each after {args.warmup} warm-up)")
+        result["endpoints"] = run_endpoints(ctx, chosen, args.iterations, args.warmup, counter)
+        result["skipped"] = skipped
+        if args.concurrency and args.duration:
+            print(f"load: {args.concurrency} threads for {args.duration}s")
+            result["load"] = run_load(ctx, chosen, args.concurrency, args.duration, counter)
+            overall = result["load"]["overall"]
+            print(f"  {overall['throughput_rps']} req/s  p50 {overall['p50_ms']} ms  p95 {overall['p95_ms']} ms  "
+                  f"p99 {overall['p99_ms']} ms  {overall['errors']} unexpected")
+    # on the scratch database, so only in-process
+    if not args.url and args.startup_runs and (not args.only or any(p in "startup" for p in args.only)):
+        from .runner import run_startup
+
+        print(f"startup ({args.startup_runs} cold starts each)")
+        result["startup"] = run_startup(args.startup_runs)
+
+    os.makedirs(args.out, exist_ok=True)
+    stamp = datetime.utcnow().strftime("%Y%m%d-%H%M%S")
+    path = os.path.join(args.out, f"{ds.profile}-{result['meta']['commit'] or 'nogit'}-{stamp}.json")
+    with open(path, "w") as fh:
+        json.dump(result, fh, indent=2)
+    print(f"wrote {path}")
+
+
+def cmd_compare(args):
+    from .runner import compare
+
+    with open(args.old) as fh:
+        old = json.load(fh)
+    with open(args.new) as fh:
+        new = json.load(fh)
+    lines, regressions = compare(old, new, args.threshold, args.floor_ms)
+    print("\n".join(lines))
+    if regressions:
+        print(f"\n{len(regressions)} regression(s):")
+        print("\n".join(f"  {r}" for r in regressions))
+        sys.exit(1)
+    print("\nno regressions")
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m bench")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    gen = sub.add_parser("generate", help="build a dataset for a live server")
+    gen.add_argument("--profile", choices=PROFILES, default="small")
+    gen.add_argument("--seed", type=int, default=1)
+    gen.add_argument("--workdir", required=True)
+    gen.set_defaults(fn=cmd_generate)
+
+    run = sub.add_parser("run", help="measure every endpoint, then a concurrent mix")
+    run.add_argument("--profile", choices=PROFILES, default="small")
+    run.add_argument("--seed", type=int, default=1)
+    run.add_argument("--workdir", help="scratch directory (default: a new temp dir)")
+    run.add_argument("--iterations", type=int, default=30)
+    run.add_argument("--warmup", type=int, default=3)
+    run.add_argument("--concurrency", type=int, default=8)
+    run.add_argument("--duration", type=float, default=15, help="seconds of concurrent load (0 = skip)")
+    run.add_argument("--startup-runs", type=int, default=5, help="cold starts timed, in-process only (0 = skip)")
+    run.add_argument("--only", action="append", help="only scenarios whose name contains this (repeatable)")
+    run.add_argument("--url", help="benchmark a running server instead of the app in-process")
+    run.add_argument("--dataset", help="dataset.json of the server's data (with --url)")
+    run.add_argument("--out", default="bench-results")
+    run.set_defaults(fn=cmd_run)
+
+    cmp = sub.add_parser("compare", help="diff two result files; exit 1 on regressions")
+    cmp.add_argument("old")
+    cmp.add_argument("new")
+    cmp.add_argument("--threshold", type=float, default=0.2, help="allowed relative p95 increase")
+    cmp.add_argument("--floor-ms", type=float, default=0.5, help="ignore p95 changes smaller than this")
+    cmp.set_defaults(fn=cmd_compare)
+
+    args = parser.parse_args()
+    args.fn(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""
+Synthetic datasets for the benchmarks.
+
+Everything is written with Core executemany inserts and precomputed ids and
+paths, so even the large profile builds in seconds; rollups are then filled
+by tree.recompute_rollups like a repaired production database. The same
+profile and seed always give the same rows, ids and share tokens.
+
+Shapes:
+- chain: one folder nested `chain_depth` deep; the grantee's only access is
+  a viewer grant on its top, so every permission check walks the whole
+  ancestor chain (get_effective_role depth cost).
+- wide: one folder with `wide_width` direct children (listing pagination).
+- bulk: a balanced tree (`fanout` ** levels folders) with files everywhere,
+  the target of searches, archives and share links.
+- homes: one small top-level folder per user; random grants and share links
+  spread over the bulk folders.
+"""
+import hashlib
+import os
+import random
+import tempfile
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, insert
+from sqlalchemy.orm import Session
+
+from app.models import Item, ItemPermission, ShareLink, User
+from app.storage import get_storage
+from app.tree import recompute_rollups, subtree_filter
+
+from .profiles import PROFILES
+
+BATCH = 5000
+WORDS = (
+    "lecture", "notes", "week", "slides", "exam", "solution", "draft", "report",
+    "lab", "project", "reading", "summary", "quiz", "chapter", "figure", "data",
+)
+MIME_TYPES = (
+    ("txt", "text/plain"),
+    ("pdf", "application/pdf"),
+    ("png", "image/png"),
+    ("docx", "application/vnd.openxmlformats-officedocument.wordprocessingml.document"),
+    ("bin", "application/octet-stream"),
+)
+
+
+@dataclass
+class Dataset:
+    """What the scenarios need to know about a generated dataset (saved as JSON)."""
+
+    profile: str
+    seed: int
+    owner: str
+    grantee: str
+    outsider: str
+    chain_ids: list[int]
+    wide_id: int
+    bulk_root_id: int
+    bulk_leaf_ids: list[int]
+    file_ids: list[int]  # files in the bulk tree, the share link's subtree
+    share_token: str
+    counts: dict = field(default_factory=dict)
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+class TreeWriter:
+    """Buffers item rows with ids and paths assigned up front."""
+
+    def __init__(self, db: Session, rng: random.Random, blob_key: str, digest: str, blob_size: int):
+        self.db = db
+        self.rng = rng
+        self.blob_key = blob_key
+        self.digest = digest
+        self.blob_size = blob_size
+        self.next_id = (db.query(func.max(Item.id)).scalar() or 0) + 1
+        self.rows = []
+        self.folders = 0
+        self.files = 0
+        self.now = datetime.utcnow()
+
+    def name(self, n: int) -> str:
+        return f"{self.rng.choice(WORDS)} {self.rng.choice(WORDS)} {n}"
+
+    def add(self, parent: tuple[int, str] | None, owner_id: int, kind: str, name: str) -> tuple[int, str]:
+        item_id = self.next_id
+        self.next_id += 1
+        path = f"{parent[1] if parent else '/'}{item_id}/"
+        row = {
+            "id": item_id,
+            "parent_id": parent[0] if parent else None,
+            "name": name,
+            "type": kind,
+            "owner_user_id": owner_id,
+            "created_at": self.now,
+            "modified_at": self.now - timedelta(seconds=self.rng.randrange(86400 * 365)),
+            "modified_by_user_id": owner_id,
+            "storage_path": None,
+            "content_hash": None,
+            "mime_type": None,
+            "size_bytes": 0,
+            "path": path,
+        }
+        if kind == "file":
+            ext, mime = self.rng.choice(MIME_TYPES)
+            row.update(
+                name=f"{name}.{ext}",
+                storage_path=self.blob_key,
+                content_hash=self.digest,
+                mime_type=mime,
+                size_bytes=self.blob_size,
+            )
+            self.files += 1
+        else:
+            self.folders += 1
+        self.rows.append(row)
+        if len(self.rows) >= BATCH:
+            self.flush()
+        return item_id, path
+
+    def folder(self, parent, owner_id: int, name: str, files: int) -> tuple[int, str]:
+        node = self.add(parent, owner_id, "folder", name)
+        for n in range(files):
+            self.add(node, owner_id, "file", self.name(n))
+        return node
+
+    def flush(self):
+        if self.rows:
+            self.db.execute(insert(Item), self.rows)
+            self.rows = []
+
+
+def store_blob(size: int, seed: int) -> tuple[str, str]:
+    """One blob shared by every generated file (content addressing dedupes it)."""
+    data = random.Random(seed).randbytes(size)
+    digest = hashlib.sha256(data).hexdigest()
+    fd, tmp = tempfile.mkstemp()
+    with os.fdopen(fd, "wb") as fh:
+        fh.write(data)
+    return get_storage().put(digest, tmp), digest
+
+
+def generate(db: Session, profile_name: str, seed: int = 1) -> Dataset:
+    profile = PROFILES[profile_name]
+    rng = random.Random(seed)
+
+    first_user = (db.query(func.max(User.id)).scalar() or 0) + 1
+    names = [f"bench{n:05d}" for n in range(profile.users)]
+    db.execute(
+        insert(User),
+        [
+            {"id": first_user + n, "provider": "local", "provider_user_id": name, "display_name": name}
+            for n, name in enumerate(names)
+        ],
+    )
+    user_ids = list(range(first_user, first_user + profile.users))
+    owner_id, grantee_id = user_ids[0], user_ids[1]
+
+    blob_key, digest = store_blob(profile.blob_bytes, seed)
+    tree = TreeWriter(db, rng, blob_key, digest, profile.blob_bytes)
+
+    # chain
+    chain = []
+    node = None
+    for depth in range(profile.chain_depth):
+        node = tree.folder(node, owner_id, f"chain {depth}", profile.files_per_folder)
+        chain.append(node)
+
+    # wide: a tenth folders, the rest files
+    wide = tree.folder(None, owner_id, "wide", 0)
+    for n in range(profile.wide_width):
+        tree.add(wide, owner_id, "folder" if n % 10 == 0 else "file", tree.name(n))
+
+    # bulk
+    bulk = tree.folder(None, owner_id, "bulk", profile.files_per_folder)
+    level = [bulk]
+    bulk_folders = [bulk]
+    for _ in range(profile.levels):
+        below = []
+        for parent in level:
+            for n in range(profile.fanout):
+                below.append(tree.folder(parent, owner_id, tree.name(n), profile.files_per_folder))
+        bulk_folders += below
+        level = below
+
+    # homes
+    for user_id, name in zip(user_ids, names):
+        tree.folder(None, user_id, f"home {name}", profile.files_per_folder)
+    tree.flush()
+
+    grants = {(grantee_id, chain[0][0]): "viewer", (grantee_id, wide[0]): "viewer"}
+    while len(grants) < profile.grants:
+        user_id = rng.choice(user_ids[2:-1])
+        grants.setdefault((user_id, rng.choice(bulk_folders)[0]), rng.choice(("viewer", "editor")))
+    db.execute(
+        insert(ItemPermission),
+        [{"item_id": item_id, "user_id": user_id, "role": role} for (user_id, item_id), role in grants.items()],
+    )
+
+    tokens = [f"bench{rng.getrandbits(64):016x}" for _ in range(profile.share_links)]
+    links = [{"item_id": bulk[0], "token": tokens[0], "role": "editor", "created_at": tree.now}]
+    links += [
+        {"item_id": rng.choice(bulk_folders)[0], "token": token, "role": rng.choice(("viewer", "editor")), "created_at": tree.now}
+        for token in tokens[1:]
+    ]
+    db.execute(insert(ShareLink), links)
+    db.commit()
+    recompute_rollups(db)
+
+    file_ids = [
+        item_id for (item_id,) in db.query(Item.id)
+        .filter(Item.type == "file", subtree_filter(bulk[1]))
+        .order_by(Item.id)
+        .limit(200)
+    ]
+    return Dataset(
+        profile=profile_name,
+        seed=seed,
+        owner=names[0],
+        grantee=names[1],
+        outsider=names[-1],
+        chain_ids=[item_id for item_id, _ in chain],
+        wide_id=wide[0],
+        bulk_root_id=bulk[0],
+        bulk_leaf_ids=[item_id for item_id, _ in level[:50]],
+        file_ids=file_ids,
+        share_token=tokens[0],
+        counts={
+            "users": profile.users,
+            "folders": tree.folders,
+            "files": tree.files,
+            "grants": len(grants),
+            "share_links": len(links),
+        },
+    )
@@ -0,0 +1,28 @@
+"""
+Dataset sizes. Kept apart from dataset.py, which imports the app: the CLI
+needs the profile names before it has pointed the app at a scratch database.
+"""
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class Profile:
+    users: int
+    chain_depth: int
+    wide_width: int
+    fanout: int
+    levels: int
+    files_per_folder: int
+    grants: int
+    share_links: int
+    blob_bytes: int = 64 * 1024
+
+
+PROFILES = {
+    "small": Profile(users=20, chain_depth=20, wide_width=1000, fanout=4, levels=3,
+                     files_per_folder=5, grants=200, share_links=50),
+    "medium": Profile(users=200, chain_depth=60, wide_width=10_000, fanout=6, levels=4,
+                      files_per_folder=10, grants=5000, share_links=1000),
+    "large": Profile(users=2000, chain_depth=200, wide_width=50_000, fanout=8, levels=5,
+                     files_per_folder=10, grants=50_000, share_links=10_000),
+}
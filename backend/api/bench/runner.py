@@ -0,0 +1,230 @@
+"""
+Measurement: every scenario on its own (latency percentiles and SQL
+statements per request), then a concurrent mixed load (throughput and
+latency under contention), cold-start costs, and the comparison of two
+result files.
+"""
+import math
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import event
+
+from .scenarios import Ctx, Scenario
+
+
+class SqlCounter:
+    """Counts statements sent to the database (an executemany counts once)."""
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def attach(self, engines):
+        for eng in engines:
+            event.listen(getattr(eng, "sync_engine", eng), "before_cursor_execute", self._count)
+
+    def _count(self, *args):
+        with self._lock:
+            self.count += 1
+
+
+def percentile(ordered: list[float], p: float) -> float | None:
+    """Nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return None
+    return ordered[max(math.ceil(p / 100 * len(ordered)) - 1, 0)]
+
+
+def summarize(latencies: list[float], statuses: Counter, errors: int, sql: list[int] | None) -> dict:
+    ordered = sorted(latencies)
+    ms = lambda v: None if v is None else round(v * 1000, 3)  # noqa: E731
+    out = {
+        "n": len(ordered),
+        "errors": errors,
+        "statuses": {str(k): v for k, v in sorted(statuses.items())},
+        "mean_ms": ms(sum(ordered) / len(ordered)) if ordered else None,
+        "p50_ms": ms(percentile(ordered, 50)),
+        "p95_ms": ms(percentile(ordered, 95)),
+        "p99_ms": ms(percentile(ordered, 99)),
+        "max_ms": ms(ordered[-1]) if ordered else None,
+    }
+    if sql:
+        out["sql_per_request"] = round(sum(sql) / len(sql), 2)
+        out["sql_p50"] = percentile(sorted(sql), 50)
+    return out
+
+
+def measure(ctx: Ctx, sc: Scenario, iterations: int, warmup: int, counter: SqlCounter | None) -> dict:
+    latencies, sql, statuses, errors, first_error = [], [], Counter(), 0, None
+    for i in range(warmup + iterations):
+        prepared = sc.setup(ctx, i) if sc.setup else None
+        before = counter.count if counter else 0
+        started = time.perf_counter()
+        res = sc.run(ctx, i, prepared)
+        elapsed = time.perf_counter() - started
+        if i < warmup:
+            continue
+        latencies.append(elapsed)
+        statuses[res.status_code] += 1
+        if counter:
+            sql.append(counter.count - before)
+        if res.status_code not in sc.ok:
+            errors += 1
+            first_error = first_error or f"{res.status_code} {res.text[:200]}"
+    out = summarize(latencies, statuses, errors, sql)
+    if first_error:
+        out["first_error"] = first_error
+    return out
+
+
+def run_endpoints(ctx: Ctx, scenarios: list[Scenario], iterations: int, warmup: int, counter, log=print) -> dict:
+    results = {}
+    for sc in scenarios:
+        try:
+            results[sc.name] = measure(ctx, sc, iterations, warmup, counter)
+        except Exception as e:  # a broken scenario shouldn't lose the others' numbers
+            results[sc.name] = {"error": repr(e)}
+        r = results[sc.name]
+        if "error" in r:
+            log(f"  {sc.name:<36} ERROR {r['error']}")
+        else:
+            sql = f"{r['sql_per_request']:>7} sql" if "sql_per_request" in r else ""
+            log(f"  {sc.name:<36} p50 {r['p50_ms']:>9.2f} ms  p95 {r['p95_ms']:>9.2f} ms  {sql}"
+                + (f"  {r['errors']} unexpected" if r["errors"] else ""))
+    return results
+
+
+def run_load(ctx: Ctx, scenarios: list[Scenario], concurrency: int, duration: float, counter) -> dict:
+    """`concurrency` threads replay the weighted mix for `duration` seconds."""
+    mix = [sc for sc in scenarios if sc.load_weight and sc.setup is None]
+    weights = [sc.load_weight for sc in mix]
+    lock = threading.Lock()
+    latencies = defaultdict(list)
+    statuses = defaultdict(Counter)
+    errors = Counter()
+    deadline = time.perf_counter() + duration
+
+    def worker(n: int):
+        rng = random.Random(n)
+        i = n * 1_000_000
+        while time.perf_counter() < deadline:
+            sc = rng.choices(mix, weights)[0]
+            started = time.perf_counter()
+            try:
+                res = sc.run(ctx, i, None)
+                status = res.status_code
+            except Exception:
+                status = 0
+            elapsed = time.perf_counter() - started
+            i += 1
+            with lock:
+                latencies[sc.name].append(elapsed)
+                statuses[sc.name][status] += 1
+                if status not in sc.ok:
+                    errors[sc.name] += 1
+
+    sql_before = counter.count if counter else 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    total = sum(len(v) for v in latencies.values())
+    overall = summarize(
+        [x for v in latencies.values() for x in v],
+        sum(statuses.values(), Counter()),
+        sum(errors.values()),
+        None,
+    )
+    overall.update(
+        concurrency=concurrency,
+        seconds=round(elapsed, 3),
+        throughput_rps=round(total / elapsed, 2) if elapsed else None,
+        sql_per_request=round((counter.count - sql_before) / total, 2) if counter and total else None,
+    )
+    return {
+        "overall": overall,
+        "mix": {sc.name: sc.load_weight for sc in mix},
+        "scenarios": {name: summarize(v, statuses[name], errors[name], None) for name, v in sorted(latencies.items())},
+    }
+
+
+# ----------------- STARTUP -----------------
+# Each timed in a new interpreter on the benchmark's database: what a worker
+# process pays before it can serve, and the gunicorn master's schema check
+# (gunicorn.conf.py). The snippet prints the seconds taken.
+STARTUP_SNIPPETS = {
+    "import_app_main": "import time; t = time.perf_counter(); import app.main; print(time.perf_counter() - t)",
+    "require_schema": (
+        "import time; from app.db import engine; from app.migrations import require_schema; "
+        "t = time.perf_counter(); require_schema(engine); print(time.perf_counter() - t)"
+    ),
+}
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_startup(runs: int, log=print) -> dict:
+    results = {}
+    for name, snippet in STARTUP_SNIPPETS.items():
+        latencies = []
+        for _ in range(runs):
+            out = subprocess.run([sys.executable, "-c", snippet], cwd=APP_DIR, capture_output=True, text=True)
+            if out.returncode != 0:
+                results[name] = {"error": out.stderr.strip().splitlines()[-1] if out.stderr.strip() else "failed"}
+                break
+            latencies.append(float(out.stdout.split()[-1]))
+        else:
+            results[name] = summarize(latencies, Counter(), 0, None)
+        r = results[name]
+        if "error" in r:
+            log(f"  {name:<36} ERROR {r['error']}")
+        else:
+            log(f"  {name:<36} p50 {r['p50_ms']:>9.2f} ms  p95 {r['p95_ms']:>9.2f} ms")
+    return results
+
+
+# ----------------- COMPARISON -----------------
+def compare(old: dict, new: dict, threshold: float, floor_ms: float) -> tuple[list[str], list[str]]:
+    """
+    Table lines and regressions between two result files: p95 more than
+    `threshold` (and `floor_ms`) slower, more SQL per request, lower load
+    throughput.
+    """
+    lines = [f"{'scenario':<36} {'old p95':>10} {'new p95':>10} {'change':>8} {'old sql':>8} {'new sql':>8}"]
+    regressions = []
+    pairs = [(name, old["endpoints"][name], new["endpoints"][name])
+             for name in sorted(set(old["endpoints"]) & set(new["endpoints"]))]
+    old_startup, new_startup = old.get("startup") or {}, new.get("startup") or {}
+    pairs += [(f"startup {name}", old_startup[name], new_startup[name])
+              for name in sorted(set(old_startup) & set(new_startup))]
+    for name, o, n in pairs:
+        if o.get("p95_ms") is None or n.get("p95_ms") is None:
+            continue
+        change = (n["p95_ms"] - o["p95_ms"]) / o["p95_ms"] if o["p95_ms"] else 0.0
+        flags = []
+        if change > threshold and n["p95_ms"] - o["p95_ms"] > floor_ms:
+            flags.append("slower")
+        if o.get("sql_p50") is not None and n.get("sql_p50") is not None and n["sql_p50"] > o["sql_p50"]:
+            flags.append("more sql")
+        if flags:
+            regressions.append(f"{name}: {', '.join(flags)}")
+        lines.append(
+            f"{name:<36} {o['p95_ms']:>10.2f} {n['p95_ms']:>10.2f} {change:>+8.1%} "
+            f"{o.get('sql_p50', '-'):>8} {n.get('sql_p50', '-'):>8}  {' '.join(flags)}"
+        )
+
+    o_rps = (old.get("load") or {}).get("overall", {}).get("throughput_rps")
+    n_rps = (new.get("load") or {}).get("overall", {}).get("throughput_rps")
+    if o_rps and n_rps:
+        change = (n_rps - o_rps) / o_rps
+        lines.append(f"{'load throughput (req/s)':<36} {o_rps:>10.1f} {n_rps:>10.1f} {change:>+8.1%}")
+        if change < -threshold:
+            regressions.append("load: lower throughput")
+    return lines, regressions
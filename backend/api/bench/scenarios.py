@@ -0,0 +1,453 @@
+"""
+One scenario per endpoint (or per interesting case of one).
+
+A scenario's `run` makes exactly the request being timed; anything it needs
+first (a fresh folder to delete, an upload to commit, a cold cache) is done
+by `setup`, outside the timing. Scenarios with `load_weight` make up the
+mixed workload of the concurrent phase.
+"""
+from dataclasses import dataclass
+from typing import Callable
+
+from .dataset import Dataset
+
+CHUNK = b"x" * (256 * 1024)
+
+
+@dataclass
+class Scenario:
+    name: str
+    run: Callable  # (ctx, i, prepared) -> response
+    setup: Callable | None = None  # (ctx, i) -> prepared
+    ok: tuple = (200,)
+    stream: bool = False  # endless response: only against a live server
+    in_process: bool = False  # touches the app's own state (caches): in-process only
+    load_weight: int = 0
+
+
+SCENARIOS: list[Scenario] = []
+
+
+def scenario(name: str, **opts):
+    def register(fn):
+        SCENARIOS.append(Scenario(name, fn, **opts))
+        return fn
+    return register
+
+
+class Ctx:
+    """The client, the dataset and request helpers shared by all scenarios."""
+
+    def __init__(self, client, ds: Dataset):
+        self.client = client
+        self.ds = ds
+        self.share = f"/s/{ds.share_token}"
+
+    def req(self, method: str, url: str, user: str | None = None, headers: dict | None = None, **kw):
+        return self.client.request(method, url, headers={"X-User": user or self.ds.owner, **(headers or {})}, **kw)
+
+    def get(self, url: str, user: str | None = None, **kw):
+        return self.req("GET", url, user, **kw)
+
+    def post(self, url: str, user: str | None = None, **kw):
+        return self.req("POST", url, user, **kw)
+
+    def file_id(self, i: int) -> int:
+        return self.ds.file_ids[i % len(self.ds.file_ids)]
+
+    def leaf_id(self, i: int) -> int:
+        return self.ds.bulk_leaf_ids[i % len(self.ds.bulk_leaf_ids)]
+
+    def checked(self, res):
+        if res.status_code >= 400:
+            raise RuntimeError(f"setup request failed: {res.status_code} {res.text[:200]}")
+        return res
+
+    def new_folder(self, i: int, parent_id: int | None = None) -> int:
+        body = {"name": f"bench tmp {i}", "parent_id": parent_id or self.ds.bulk_root_id}
+        return self.checked(self.post("/folders", json=body)).json()["id"]
+
+    def new_file(self, i: int, folder_id: int) -> int:
+        files = {"file": (f"bench tmp {i}.txt", b"bench %d" % i, "text/plain")}
+        return self.checked(self.post("/upload", params={"folder_id": folder_id}, files=files)).json()["id"]
+
+    def new_upload(self) -> str:
+        body = {"folder_id": self.ds.bulk_root_id, "name": "bench chunked.bin", "size": len(CHUNK)}
+        return self.checked(self.post("/uploads", json=body)).json()["upload_id"]
+
+    def etag(self, url: str, user: str | None = None) -> str:
+        return self.checked(self.get(url, user)).headers["etag"]
+
+
+def clear_permission_cache(ctx: Ctx, i: int):
+    from app.permissions import permission_cache
+    permission_cache.clear()
+
+
+# ----------------- BASICS -----------------
+@scenario("health")
+def _(ctx, i, _p):
+    return ctx.client.get("/health")
+
+
+@scenario("me", load_weight=5)
+def _(ctx, i, _p):
+    return ctx.get("/me")
+
+
+# ----------------- LISTINGS -----------------
+@scenario("root", load_weight=10)
+def _(ctx, i, _p):
+    return ctx.get("/root")
+
+
+@scenario("root_not_modified", setup=lambda ctx, i: ctx.etag("/root"), ok=(304,), load_weight=10)
+def _(ctx, i, etag):
+    return ctx.get("/root", headers={"If-None-Match": etag})
+
+
+@scenario("shared_with_me", load_weight=2)
+def _(ctx, i, _p):
+    return ctx.get("/shared-with-me", user=ctx.ds.grantee)
+
+
+@scenario("children_wide_first_page", load_weight=10)
+def _(ctx, i, _p):
+    return ctx.get(f"/folders/{ctx.ds.wide_id}/children")
+
+
+@scenario("children_wide_by_size")
+def _(ctx, i, _p):
+    return ctx.get(f"/folders/{ctx.ds.wide_id}/children", params={"sort": "size", "order": "desc"})
+
+
+@scenario("children_wide_prefix")
+def _(ctx, i, _p):
+    return ctx.get(f"/folders/{ctx.ds.wide_id}/children", params={"prefix": "lecture"})
+
+
+@scenario("children_wide_not_modified", setup=lambda ctx, i: ctx.etag(f"/folders/{ctx.ds.wide_id}/children"), ok=(304,))
+def _(ctx, i, etag):
+    return ctx.get(f"/folders/{ctx.ds.wide_id}/children", headers={"If-None-Match": etag})
+
+
+# get_effective_role depth cost: the grantee's only grant is on the chain's
+# top, so a cold check of a chain folder resolves every ancestor above it
+CHAIN_DEPTHS = {
+    "top": lambda n: 1,
+    "middle": lambda n: max(n // 2, 1),
+    "deepest": lambda n: n,
+}
+
+for _label, _depth in CHAIN_DEPTHS.items():
+    def _chain(ctx, i, _p, depth=_depth):
+        folder_id = ctx.ds.chain_ids[depth(len(ctx.ds.chain_ids)) - 1]
+        return ctx.get(f"/folders/{folder_id}/children", ctx.ds.grantee)
+
+    SCENARIOS.append(Scenario(f"children_chain_{_label}_cold", _chain, setup=clear_permission_cache, in_process=True))
+    SCENARIOS.append(Scenario(f"children_chain_{_label}_warm", _chain, load_weight=5 if _label == "deepest" else 0))
+
+
+# ----------------- SEARCH -----------------
+@scenario("search_owner", load_weight=5)
+def _(ctx, i, _p):
+    return ctx.get("/search", params={"q": "lecture notes"})
+
+
+@scenario("search_grantee")
+def _(ctx, i, _p):
+    return ctx.get("/search", ctx.ds.grantee, params={"q": "chain"})
+
+
+# ----------------- FILES -----------------
+@scenario("download", load_weight=5)
+def _(ctx, i, _p):
+    return ctx.get(f"/download/{ctx.file_id(i)}")
+
+
+@scenario("download_range", ok=(206,))
+def _(ctx, i, _p):
+    return ctx.get(f"/download/{ctx.file_id(i)}", headers={"Range": "bytes=0-1023"})
+
+
+@scenario("download_head")
+def _(ctx, i, _p):
+    return ctx.req("HEAD", f"/download/{ctx.file_id(i)}")
+
+
+@scenario("download_not_modified", setup=lambda ctx, i: ctx.etag(f"/download/{ctx.file_id(i)}"), ok=(304,))
+def _(ctx, i, etag):
+    return ctx.get(f"/download/{ctx.file_id(i)}", headers={"If-None-Match": etag})
+
+
+# previews are usually still pending (or off) in a benchmark run
+@scenario("thumbnail", ok=(200, 202, 404, 503))
+def _(ctx, i, _p):
+    return ctx.get(f"/items/{ctx.file_id(i)}/thumbnail")
+
+
+@scenario("snippet", ok=(200, 202, 404, 503))
+def _(ctx, i, _p):
+    return ctx.get(f"/items/{ctx.file_id(i)}/snippet")
+
+
+@scenario("archive_folder")
+def _(ctx, i, _p):
+    return ctx.get(f"/folders/{ctx.leaf_id(i)}/archive")
+
+
+@scenario("archive_selection")
+def _(ctx, i, _p):
+    return ctx.post("/archive", json={"item_ids": [ctx.file_id(i + n) for n in range(10)]})
+
+
+# ----------------- CHANGES -----------------
+@scenario("changes", load_weight=5)
+def _(ctx, i, _p):
+    return ctx.get("/changes")
+
+
+@scenario("changes_stream", stream=True)
+def _(ctx, i, _p):
+    return first_event(ctx, "/changes/stream")
+
+
+def first_event(ctx: Ctx, url: str):
+    """Time to the first server-sent event, then hang up."""
+    with ctx.client.stream("GET", url, headers={"X-User": ctx.ds.owner}) as res:
+        for line in res.iter_lines():
+            if line.startswith("event:"):
+                break
+    return res
+
+
+# ----------------- WRITES -----------------
+@scenario("create_folder", load_weight=2)
+def _(ctx, i, _p):
+    return ctx.post("/folders", json={"name": f"bench new {i}", "parent_id": ctx.leaf_id(i)})
+
+
+@scenario("rename", load_weight=2)
+def _(ctx, i, _p):
+    return ctx.post(f"/items/{ctx.file_id(i)}/rename", json={"new_name": f"bench renamed {i}.txt"})
+
+
+@scenario("move")
+def _(ctx, i, _p):
+    return ctx.post(f"/items/{ctx.file_id(0)}/move", json={"new_parent_id": ctx.leaf_id(i % 2)})
+
+
+# copies land in a fresh folder, so sources never grow from earlier runs
+@scenario("copy_file", setup=lambda ctx, i: ctx.new_folder(i))
+def _(ctx, i, folder_id):
+    return ctx.post(f"/items/{ctx.file_id(i)}/copy", json={"new_parent_id": folder_id})
+
+
+@scenario("copy_folder", setup=lambda ctx, i: ctx.new_folder(i))
+def _(ctx, i, folder_id):
+    return ctx.post(f"/items/{ctx.leaf_id(i)}/copy", json={"new_parent_id": folder_id})
+
+
+@scenario("batch_copy_10", setup=lambda ctx, i: ctx.new_folder(i))
+def _(ctx, i, folder_id):
+    ops = [{"op": "copy", "item_id": ctx.file_id(i + n), "new_parent_id": folder_id} for n in range(10)]
+    return ctx.post("/items/batch", json={"ops": ops})
+
+
+@scenario("delete_folder", setup=lambda ctx, i: ctx.new_folder(i))
+def _(ctx, i, folder_id):
+    return ctx.req("DELETE", f"/items/{folder_id}")
+
+
+@scenario("batch_delete_10", setup=lambda ctx, i: [ctx.new_folder(i) for _ in range(10)])
+def _(ctx, i, ids):
+    return ctx.post("/items/batch", json={"ops": [{"op": "delete", "item_id": item_id} for item_id in ids]})
+
+
+def deleted_job(ctx: Ctx, i: int) -> int:
+    folder_id = ctx.new_folder(i)
+    ctx.new_file(i, folder_id)
+    return ctx.checked(ctx.req("DELETE", f"/items/{folder_id}")).json()["job_id"]
+
+
+@scenario("job_status", setup=deleted_job)
+def _(ctx, i, job_id):
+    return ctx.get(f"/jobs/{job_id}")
+
+
+@scenario("share_link_create")
+def _(ctx, i, _p):
+    return ctx.post(f"/share-links/{ctx.leaf_id(i)}", json={"role": "viewer", "expires_in_hours": 1})
+
+
+def new_link(ctx: Ctx, i: int) -> str:
+    res = ctx.post(f"/share-links/{ctx.leaf_id(i)}", json={"role": "viewer"})
+    return ctx.checked(res).json()["token"]
+
+
+@scenario("share_link_delete", setup=new_link)
+def _(ctx, i, token):
+    return ctx.req("DELETE", f"/share-links/{token}")
+
+
+# ----------------- UPLOADS -----------------
+@scenario("upload_multipart", load_weight=1)
+def _(ctx, i, _p):
+    files = {"file": (f"bench upload {i}.bin", CHUNK, "application/octet-stream")}
+    return ctx.post("/upload", params={"folder_id": ctx.leaf_id(i)}, files=files)
+
+
+@scenario("upload_init")
+def _(ctx, i, _p):
+    return ctx.post("/uploads", json={"folder_id": ctx.ds.bulk_root_id, "name": "bench chunked.bin"})
+
+
+@scenario("upload_progress", setup=lambda ctx, i: ctx.new_upload())
+def _(ctx, i, upload_id):
+    return ctx.get(f"/uploads/{upload_id}")
+
+
+@scenario("upload_chunk", setup=lambda ctx, i: ctx.new_upload())
+def _(ctx, i, upload_id):
+    return ctx.req("PUT", f"/uploads/{upload_id}", params={"offset": 0}, content=CHUNK)
+
+
+def staged_upload(ctx: Ctx, i: int) -> str:
+    upload_id = ctx.new_upload()
+    ctx.checked(ctx.req("PUT", f"/uploads/{upload_id}", params={"offset": 0}, content=CHUNK))
+    return upload_id
+
+
+@scenario("upload_commit", setup=staged_upload)
+def _(ctx, i, upload_id):
+    return ctx.post(f"/uploads/{upload_id}/commit")
+
+
+@scenario("upload_abort", setup=lambda ctx, i: ctx.new_upload())
+def _(ctx, i, upload_id):
+    return ctx.req("DELETE", f"/uploads/{upload_id}")
+
+
+# ----------------- SHARE LINKS -----------------
+# the benchmark's link is an editor link on the bulk tree, used by the grantee
+
+@scenario("share_meta")
+def _(ctx, i, _p):
+    return ctx.get(f"{ctx.share}/meta", ctx.ds.grantee)
+
+
+@scenario("share_children", load_weight=5)
+def _(ctx, i, _p):
+    return ctx.get(f"{ctx.share}/children", ctx.ds.grantee, params={"folder_id": ctx.leaf_id(i)})
+
+
+@scenario("share_search")
+def _(ctx, i, _p):
+    return ctx.get(f"{ctx.share}/search", ctx.ds.grantee, params={"q": "report"})
+
+
+@scenario("share_download")
+def _(ctx, i, _p):
+    return ctx.get(f"{ctx.share}/download/{ctx.file_id(i)}", ctx.ds.grantee)
+
+
+@scenario("share_thumbnail", ok=(200, 202, 404, 503))
+def _(ctx, i, _p):
+    return ctx.get(f"{ctx.share}/items/{ctx.file_id(i)}/thumbnail", ctx.ds.grantee)
+
+
+@scenario("share_snippet", ok=(200, 202, 404, 503))
+def _(ctx, i, _p):
+    return ctx.get(f"{ctx.share}/items/{ctx.file_id(i)}/snippet", ctx.ds.grantee)
+
+
+@scenario("share_archive_folder")
+def _(ctx, i, _p):
+    return ctx.get(f"{ctx.share}/archive", ctx.ds.grantee, params={"folder_id": ctx.leaf_id(i)})
+
+
+@scenario("share_archive_selection")
+def _(ctx, i, _p):
+    ids = [ctx.file_id(i + n) for n in range(10)]
+    return ctx.post(f"{ctx.share}/archive", ctx.ds.grantee, json={"item_ids": ids})
+
+
+@scenario("share_changes")
+def _(ctx, i, _p):
+    return ctx.get(f"{ctx.share}/changes", ctx.ds.grantee)
+
+
+@scenario("share_changes_stream", stream=True)
+def _(ctx, i, _p):
+    return first_event(ctx, f"{ctx.share}/changes/stream")
+
+
+@scenario("share_rename")
+def _(ctx, i, _p):
+    return ctx.post(f"{ctx.share}/items/{ctx.file_id(i)}/rename", ctx.ds.grantee, json={"new_name": f"bench shared {i}.txt"})
+
+
+@scenario("share_copy_file", setup=lambda ctx, i: ctx.new_folder(i))
+def _(ctx, i, folder_id):
+    return ctx.post(f"{ctx.share}/items/{ctx.file_id(i)}/copy", ctx.ds.grantee, json={"new_parent_id": folder_id})
+
+
+@scenario("share_batch_copy_10", setup=lambda ctx, i: ctx.new_folder(i))
+def _(ctx, i, folder_id):
+    ops = [{"op": "copy", "item_id": ctx.file_id(i + n), "new_parent_id": folder_id} for n in range(10)]
+    return ctx.post(f"{ctx.share}/items/batch", ctx.ds.grantee, json={"ops": ops})
+
+
+@scenario("share_delete", setup=lambda ctx, i: ctx.new_folder(i))
+def _(ctx, i, folder_id):
+    return ctx.req("DELETE", f"{ctx.share}/items/{folder_id}", ctx.ds.grantee)
+
+
+@scenario("share_batch_delete_10", setup=lambda ctx, i: [ctx.new_folder(i) for _ in range(10)])
+def _(ctx, i, ids):
+    body = {"ops": [{"op": "delete", "item_id": item_id} for item_id in ids]}
+    return ctx.post(f"{ctx.share}/items/batch", ctx.ds.grantee, json=body)
+
+
+@scenario("share_upload_multipart")
+def _(ctx, i, _p):
+    files = {"file": (f"bench shared upload {i}.bin", CHUNK, "application/octet-stream")}
+    return ctx.post(f"{ctx.share}/upload", ctx.ds.grantee, params={"folder_id": ctx.leaf_id(i)}, files=files)
+
+
+@scenario("share_upload_init")
+def _(ctx, i, _p):
+    body = {"folder_id": ctx.ds.bulk_root_id, "name": "bench shared chunked.bin"}
+    return ctx.post(f"{ctx.share}/uploads", ctx.ds.grantee, json=body)
+
+
+def share_upload(ctx: Ctx, i: int) -> str:
+    body = {"folder_id": ctx.ds.bulk_root_id, "name": "bench shared chunked.bin", "size": len(CHUNK)}
+    return ctx.checked(ctx.post(f"{ctx.share}/uploads", ctx.ds.grantee, json=body)).json()["upload_id"]
+
+
+def share_staged_upload(ctx: Ctx, i: int) -> str:
+    upload_id = share_upload(ctx, i)
+    res = ctx.req("PUT", f"{ctx.share}/uploads/{upload_id}", ctx.ds.grantee, params={"offset": 0}, content=CHUNK)
+    ctx.checked(res)
+    return upload_id
+
+
+@scenario("share_upload_progress", setup=share_upload)
+def _(ctx, i, upload_id):
+    return ctx.get(f"{ctx.share}/uploads/{upload_id}", ctx.ds.grantee)
+
+
+@scenario("share_upload_chunk", setup=share_upload)
+def _(ctx, i, upload_id):
+    return ctx.req("PUT", f"{ctx.share}/uploads/{upload_id}", ctx.ds.grantee, params={"offset": 0}, content=CHUNK)
+
+
+@scenario("share_upload_commit", setup=share_staged_upload)
+def _(ctx, i, upload_id):
+    return ctx.post(f"{ctx.share}/uploads/{upload_id}/commit", ctx.ds.grantee)
+
+
+@scenario("share_upload_abort", setup=share_upload)
+def _(ctx, i, upload_id):
+    return ctx.req("DELETE", f"{ctx.share}/uploads/{upload_id}", ctx.ds.grantee)
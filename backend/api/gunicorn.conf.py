@@ -0,0 +1,35 @@
+"""
+Multi-process server: gunicorn supervising uvicorn workers.
+
+    gunicorn -c gunicorn.conf.py app.main:app
+
+EDUSHARE_WORKERS (or WEB_CONCURRENCY) sets the process count, PORT the port.
+Workers share nothing but the database: caches are kept coherent through
+app/cache_bus.py, and one worker at a time runs the background job and
+preview workers (main.claim_background_work).
+
+The app is imported in each worker, never in the master (no preload_app), so
+no pooled connection, thread or cache-bus origin is shared across a fork.
+"""
+import os
+
+from app import settings
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = max(1, settings.WORKERS)
+worker_class = "uvicorn.workers.UvicornWorker"
+# change streams hold their response open; heartbeats keep them under this
+timeout = int(os.getenv("EDUSHARE_WORKER_TIMEOUT", "120"))
+graceful_timeout = 30
+keepalive = 5
+accesslog = "-"
+
+
+def on_starting(server):
+    # refuse an unmigrated database once, here, rather than in every worker;
+    # the connection is closed before any fork
+    from app.db import engine
+    from app.migrations import require_schema
+
+    require_schema(engine)
+    engine.dispose()
@@ -1,6 +1,11 @@
 import uvicorn
 
+from app.db import engine
+from app.migrations import migrate
+
 if __name__ == "__main__":
+    # once, here: reloads only re-import the app, which checks the version
+    migrate(engine)
     uvicorn.run(
         "app.main:app",
         host="127.0.0.1",
@@ -1,2 +1,6 @@
 #!/bin/bash
-uvicorn app.main:app --host 0.0.0.0 --port ${PORT:-8000}
\ No newline at end of file
+set -e
+# schema changes happen here, once, not in the workers (see app/migrations.py)
+python -m app.maintenance migrate
+# EDUSHARE_WORKERS (or WEB_CONCURRENCY) worker processes, see gunicorn.conf.py
+exec gunicorn -c gunicorn.conf.py app.main:app
@@ -0,0 +1,31 @@
+"""
+The app reads its settings at import: point it at a scratch database and
+storage directory first, with the background workers off.
+"""
+import os
+import tempfile
+
+_scratch = tempfile.mkdtemp(prefix="edushare-tests-")
+os.environ.update({
+    "EDUSHARE_DATABASE_URL": f"sqlite:///{_scratch}/edushare.db",
+    "EDUSHARE_STORAGE_DIR": os.path.join(_scratch, "storage"),
+    "EDUSHARE_JOB_WORKER": "0",
+    "EDUSHARE_PREVIEW_WORKERS": "0",
+    "EDUSHARE_CACHE_BUS_POLL_SECONDS": "0",
+})
+
+import pytest  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app.db import engine  # noqa: E402
+from app.migrations import migrate  # noqa: E402
+
+migrate(engine, report=lambda line: None)
+
+from app.main import app  # noqa: E402
+
+
+@pytest.fixture
+def client():
+    with TestClient(app) as c:
+        yield c
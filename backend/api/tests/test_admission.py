@@ -0,0 +1,69 @@
+import anyio
+
+from app import settings
+from app.main import app
+
+OWNER = {"X-User": "alice"}
+
+
+def scope_for(path: str) -> dict:
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "server": ("testserver", 80),
+        "client": ("127.0.0.1", 1234),
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"host", b"testserver"), (b"x-user", b"alice")],
+    }
+
+
+def test_slow_download_does_not_hold_a_concurrency_slot(client, monkeypatch):
+    folder = client.post("/folders", json={"name": "lectures"}, headers=OWNER).json()["id"]
+    files = {"file": ("lecture.mp4", b"x" * (3 * 1024 * 1024), "video/mp4")}
+    file_id = client.post("/upload", params={"folder_id": folder}, files=files, headers=OWNER).json()["id"]
+    monkeypatch.setattr(settings, "ADMISSION_MAX_IN_FLIGHT", 1)
+
+    async def main():
+        started = anyio.Event()
+        finish = anyio.Event()
+        disconnected = anyio.Event()
+
+        async def receive():
+            if not started.is_set():
+                return {"type": "http.request", "body": b"", "more_body": False}
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        async def slow_send(message):
+            # a client that has the headers and then reads nothing for a while
+            if message["type"] == "http.response.start":
+                assert message["status"] == 200
+                started.set()
+            else:
+                await finish.wait()
+
+        statuses = []
+
+        async def listing_send(message):
+            if message["type"] == "http.response.start":
+                statuses.append(message["status"])
+
+        async def listing_receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        with anyio.fail_after(30):
+            async with anyio.create_task_group() as tg:
+                tg.start_soon(app, scope_for(f"/download/{file_id}"), receive, slow_send)
+                await started.wait()
+                await app(scope_for(f"/folders/{folder}/children"), listing_receive, listing_send)
+                finish.set()
+                disconnected.set()
+        return statuses
+
+    assert anyio.run(main) == [200]
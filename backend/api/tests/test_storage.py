@@ -0,0 +1,29 @@
+import pytest
+
+from app.storage import LocalStorage, StorageBackend
+
+
+def test_incomplete_backend_fails_at_construction():
+    class NoDelete(StorageBackend):
+        def put(self, digest, staged_path):
+            return digest
+
+        def put_derived(self, digest, suffix, staged_path):
+            return digest + suffix
+
+        def open(self, key):
+            raise FileNotFoundError(key)
+
+        def size(self, key):
+            return 0
+
+        def exists(self, key):
+            return False
+
+    with pytest.raises(TypeError, match="delete"):
+        NoDelete()
+
+
+def test_local_storage_is_complete(tmp_path):
+    storage = LocalStorage(str(tmp_path))
+    assert not storage.exists(storage.key_for("0" * 64))
@@ -117,7 +117,7 @@
       delete opts.json;
     }
 
-    const res = await fetch(API_BASE + path, { ...opts, headers });
+    const res = await fetchAdmitted(API_BASE + path, { ...opts, headers });
 
     if (!res.ok) {
       let msg = `${res.status} ${res.statusText}`;
@@ -133,6 +133,68 @@
     return res.text();
   }
 
+  // Listings are paginated server-side: the first page renders at once, the
+  // rest load as the list is scrolled (X-Next-Cursor). Sorting by these keys
+  // and the filter box (a name prefix) are done by the server.
+  const SERVER_SORT_KEYS = { name: "name", modified: "modified_at" };
+
+  // Each listing page is kept with its ETag; refreshing an unchanged folder
+  // only costs a 304 per page.
+  const listingCache = new Map(); // "user url" -> { etag, items, next }
+
+  // A 429/503 means the API turned the request away before doing anything:
+  // wait as long as its Retry-After says, then try again (a few times).
+  async function fetchAdmitted(url, opts = {}) {
+    for (let attempt = 0; ; attempt++) {
+      const res = await fetch(url, opts);
+      if ((res.status !== 429 && res.status !== 503) || attempt >= 3) return res;
+      const wait = Number(res.headers.get("Retry-After")) || 1;
+      await new Promise((resolve) => setTimeout(resolve, Math.min(wait, 10) * 1000));
+    }
+  }
+
+  // One page of a listing: { items, next } (next: the cursor of the page after it, or null).
+  async function apiFetchPage(path, cursor) {
+    const u = getUser();
+    if (!u) throw new Error("Not logged in");
+
+    const params = new URLSearchParams();
+    const serverSort = SERVER_SORT_KEYS[state.sortKey];
+    if (serverSort) {
+      params.set("sort", serverSort);
+      params.set("order", state.sortDir);
+    }
+    const prefix = searchInput ? searchInput.value.trim() : "";
+    if (prefix) params.set("prefix", prefix);
+    if (cursor) params.set("cursor", cursor);
+
+    const sep = path.includes("?") ? "&" : "?";
+    const url = API_BASE + path + sep + params.toString();
+    const key = `${u} ${url}`;
+    const cached = listingCache.get(key);
+    const headers = { "X-User": u };
+    if (cached) headers["If-None-Match"] = cached.etag;
+
+    const res = await fetchAdmitted(url, { headers, cache: "no-store" });
+
+    if (res.status === 304 && cached) return { items: cached.items, next: cached.next };
+
+    if (!res.ok) {
+      let msg = `${res.status} ${res.statusText}`;
+      try {
+        const data = await res.json();
+        msg = data.detail || JSON.stringify(data);
+      } catch {}
+      throw new Error(msg);
+    }
+
+    const items = await res.json();
+    const next = res.headers.get("X-Next-Cursor");
+    const etag = res.headers.get("ETag");
+    if (etag) listingCache.set(key, { etag, items, next });
+    return { items, next };
+  }
+
   async function apiFetchBlob(path, opts = {}) {
     const u = getUser();
     if (!u) throw new Error("Not logged in");
@@ -140,7 +202,7 @@
     const headers = new Headers(opts.headers || {});
     headers.set("X-User", u);
 
-    const res = await fetch(API_BASE + path, { ...opts, headers });
+    const res = await fetchAdmitted(API_BASE + path, { ...opts, headers });
 
     if (!res.ok) {
       let msg = `${res.status} ${res.statusText}`;
@@ -220,6 +282,7 @@
   const state = {
     user: getUser(),
     rootId: "root",
+    sharedId: "shared", // pseudo-folder: top items other users granted us
     currentFolderId: "root",
     selectedIds: [],
     sortKey: "name",
@@ -228,6 +291,13 @@
     shareRole: null, // "viewer" | "editor"
     shareRootItem: null, // ItemOut
     items: [],
+    // the listing shown: its API path (null for a file share link), the
+    // cursor of its next page, and how many pages are loaded
+    listPath: null,
+    nextCursor: null,
+    pagesLoaded: 0,
+    listGen: 0, // bumped by every reload, so late pages of an old listing are dropped
+    loadingMore: false,
   };
 
   function saveUiState() {
@@ -305,43 +375,143 @@
     }
   }
 
-  async function refreshCurrentFolder() {
+  function currentListPath() {
+    if (state.shareToken && state.shareRootItem?.type === "file") return null;
+    if (state.shareToken && state.shareRootItem?.type === "folder") {
+      return `/s/${encodeURIComponent(state.shareToken)}/children?folder_id=${encodeURIComponent(state.currentFolderId)}`;
+    }
+    if (state.currentFolderId === state.rootId) return `/root`;
+    if (state.currentFolderId === state.sharedId) return `/shared-with-me`;
+    return `/folders/${encodeURIComponent(state.currentFolderId)}/children`;
+  }
+
+  // Reload the listing from its first page. keepPages: as many pages as were
+  // loaded (live updates shouldn't shrink what the user scrolled through).
+  async function refreshCurrentFolder({ keepPages = false } = {}) {
     state.user = getUser();
     await refreshProfileName();
     state.selectedIds = [];
 
-    if (state.shareToken) {
-      // If share link is to a folder:
-      if (state.shareRootItem?.type === "folder") {
-        const kids = await apiFetch(
-          `/s/${encodeURIComponent(state.shareToken)}/children?folder_id=${encodeURIComponent(state.currentFolderId)}`
-        );
-        state.items = kids.map(mapItemFromApi);
-        render();
-        updateBackButton(); // ✅
-        return;
-      }
+    const gen = ++state.listGen;
+    const path = currentListPath();
+    if (path === null) {
+      // share link to a file: show a single "virtual" file row
+      state.listPath = null;
+      state.nextCursor = null;
+      state.pagesLoaded = 0;
+      state.items = state.shareRootItem ? [mapItemFromApi(state.shareRootItem)] : [];
+      render();
+      updateBackButton(); // ✅
+      return;
+    }
 
-      // If share link is to a file: show a single "virtual" file row
-      if (state.shareRootItem?.type === "file") {
-        state.items = [mapItemFromApi(state.shareRootItem)];
-        render();
-        updateBackButton(); // ✅
-        return;
-      }
+    const wanted = keepPages ? Math.max(state.pagesLoaded, 1) : 1;
+    let items = [];
+    let cursor = null;
+    let pages = 0;
+    do {
+      const page = await apiFetchPage(path, cursor);
+      if (gen !== state.listGen) return; // superseded by a newer reload
+      items = items.concat(page.items.map(mapItemFromApi));
+      cursor = page.next;
+      pages++;
+    } while (cursor && pages < wanted);
+
+    state.listPath = path;
+    state.items = items;
+    state.nextCursor = cursor;
+    state.pagesLoaded = pages;
+    render();
+    updateBackButton(); // ✅
+  }
+
+  async function loadMore() {
+    if (!state.nextCursor || state.loadingMore) return;
+    const gen = state.listGen;
+    state.loadingMore = true;
+    try {
+      const page = await apiFetchPage(state.listPath, state.nextCursor);
+      if (gen !== state.listGen) return;
+      state.items = state.items.concat(page.items.map(mapItemFromApi));
+      state.nextCursor = page.next;
+      state.pagesLoaded++;
+    } finally {
+      state.loadingMore = false;
     }
+    render();
+  }
 
-    // normal mode
-    if (state.currentFolderId === state.rootId) {
-      const rootItems = await apiFetch(`/root`);
-      state.items = rootItems.map(mapItemFromApi);
-    } else {
-      const kids = await apiFetch(`/folders/${encodeURIComponent(state.currentFolderId)}/children`);
-      state.items = kids.map(mapItemFromApi);
+  // near the bottom of the list: fetch the next page
+  function maybeLoadMore() {
+    if (!state.nextCursor || !tableBody) return;
+    if (tableBody.scrollTop + tableBody.clientHeight >= tableBody.scrollHeight - 200) {
+      loadMore().catch((e) => alert(e.message));
     }
+  }
 
-    render();
-    updateBackButton(); // ✅
+
+  // ---------------- LIVE UPDATES ----------------
+  // Server-sent change feed. fetch() instead of EventSource because the API
+  // needs the X-User header; reconnects resume from the last change seen.
+  let lastChangeId = null;
+  let refreshTimer = null;
+
+  function changeTouchesCurrentFolder(change) {
+    const cur = state.currentFolderId;
+    const parent = change.parent_id == null ? state.rootId : String(change.parent_id);
+    const oldParent = change.old_parent_id == null ? state.rootId : String(change.old_parent_id);
+    return parent === cur || (change.kind === "move" && oldParent === cur) || String(change.item_id) === cur;
+  }
+
+  function onChange(change) {
+    if (!changeTouchesCurrentFolder(change)) return;
+    clearTimeout(refreshTimer);
+    refreshTimer = setTimeout(() => refreshCurrentFolder({ keepPages: true }).catch(() => {}), 300);
+  }
+
+  async function watchChanges() {
+    const base = state.shareToken ? `/s/${encodeURIComponent(state.shareToken)}/changes/stream` : "/changes/stream";
+    let delay = 1000;
+
+    for (;;) {
+      const u = getUser();
+      if (!u) return;
+      try {
+        const headers = { "X-User": u };
+        if (lastChangeId != null) headers["Last-Event-ID"] = String(lastChangeId);
+        const res = await fetchAdmitted(API_BASE + base, { headers, cache: "no-store" });
+        if (!res.ok || !res.body) throw new Error(`${res.status}`);
+        delay = 1000;
+
+        const reader = res.body.pipeThrough(new TextDecoderStream()).getReader();
+        let buf = "";
+        for (;;) {
+          const { value, done } = await reader.read();
+          if (done) break;
+          buf += value;
+          let end;
+          while ((end = buf.indexOf("\n\n")) >= 0) {
+            const block = buf.slice(0, end);
+            buf = buf.slice(end + 2);
+            let name = "message";
+            let data = "";
+            for (const line of block.split("\n")) {
+              if (line.startsWith("id: ")) lastChangeId = Number(line.slice(4));
+              else if (line.startsWith("event: ")) name = line.slice(7);
+              else if (line.startsWith("data: ")) data += line.slice(6);
+            }
+            if (name === "change") onChange(JSON.parse(data));
+            else if (name === "error") {
+              // expired cursor: start over from "now" after a full reload
+              lastChangeId = null;
+              await refreshCurrentFolder().catch(() => {});
+            }
+          }
+        }
+      } catch {}
+      await new Promise((r) => setTimeout(r, delay));
+      delay = Math.min(delay * 2, 30000);
+    }
   }
 
 
@@ -386,22 +556,27 @@
     // normal breadcrumb
     const parts = [{ id: state.rootId, name: "Public Folder" }];
     const cur = findItem(state.currentFolderId);
-    if (cur && cur.type === "folder") parts.push({ id: cur.id, name: cur.name });
+    if (state.currentFolderId === state.sharedId) parts.push({ id: state.sharedId, name: "Shared with me" });
+    else if (cur && cur.type === "folder") parts.push({ id: cur.id, name: cur.name });
 
-    breadcrumbEl.innerHTML = parts
-      .map((p, idx) => {
-        const isLast = idx === parts.length - 1;
-        if (isLast) return escapeHtml(p.name);
-        return `<a class="crumb" href="#" data-id="${escapeHtml(p.id)}">${escapeHtml(p.name)}</a> &gt; `;
-      })
-      .join("");
+    breadcrumbEl.innerHTML =
+      parts
+        .map((p, idx) => {
+          const isLast = idx === parts.length - 1;
+          if (isLast) return escapeHtml(p.name);
+          return `<a class="crumb" href="#" data-id="${escapeHtml(p.id)}">${escapeHtml(p.name)}</a> &gt; `;
+        })
+        .join("") +
+      (state.currentFolderId === state.rootId
+        ? ` &middot; <a class="crumb" href="#" data-id="${state.sharedId}">Shared with me</a>`
+        : "");
 
     Array.from(breadcrumbEl.querySelectorAll(".crumb")).forEach((a) => {
       a.addEventListener("click", async (e) => {
         e.preventDefault();
         const id = a.getAttribute("data-id");
         if (!id) return;
-        if (id === state.rootId) navStack.length = 0;
+        if (id === state.rootId || id === state.sharedId) navStack.length = 0;
         state.currentFolderId = id;
         state.selectedIds = [];
         saveUiState();
@@ -412,8 +587,13 @@
 
   // ---------------- LIST / SORT ----------------
   function getVisibleItems() {
+    // listings come filtered by the server; only a file share's single row doesn't
     const q = (searchInput ? searchInput.value : "").trim().toLowerCase();
-    const filtered = q ? state.items.filter((x) => x.name.toLowerCase().includes(q)) : state.items;
+    const filtered =
+      q && state.listPath === null ? state.items.filter((x) => x.name.toLowerCase().startsWith(q)) : state.items;
+
+    // already in server order (the loaded pages of it, for other keys)
+    if (SERVER_SORT_KEYS[state.sortKey]) return filtered;
 
     return filtered.slice().sort((a, b) => {
       const av = (a[state.sortKey] || "").toString().toLowerCase();
@@ -572,39 +752,61 @@
     const ok = confirm(`Delete ${sel.length} item(s)?`);
     if (!ok) return;
 
-    for (const item of sel) {
-      if (state.shareToken) {
-        await apiFetch(`/s/${encodeURIComponent(state.shareToken)}/items/${encodeURIComponent(item.id)}`, {
-          method: "DELETE",
-        });
-      } else {
-        await apiFetch(`/items/${encodeURIComponent(item.id)}`, { method: "DELETE" });
+    // one request and one transaction for the whole selection
+    const path = state.shareToken ? `/s/${encodeURIComponent(state.shareToken)}/items/batch` : "/items/batch";
+    const data = await apiFetch(path, {
+      method: "POST",
+      json: { ops: sel.map((item) => ({ op: "delete", item_id: item.id })) },
+    });
+
+    const failed = data.results.filter((r) => !r.ok);
+    if (failed.length) alert(`${failed.length} item(s) could not be deleted: ${failed[0].detail}`);
+
+    await refreshCurrentFolder();
+  }
+
+  // Resumable upload: init -> PUT chunks -> commit. A failed chunk is retried
+  // from whatever offset the server reports, so a dropped connection only
+  // costs the chunk that was in flight.
+  const UPLOAD_RETRIES = 5;
+
+  async function uploadFileChunked(f) {
+    const base = state.shareToken ? `/s/${encodeURIComponent(state.shareToken)}/uploads` : `/uploads`;
+    const init = await apiFetch(base, {
+      method: "POST",
+      json: { folder_id: Number(state.currentFolderId), name: f.name, size: f.size, mime_type: f.type || null },
+    });
+    const uploadPath = `${base}/${encodeURIComponent(init.upload_id)}`;
+
+    let offset = init.offset;
+    let failures = 0;
+    while (offset < f.size) {
+      const end = Math.min(offset + init.chunk_size, f.size);
+      try {
+        const res = await apiFetch(`${uploadPath}?offset=${offset}`, { method: "PUT", body: f.slice(offset, end) });
+        offset = res.offset;
+        failures = 0;
+      } catch (e) {
+        failures += 1;
+        if (failures > UPLOAD_RETRIES) throw e;
+        await new Promise((r) => setTimeout(r, 1000 * failures));
+        offset = (await apiFetch(uploadPath)).offset;
       }
     }
 
-    await refreshCurrentFolder();
+    return apiFetch(`${uploadPath}/commit`, { method: "POST" });
   }
 
   async function uploadFilesIntoCurrentFolder(fileList) {
     const files = Array.from(fileList || []);
     if (files.length === 0) return;
+    if (state.currentFolderId === state.sharedId) {
+      alert("Open one of the shared folders to upload into it.");
+      return;
+    }
 
     for (const f of files) {
-      const form = new FormData();
-      form.append("file", f);
-
-      if (state.shareToken) {
-        // share upload endpoint
-        await apiFetch(`/s/${encodeURIComponent(state.shareToken)}/upload?folder_id=${encodeURIComponent(state.currentFolderId)}`, {
-          method: "POST",
-          body: form,
-        });
-      } else {
-        await apiFetch(`/upload?folder_id=${encodeURIComponent(state.currentFolderId)}`, {
-          method: "POST",
-          body: form,
-        });
-      }
+      await uploadFileChunked(f);
     }
 
     await refreshCurrentFolder();
@@ -637,6 +839,56 @@
     return `/download/${encodeURIComponent(item.id)}`;
   }
 
+  // ---------------- THUMBNAILS ----------------
+  // Rendered in the background after upload; 202 means "not yet, retry".
+  const thumbUrls = new Map(); // item id -> object URL
+  const thumbPending = new Set();
+
+  function hasThumbnail(item) {
+    const mime = (item.mime || "").toLowerCase();
+    return item.type === "file" && ((mime.startsWith("image/") && mime !== "image/svg+xml") || mime === "application/pdf");
+  }
+
+  function thumbnailPathForItem(item) {
+    if (state.shareToken) {
+      return `/s/${encodeURIComponent(state.shareToken)}/items/${encodeURIComponent(item.id)}/thumbnail`;
+    }
+    return `/items/${encodeURIComponent(item.id)}/thumbnail`;
+  }
+
+  async function loadThumbnail(item) {
+    const u = getUser();
+    if (!u || thumbPending.has(item.id)) return;
+    thumbPending.add(item.id);
+    let retryMs = 0;
+    try {
+      const res = await fetch(API_BASE + thumbnailPathForItem(item), { headers: { "X-User": u } });
+      if (res.status === 202) {
+        retryMs = (Number(res.headers.get("Retry-After")) || 2) * 1000;
+      } else if (res.ok) {
+        const url = URL.createObjectURL(await res.blob());
+        thumbUrls.set(item.id, url);
+        const img = tableBody.querySelector(`.row[data-id="${CSS.escape(item.id)}"] img.icon`);
+        if (img) img.src = url;
+      } else {
+        thumbUrls.set(item.id, null); // no preview for this file
+      }
+    } catch {
+      // keep the generic icon
+    } finally {
+      thumbPending.delete(item.id);
+    }
+    if (retryMs) {
+      setTimeout(() => {
+        if (findItem(item.id)) loadThumbnail(item);
+      }, retryMs);
+    }
+  }
+
+  function loadThumbnails(items) {
+    items.filter((x) => hasThumbnail(x) && !thumbUrls.has(x.id)).forEach((x) => loadThumbnail(x));
+  }
+
   async function downloadItem(item) {
     const { blob } = await apiFetchBlob(downloadPathForItem(item));
     const url = URL.createObjectURL(blob);
@@ -757,7 +1009,7 @@
     tableBody.innerHTML = visible
       .map((item) => {
         const rowClass = isSelected(item.id) ? "row selected" : "row";
-        const iconSrc = item.type === "folder" ? "icons/folder.svg" : "icons/file.svg";
+        const iconSrc = item.type === "folder" ? "icons/folder.svg" : thumbUrls.get(item.id) || "icons/file.svg";
         return `
         <div class="${rowClass}" data-id="${escapeHtml(item.id)}" data-type="${escapeHtml(item.type)}">
           <div class="col col-check"><span class="select-box"></span></div>
@@ -766,7 +1018,10 @@
           <div class="col col-by">${escapeHtml(item.by || "")}</div>
         </div>`;
       })
-      .join("");
+      .join("") + (state.nextCursor ? `<div class="load-more">Load more</div>` : "");
+
+    const more = tableBody.querySelector(".load-more");
+    if (more) more.addEventListener("click", () => loadMore().catch((e) => alert(e.message)));
 
     Array.from(tableBody.querySelectorAll(".row")).forEach((row) => {
       row.addEventListener("click", () => {
@@ -810,6 +1065,7 @@
       });
     });
 
+    loadThumbnails(visible);
     updateActionButtons();
   }
 
@@ -826,7 +1082,11 @@
           state.sortDir = "asc";
         }
         saveUiState();
-        render();
+        if (SERVER_SORT_KEYS[key] && !(state.shareToken && state.shareRootItem?.type === "file")) {
+          refreshCurrentFolder().catch((e) => alert(e.message));
+        } else {
+          render();
+        }
       });
     });
   }
@@ -882,6 +1142,11 @@
       const shareReadOnly = state.shareToken && state.shareRole !== "editor";
       if (shareReadOnly) return;
 
+      if (state.currentFolderId === state.sharedId) {
+        alert("Open one of the shared folders to create a folder in it.");
+        return;
+      }
+
       const name = prompt("Folder name:");
       if (!name || !name.trim()) return;
 
@@ -968,12 +1233,18 @@
       });
   }
 
+  // the filter is a name prefix the server applies: reload once typing pauses
+  let searchTimer = null;
   if (searchInput)
     searchInput.addEventListener("input", () => {
       closeCtx();
-      render();
+      if (state.listPath === null) return render();
+      clearTimeout(searchTimer);
+      searchTimer = setTimeout(() => refreshCurrentFolder().catch((e) => alert(e.message)), 250);
     });
 
+  if (tableBody) tableBody.addEventListener("scroll", maybeLoadMore);
+
   // ---------------- INIT ----------------
   loadUiState();
   applyShareFromUrl();
@@ -988,6 +1259,7 @@
       wireButtons();
       wireSorting();
       await refreshCurrentFolder();
+      watchChanges();
     } catch (e) {
       alert("Failed to load from API: " + e.message);
     }